@@ -0,0 +1,394 @@
+"""
+Asynchronous license plate recognition (ANPR) for the Car Parking System.
+
+Recognizing a plate in a camera frame is CPU-heavy, so it does not happen in
+the request. /api/simulate-license-detection only submits the frame and
+returns a job id; the outcome is polled, or waited for, at
+/api/simulate-license-detection/<job_id>.
+
+    submit -> bounded queue -> dispatcher -> process pool (recognizer)
+                                                    |
+    job outcome <- resolver thread (plate lookup, slot) <-
+
+The queue holds ANPR_QUEUE_SIZE frames and at most IN_FLIGHT_PER_WORKER
+frames per pool process are being recognized at once. When the queue is
+full submit raises PipelineFull and the endpoint answers 503 with
+Retry-After, so a burst from the cameras is shed instead of piling up.
+
+A car waiting at the barrier is read many times. Reads of the same plate at
+the same location within ANPR_DEDUP_SECONDS are folded into the first
+successful job while its slot is still free, so the car is sent to one
+slot: identical frames are matched by digest when they are submitted, other
+frames once they are recognized.
+Reads that already carry the plate text skip the pool and are resolved in
+the request, as fast as before.
+
+The recognizer is a picklable function frame_bytes -> (plate, confidence)
+or None, named 'module:function' by ANPR_RECOGNIZER and called with the
+keyword arguments in ANPR_RECOGNIZER_OPTIONS. The default stub reads the
+plate text from the frame bytes after spending about work_ms of CPU.
+
+Jobs are kept by the worker process that accepted them, like the occupancy
+index, and every worker has one pool for all facilities; a job is resolved,
+and folded with other reads, within the facility it was submitted for. With several gunicorn workers
+pass wait= when submitting rather than polling another worker.
+"""
+import functools
+import hashlib
+import importlib
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from extensions import db
+from facilities import current_facility, use_facility
+from models import normalize_plate
+from occupancy import occupancy_index
+from plates import plate_lookup
+from reservations import reservation_index
+from utils import pick_available_slot
+
+logger = logging.getLogger(__name__)
+
+ANPR_WORKERS = 2
+ANPR_QUEUE_SIZE = 64
+ANPR_DEDUP_SECONDS = 30
+ANPR_RECOGNIZER = 'anpr:stub_recognizer'
+IN_FLIGHT_PER_WORKER = 2
+JOB_TTL = 300
+MAX_JOBS = 10000
+# Loop iterations of the stub recognizer per millisecond of CPU, roughly
+STUB_ITERATIONS_PER_MS = 10000
+MAX_FRAME_BYTES = 4 * 1024 * 1024
+MAX_DETECTION_WAIT = 30
+# How long a repeated read waits for the first read of the car to finish
+DUPLICATE_WAIT = 5
+
+
+class PipelineFull(Exception):
+    """The frame queue is full; the camera should retry later"""
+
+
+def stub_recognizer(frame, work_ms=50):
+    """Stand-in for a real recognizer: the frame bytes are the plate text.
+
+    Spends roughly work_ms of CPU in pure Python first, holding the GIL the
+    way inference would in the request thread.
+    """
+    total = 0
+    for i in range(int(work_ms * STUB_ITERATIONS_PER_MS)):
+        total += i * i
+    plate = frame.decode('utf-8', 'replace').strip()
+    return (plate, 0.99) if plate else None
+
+
+def load_recognizer(name, options=None):
+    module_name, _, function_name = name.partition(':')
+    recognizer = getattr(importlib.import_module(module_name), function_name)
+    return functools.partial(recognizer, **options) if options else recognizer
+
+
+def resolve_detection(license_plate, parking_type, vip=False, fuzzy=False):
+    """Find the vehicle for a plate read and the slot to send it to.
+
+    Returns (payload, status_code) as the detection endpoint answers them.
+    """
+    vehicle = plate_lookup.lookup(license_plate, fuzzy=fuzzy)
+
+    if not vehicle:
+        return {
+            'success': False,
+            'message': f'Vehicle with license plate {license_plate} not found in system'
+        }, 404
+
+    # Send the vehicle to its booked slot if it has a reservation starting about now
+    occupancy_index.sync()
+    reservation_index.sync()
+    booking = reservation_index.for_vehicle(vehicle.id, datetime.utcnow())
+    if booking and not occupancy_index.is_occupied(booking.slot_id):
+        selected_slot = occupancy_index.get(booking.slot_id)
+    else:
+        # Assign a slot with the configured strategy, avoiding upcoming reservations
+        booking = None
+        selected_slot = pick_available_slot(parking_type.lower(), vip=vip)
+
+    if not selected_slot:
+        return {
+            'success': False,
+            'message': f'No available {parking_type} parking slots'
+        }, 400
+
+    return {
+        'success': True,
+        'message': f'License plate {license_plate} detected',
+        'vehicle_id': vehicle.id,
+        'vehicle_info': {
+            'license_plate': vehicle.license_plate,
+            'make': vehicle.make,
+            'model': vehicle.model,
+            'color': vehicle.color
+        },
+        'slot_id': selected_slot.id,
+        'slot_number': selected_slot.slot_number,
+        'slot_area': selected_slot.area,
+        'reservation_id': booking.id if booking else None
+    }, 200
+
+
+class DetectionJob:
+    """One plate read or camera frame and, once resolved, its outcome"""
+
+    def __init__(self, user_id, parking_type, vip, fuzzy, plate=None, frame=None):
+        self.id = uuid.uuid4().hex
+        self.user_ids = {user_id}
+        self.parking_type = parking_type
+        self.vip = vip
+        self.fuzzy = fuzzy
+        self.plate = plate
+        self.frame = frame
+        self.status = 'queued'
+        self.result = None
+        self.status_code = None
+        self.duplicate_of = None
+        self.slot_taken = False
+        self.facility = current_facility()
+        self.submitted_at = time.monotonic()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    @property
+    def succeeded(self):
+        return self.status == 'done'
+
+    def to_dict(self):
+        data = {'job_id': self.id, 'status': self.status, 'duplicate_of': self.duplicate_of}
+        if self.finished:
+            data.update(self.result)
+        else:
+            data.update(success=True, message='Frame queued for recognition')
+        return data
+
+
+class DetectionPipeline:
+    """Bounded queue of frames, recognized by a process pool"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._recent = OrderedDict()
+        self._by_slot = {}
+        self._executor = None
+        self._app = None
+        self.stats = Counter()
+        self.workers = ANPR_WORKERS
+        self.queue_size = ANPR_QUEUE_SIZE
+        self.dedup_seconds = ANPR_DEDUP_SECONDS
+        self.recognizer = stub_recognizer
+
+    def init_app(self, app):
+        """Read the ANPR_* settings; the pool starts with the first frame"""
+        app.config.setdefault('ANPR_WORKERS', ANPR_WORKERS)
+        app.config.setdefault('ANPR_QUEUE_SIZE', ANPR_QUEUE_SIZE)
+        app.config.setdefault('ANPR_DEDUP_SECONDS', ANPR_DEDUP_SECONDS)
+        app.config.setdefault('ANPR_RECOGNIZER', ANPR_RECOGNIZER)
+        app.config.setdefault('ANPR_RECOGNIZER_OPTIONS', {})
+        self._app = app
+        self.dedup_seconds = app.config['ANPR_DEDUP_SECONDS']
+        if self._executor is None:
+            self.workers = app.config['ANPR_WORKERS']
+            self.queue_size = app.config['ANPR_QUEUE_SIZE']
+            self.recognizer = load_recognizer(app.config['ANPR_RECOGNIZER'],
+                                              app.config['ANPR_RECOGNIZER_OPTIONS'])
+
+    def start(self):
+        with self._start_lock:
+            if self._executor is not None:
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._recognized = queue.Queue()
+            self._in_flight = threading.BoundedSemaphore(self.workers * IN_FLIGHT_PER_WORKER)
+            # Forking a process that already runs threads can deadlock the children
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            threading.Thread(target=self._dispatch, name='anpr-dispatch', daemon=True).start()
+            threading.Thread(target=self._resolve_recognized, name='anpr-resolve', daemon=True).start()
+
+    def shutdown(self):
+        with self._start_lock:
+            if self._executor is None:
+                return
+            self._queue.put(None)
+            self._executor.shutdown(wait=True)
+            self._recognized.put(None)
+            self._executor = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._executor is not None else 0
+
+    def submit_plate(self, license_plate, parking_type, user_id, vip=False, fuzzy=False):
+        """Resolve a read that already carries the plate text.
+
+        Must be called with an app context. Returns (job, duplicate).
+        """
+        key = (current_facility(), parking_type.lower(), normalize_plate(license_plate))
+        with self._condition:
+            earlier = self._earlier(key)
+            if earlier is not None:
+                earlier.user_ids.add(user_id)
+                return earlier, True
+            job = self._add(DetectionJob(user_id, parking_type, vip, fuzzy, plate=license_plate), key)
+        self._resolve(job)
+        return job, False
+
+    def submit_frame(self, frame, parking_type, user_id, vip=False, fuzzy=False):
+        """Queue a camera frame for recognition. Returns (job, duplicate)."""
+        self.start()
+        key = (current_facility(), parking_type.lower(),
+               'frame:' + hashlib.blake2b(frame, digest_size=16).hexdigest())
+        with self._condition:
+            earlier = self._earlier(key)
+            if earlier is not None:
+                earlier.user_ids.add(user_id)
+                return earlier, True
+            job = DetectionJob(user_id, parking_type, vip, fuzzy, frame=frame)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.stats['rejected'] += 1
+                raise PipelineFull('Too many frames waiting for recognition, retry later') from None
+            return self._add(job, key), False
+
+    def get(self, job_id, user_id):
+        """The job, if it is still kept and user_id submitted it"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return job if job is not None and user_id in job.user_ids else None
+
+    def wait(self, job, timeout):
+        """Block until the job is finished or the timeout passes"""
+        with self._condition:
+            return self._condition.wait_for(lambda: job.finished, timeout)
+
+    def _add(self, job, key):
+        # Called with the condition held
+        now = time.monotonic()
+        self._prune(now)
+        self._jobs[job.id] = job
+        self._recent.pop(key, None)
+        self._recent[key] = (job, now)
+        self.stats['submitted'] += 1
+        return job
+
+    def _earlier(self, key):
+        # Called with the condition held: a job for the same car still in the window
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        job, seen_at = entry
+        if time.monotonic() - seen_at > self.dedup_seconds or (job.finished and not job.succeeded):
+            return None
+        # Once the slot has been taken, by this car or another, read the car afresh
+        if job.succeeded and (job.slot_taken or
+                              occupancy_index.for_facility(job.facility).is_occupied(job.result['slot_id'])):
+            return None
+        self.stats['duplicates'] += 1
+        return job
+
+    def _prune(self, now):
+        while self._recent:
+            _, (_, seen_at) = next(iter(self._recent.items()))
+            if now - seen_at <= self.dedup_seconds:
+                break
+            self._recent.popitem(last=False)
+        while self._jobs:
+            oldest = next(iter(self._jobs.values()))
+            if now - oldest.submitted_at <= JOB_TTL and len(self._jobs) < MAX_JOBS:
+                break
+            self._jobs.popitem(last=False)
+
+    def _dispatch(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            # Backpressure: frames stay in the bounded queue while the pool is busy
+            self._in_flight.acquire()
+            job.status = 'recognizing'
+            try:
+                future = self._executor.submit(self.recognizer, job.frame)
+            except RuntimeError:
+                self._in_flight.release()
+                self._finish(job, {'success': False, 'message': 'Recognition is shutting down'}, 503)
+                continue
+            future.add_done_callback(lambda future, job=job: self._recognized.put((job, future)))
+
+    def _resolve_recognized(self):
+        while True:
+            item = self._recognized.get()
+            if item is None:
+                return
+            job, future = item
+            self._in_flight.release()
+            job.frame = None
+            try:
+                read = future.result()
+            except Exception:
+                logger.exception('Plate recognition failed')
+                self._finish(job, {'success': False, 'message': 'Plate recognition failed'}, 500)
+                continue
+            if not read:
+                self._finish(job, {'success': False, 'message': 'No license plate recognized'}, 422)
+                continue
+
+            job.plate = read[0]
+            key = (job.facility, job.parking_type.lower(), normalize_plate(job.plate))
+            with self._condition:
+                earlier = self._earlier(key)
+                if earlier is None:
+                    self._recent.pop(key, None)
+                    self._recent[key] = (job, time.monotonic())
+            if earlier is not None and self.wait(earlier, DUPLICATE_WAIT) and earlier.succeeded:
+                job.duplicate_of = earlier.id
+                self._finish(job, earlier.result, earlier.status_code)
+                continue
+            with self._app.app_context(), use_facility(job.facility):
+                self._resolve(job)
+
+    def _resolve(self, job):
+        try:
+            payload, status_code = resolve_detection(job.plate, job.parking_type, job.vip, job.fuzzy)
+        except Exception:
+            logger.exception('Resolving plate %s failed', job.plate)
+            db.session.rollback()
+            payload, status_code = {'success': False, 'message': 'Plate detection failed'}, 500
+        self._finish(job, payload, status_code)
+
+    def _finish(self, job, payload, status_code):
+        with self._condition:
+            job.result = payload
+            job.status_code = status_code
+            job.status = 'done' if payload.get('success') else 'failed'
+            if job.succeeded:
+                self._by_slot[(job.facility, payload['slot_id'])] = job
+            self.stats[job.status] += 1
+            self._condition.notify_all()
+
+    def on_occupancy_change(self, slot, occupied):
+        if occupied:
+            with self._condition:
+                job = self._by_slot.pop((current_facility(), slot.id), None)
+                if job is not None:
+                    job.slot_taken = True
+
+
+anpr_pipeline = DetectionPipeline()
+occupancy_index.add_listener(anpr_pipeline.on_occupancy_change)
@@ -0,0 +1,561 @@
+import base64
+from datetime import datetime, time, timedelta, timezone
+from flask import Blueprint, current_app, request, jsonify, Response, stream_with_context
+from flask_login import login_required, current_user
+
+from anpr import anpr_pipeline, PipelineFull, DUPLICATE_WAIT, MAX_DETECTION_WAIT, MAX_FRAME_BYTES
+from extensions import db
+from facilities import current_facility, facility_registry
+from forecast import forecaster
+from models import ParkingSlot, ParkingRecord, Reservation
+from events import stream_slot_events
+from exit_tokens import exit_gate, InvalidExitToken, SettlementBacklog
+from exports import export_parking_records, EXPORT_FORMATS
+from gate_events import apply_gate_events, GateBatchConflict, MAX_BATCH_SIZE
+from history import get_history_page, record_to_dict, HISTORY_PAGE_SIZE
+from journal import gate_journal, JournalUnavailable
+from occupancy import occupancy_index, stage_occupancy_change
+from reservations import (reservation_index, book_slot, book_any_slot, cancel_reservation, reserved_for_others,
+                          validate_window, ReservationConflict)
+from rollups import get_occupancy_report, rollup_refresher
+from slot_cache import slot_list_cache
+from spatial import outdoor_spatial_index, estimate_walking_minutes
+from user_context import get_user_vehicle
+from utils import claim_slot, release_slot, close_parking_record
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+
+@api_bp.route('/facilities')
+@login_required
+def get_facilities():
+    return jsonify({
+        'facilities': [facility_registry.get(code).to_dict() for code in facility_registry.codes()],
+        'current': current_facility()
+    })
+
+
+@api_bp.route('/parking-history')
+@login_required
+def get_parking_history():
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+    
+    # archived=1 adds records moved to the archive (see archive.py)
+    archived = request.args.get('archived') in ('1', 'true')
+    records, next_cursor = get_history_page(current_user.id, request.args.get('before'), limit, archived)
+    
+    return jsonify({
+        'records': [record_to_dict(record) for record in records],
+        'next_cursor': next_cursor
+    })
+
+@api_bp.route('/parking-records/export')
+@login_required
+def export_records():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Format must be csv, parquet or arrow'}), 400
+    
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid start or end date'}), 400
+    
+    # Finance users (FINANCE_USERS config) export everyone's records, others only their own
+    user_id = None if current_user.username in current_app.config.get('FINANCE_USERS', ()) else current_user.id
+    
+    try:
+        chunks = export_parking_records(export_format, start, end, user_id)
+    except RuntimeError as error:
+        return jsonify({'success': False, 'message': str(error)}), 501
+    
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename=parking-records.{extension}',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@api_bp.route('/analytics/occupancy')
+@login_required
+def occupancy_analytics():
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in ('hour', 'day'):
+        return jsonify({'success': False, 'message': 'Granularity must be hour or day'}), 400
+    
+    try:
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow()
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=1)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid start or end date'}), 400
+    
+    return jsonify({
+        'success': True,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'granularity': granularity,
+        'rollups': get_occupancy_report(start, end, request.args.get('area'), granularity)
+    })
+
+@api_bp.route('/forecast')
+@login_required
+def availability_forecast():
+    # at is an ISO datetime (naive means UTC) or a local time of day such as 17:30, the next one
+    now = datetime.utcnow()
+    try:
+        at = _forecast_time(request.args.get('at'), now)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid forecast time'}), 400
+    
+    occupancy_index.sync()
+    forecaster.ensure_loaded()
+    if forecaster.trained_through is None:
+        return jsonify({'success': False, 'message': 'No forecast has been trained yet'}), 503
+    
+    area = request.args.get('area')
+    forecasts = [forecaster.forecast(name, at, now) for name in ([area] if area else forecaster.areas())]
+    if area and forecasts[0] is None:
+        return jsonify({'success': False, 'message': 'No forecast for this area'}), 404
+    
+    return jsonify({
+        'success': True,
+        'trained_through': forecaster.trained_through.isoformat(),
+        'forecasts': [forecast for forecast in forecasts if forecast is not None]
+    })
+
+def _forecast_time(value, now):
+    if not value:
+        return now
+    if 'T' not in value and ' ' not in value and ':' in value:
+        return forecaster.next_local_time(time.fromisoformat(value), now)
+    at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+@api_bp.route('/parking-slots')
+@login_required
+def get_parking_slots():
+    location = request.args.get('location', 'indoor')
+    since = request.args.get('since')
+    
+    # Served from the occupancy index; ?since=<version> returns only changed slots
+    occupancy_index.sync()
+    version, body = slot_list_cache.get_body(location, since)
+    
+    response = current_app.response_class(body, mimetype='application/json')
+    response.headers['X-Occupancy-Version'] = version
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if since is None:
+        response.set_etag(version)
+        response.make_conditional(request)
+    return response
+
+def _reservation_to_dict(reservation):
+    return {
+        'id': reservation.id,
+        'slot_id': reservation.slot_id,
+        'slot_number': reservation.slot.slot_number,
+        'area': reservation.slot.area,
+        'vehicle_id': reservation.vehicle_id,
+        'license_plate': reservation.vehicle.license_plate,
+        'start_time': reservation.start_time.isoformat(),
+        'end_time': reservation.end_time.isoformat(),
+        'status': reservation.status
+    }
+
+def _parse_window(data):
+    # Naive UTC times, like the rest of the API
+    start = datetime.fromisoformat(data['start'])
+    end = datetime.fromisoformat(data['end'])
+    validate_window(start, end)
+    return start, end
+
+@api_bp.route('/reservations/availability')
+@login_required
+def reservation_availability():
+    location = request.args.get('location', 'indoor')
+    
+    try:
+        start, end = _parse_window(request.args)
+    except (KeyError, ValueError) as error:
+        return jsonify({'success': False, 'message': f'Invalid start or end time: {error}'}), 400
+    
+    occupancy_index.sync()
+    reservation_index.sync()
+    slots = reservation_index.free_slots(location, start, end, request.args.get('area'))
+    
+    return jsonify({
+        'success': True,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'count': len(slots),
+        'slots': [{'id': slot.id, 'slot_number': slot.slot_number, 'area': slot.area} for slot in slots]
+    })
+
+@api_bp.route('/reservations')
+@login_required
+def list_reservations():
+    reservations = Reservation.query.filter(
+        Reservation.user_id == current_user.id,
+        Reservation.status == 'booked',
+        Reservation.end_time > datetime.utcnow()
+    ).order_by(Reservation.start_time).all()
+    
+    return jsonify({'reservations': [_reservation_to_dict(reservation) for reservation in reservations]})
+
+@api_bp.route('/reservations', methods=['POST'])
+@login_required
+def create_reservation():
+    data = request.get_json()
+    vehicle_id = data.get('vehicle_id')
+    slot_id = data.get('slot_id')
+    
+    try:
+        start, end = _parse_window(data)
+    except (KeyError, ValueError) as error:
+        return jsonify({'success': False, 'message': f'Invalid start or end time: {error}'}), 400
+    
+    # Check if vehicle exists and belongs to current user
+    vehicle = get_user_vehicle(current_user.id, vehicle_id)
+    if not vehicle:
+        return jsonify({'success': False, 'message': 'Vehicle not found'}), 404
+    
+    # Book the requested slot, or any free one of the location (and area)
+    occupancy_index.sync()
+    try:
+        if slot_id:
+            reservation = book_slot(current_user.id, vehicle.id, slot_id, start, end)
+        else:
+            reservation = book_any_slot(current_user.id, vehicle.id, data.get('location', 'indoor'),
+                                        start, end, data.get('area'))
+    except LookupError as error:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(error)}), 404
+    except ReservationConflict as error:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(error)}), 409
+    
+    if reservation is None:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'No parking slots free for that time'}), 409
+    
+    db.session.commit()
+    
+    return jsonify({'success': True, 'reservation': _reservation_to_dict(reservation)})
+
+@api_bp.route('/reservations/<int:reservation_id>/cancel', methods=['POST'])
+@login_required
+def cancel_reservation_endpoint(reservation_id):
+    if not cancel_reservation(reservation_id, current_user.id):
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Reservation not found or already cancelled'}), 404
+    
+    db.session.commit()
+    
+    return jsonify({'success': True, 'message': 'Reservation cancelled'})
+
+@api_bp.route('/parking-slots/stream')
+@login_required
+def stream_parking_slots():
+    location = request.args.get('location', 'indoor')
+    
+    # Resume after the last event the browser saw when it reconnects
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_seq = None
+    
+    occupancy_index.sync()
+    return Response(
+        stream_slot_events(location, last_seq),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@api_bp.route('/parking-entry', methods=['POST'])
+@login_required
+def parking_entry():
+    data = request.get_json()
+    vehicle_id = data.get('vehicle_id')
+    slot_id = data.get('slot_id')
+    parking_type = data.get('parking_type', 'Indoor')
+    
+    # Validate data
+    if not vehicle_id or not slot_id:
+        return jsonify({'success': False, 'message': 'Missing required data'}), 400
+    
+    # Check if vehicle exists and belongs to current user
+    vehicle = get_user_vehicle(current_user.id, vehicle_id)
+    if not vehicle:
+        return jsonify({'success': False, 'message': 'Vehicle not found'}), 404
+    
+    # Slots booked for the next few hours are kept for their reservations
+    if reserved_for_others(slot_id, vehicle.id):
+        return jsonify({'success': False, 'message': 'Parking slot is reserved'}), 409
+    
+    if gate_journal.enabled:
+        # Acknowledged once journaled; the record is written behind the request
+        try:
+            record_id, slot = gate_journal.entry(current_user.id, vehicle.id, slot_id, parking_type)
+        except JournalUnavailable as error:
+            return jsonify({'success': False, 'message': str(error)}), 503
+        except LookupError as error:
+            return jsonify({'success': False, 'message': str(error)}), 404
+        except ValueError as error:
+            return jsonify({'success': False, 'message': str(error)}), 400
+        return jsonify({
+            'success': True,
+            'message': f'Vehicle {vehicle.license_plate} parked successfully in slot {slot.slot_number}',
+            'record_id': record_id
+        })
+    
+    # Claim the slot atomically so concurrent gates can't double book it
+    if not claim_slot(slot_id):
+        db.session.rollback()
+        if not db.session.get(ParkingSlot, slot_id):
+            return jsonify({'success': False, 'message': 'Parking slot not found'}), 404
+        return jsonify({'success': False, 'message': 'Parking slot is already occupied'}), 400
+    stage_occupancy_change(slot_id, True)
+    
+    # Create parking record
+    parking_record = ParkingRecord(
+        user_id=current_user.id,
+        vehicle_id=vehicle_id,
+        slot_id=slot_id,
+        parking_type=parking_type
+    )
+    
+    # Save to database
+    db.session.add(parking_record)
+    db.session.commit()
+    
+    slot = db.session.get(ParkingSlot, slot_id)
+    
+    return jsonify({
+        'success': True, 
+        'message': f'Vehicle {vehicle.license_plate} parked successfully in slot {slot.slot_number}',
+        'record_id': parking_record.id
+    })
+
+@api_bp.route('/parking-exit', methods=['POST'])
+@login_required
+def parking_exit():
+    data = request.get_json()
+    record_id = data.get('record_id')
+    token = data.get('token')
+    
+    if token:
+        # The exit token from the digital card is checked in memory, see exit_tokens.py
+        try:
+            claims, duration, fee = exit_gate.exit(token)
+        except InvalidExitToken as error:
+            return jsonify({'success': False, 'message': str(error)}), 403
+        except (JournalUnavailable, SettlementBacklog) as error:
+            return jsonify({'success': False, 'message': str(error)}), 503
+        except LookupError as error:
+            return jsonify({'success': False, 'message': str(error)}), 404
+        except ValueError as error:
+            return jsonify({'success': False, 'message': str(error)}), 400
+        return jsonify({
+            'success': True,
+            'message': 'Vehicle exit processed successfully',
+            'record_id': claims.record_id,
+            'duration': duration,
+            'fee': fee
+        })
+    
+    # Validate data
+    if not record_id:
+        return jsonify({'success': False, 'message': 'Missing record ID'}), 400
+    
+    if gate_journal.enabled:
+        try:
+            duration, fee = gate_journal.exit(current_user.id, record_id)
+        except JournalUnavailable as error:
+            return jsonify({'success': False, 'message': str(error)}), 503
+        except LookupError as error:
+            return jsonify({'success': False, 'message': str(error)}), 404
+        except ValueError as error:
+            return jsonify({'success': False, 'message': str(error)}), 400
+        return jsonify({
+            'success': True,
+            'message': 'Vehicle exit processed successfully',
+            'duration': duration,
+            'fee': fee
+        })
+    
+    # Find the parking record
+    record = ParkingRecord.query.filter_by(id=record_id, user_id=current_user.id).first()
+    if not record:
+        return jsonify({'success': False, 'message': 'Parking record not found'}), 404
+    
+    # Close the record atomically so a repeated exit can't be charged twice
+    if record.exit_time or not close_parking_record(record.id, datetime.utcnow()):
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Vehicle has already exited'}), 400
+    
+    # Update parking record
+    record.calculate_fee()
+    record.payment_status = 'Paid'  # Simulating payment
+    record.status = 'completed'
+    
+    # Free up the slot
+    if release_slot(record.slot_id):
+        stage_occupancy_change(record.slot_id, False)
+    
+    # Save to database
+    db.session.commit()
+    # The exit token on the digital card must not open the gate again
+    exit_gate.record_exited([record.id])
+    
+    # Fold the completed stay into the analytics rollups, behind the request
+    rollup_refresher.request()
+    
+    return jsonify({
+        'success': True,
+        'message': 'Vehicle exit processed successfully',
+        'duration': record.duration,
+        'fee': record.fee
+    })
+
+@api_bp.route('/gate-events/batch', methods=['POST'])
+@login_required
+def ingest_gate_events():
+    # Events may move anyone's vehicle, so only gate devices (GATE_DEVICE_USERS config) post them
+    if current_user.username not in current_app.config.get('GATE_DEVICE_USERS', ()):
+        return jsonify({'success': False, 'message': 'Only gate devices may post gate events'}), 403
+    
+    data = request.get_json()
+    events = data.get('events') if isinstance(data, dict) else None
+    
+    # Validate data
+    if not isinstance(events, list) or not events:
+        return jsonify({'success': False, 'message': 'Missing events'}), 400
+    
+    if len(events) > MAX_BATCH_SIZE:
+        return jsonify({
+            'success': False,
+            'message': f'At most {MAX_BATCH_SIZE} events per batch'
+        }), 413
+    
+    try:
+        results = gate_journal.apply_batch(events) if gate_journal.enabled else apply_gate_events(events)
+    except GateBatchConflict as error:
+        return jsonify({'success': False, 'message': str(error)}), 409
+    except JournalUnavailable as error:
+        return jsonify({'success': False, 'message': str(error)}), 503
+    exit_gate.record_exited([result['record_id'] for result in results
+                             if result['success'] and result['type'] == 'exit'])
+    rollup_refresher.request()
+    
+    return jsonify({
+        'success': True,
+        'processed': len(results),
+        'failed': sum(1 for result in results if not result['success']),
+        'results': results
+    })
+
+def _detection_response(job, duplicate):
+    data = dict(job.to_dict(), duplicate=duplicate)
+    return jsonify(data), job.status_code if job.finished else 202
+
+def _wait_seconds(value):
+    return min(max(float(value or 0), 0), MAX_DETECTION_WAIT)
+
+@api_bp.route('/simulate-license-detection', methods=['POST'])
+@login_required
+def simulate_license_detection():
+    data = request.get_json()
+    parking_type = data.get('parking_type', 'Indoor')
+    fuzzy = bool(data.get('fuzzy', False))
+    # Users listed in the VIP_USERS config are routed to VIP areas first
+    vip = current_user.username in current_app.config.get('VIP_USERS', ())
+    
+    try:
+        wait = _wait_seconds(data.get('wait'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid wait'}), 400
+    
+    if not data.get('image'):
+        # The plate text is already known, so the read is resolved right away
+        job, duplicate = anpr_pipeline.submit_plate(data.get('license_plate'), parking_type, current_user.id,
+                                                    vip=vip, fuzzy=fuzzy)
+        anpr_pipeline.wait(job, DUPLICATE_WAIT)
+        return _detection_response(job, duplicate)
+    
+    # Camera frame: queue it for recognition and answer with a job id
+    try:
+        frame = base64.b64decode(data['image'], validate=True)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid image'}), 400
+    if len(frame) > MAX_FRAME_BYTES:
+        return jsonify({'success': False, 'message': 'Image too large'}), 413
+    
+    try:
+        job, duplicate = anpr_pipeline.submit_frame(frame, parking_type, current_user.id, vip=vip, fuzzy=fuzzy)
+    except PipelineFull as error:
+        response = jsonify({'success': False, 'message': str(error)})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    if wait:
+        anpr_pipeline.wait(job, wait)
+    return _detection_response(job, duplicate)
+
+@api_bp.route('/simulate-license-detection/<job_id>')
+@login_required
+def get_license_detection(job_id):
+    try:
+        wait = _wait_seconds(request.args.get('wait'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid wait'}), 400
+    
+    job = anpr_pipeline.get(job_id, current_user.id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Detection job not found'}), 404
+    if wait:
+        anpr_pipeline.wait(job, wait)
+    return _detection_response(job, False)
+
+@api_bp.route('/nearest-outdoor-slot', methods=['POST'])
+@login_required
+def find_nearest_outdoor_slot():
+    data = request.get_json()
+    
+    try:
+        user_lat = float(data.get('latitude'))
+        user_lng = float(data.get('longitude'))
+        limit = min(max(int(data.get('limit', 1)), 1), 20)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Missing or invalid location'}), 400
+    
+    # k-nearest free outdoor slots by great-circle distance
+    occupancy_index.sync()
+    nearest = outdoor_spatial_index.nearest(user_lat, user_lng, limit)
+    
+    if not nearest:
+        return jsonify({
+            'success': False,
+            'message': 'No available outdoor parking slots'
+        }), 400
+    
+    slots_data = [{
+        'slot_id': slot.id,
+        'slot_number': slot.slot_number,
+        'area': slot.area,
+        'coordinates': {
+            'latitude': slot.latitude,
+            'longitude': slot.longitude
+        },
+        'distance': int(round(distance)),  # Distance in meters
+        'estimated_time': estimate_walking_minutes(distance)  # Walking time in minutes
+    } for slot, distance in nearest]
+    
+    return jsonify(dict(slots_data[0], success=True, nearby_slots=slots_data))
@@ -0,0 +1,103 @@
+"""
+Archival of completed parking records for the Car Parking System.
+
+Gates only ever look at open records, but parking_records keeps every stay,
+so its indexes and the history queries grow with the years. `flask
+archive-records` moves completed records that left more than
+ARCHIVE_AFTER_DAYS ago (default 90) into parking_records_archive, which has
+the same columns and keeps the record ids.
+
+Records move in batches of ARCHIVE_BATCH_SIZE, one short transaction each: a
+batch is copied with INSERT ... SELECT and deleted by id under the same
+conditions, and a count mismatch (a record repriced or reopened meanwhile)
+rolls the batch back and stops the run. Only records already folded into the
+occupancy rollups are moved, and never the newest record, whose id SQLite
+and the gate journal continue from.
+
+Reads that need the whole history see both tables: history pages when asked
+(archived=1), exports, repricing and the rollup and forecast rebuilds. Run
+archival from the same nightly job as those rebuilds rather than alongside
+them.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from models import ArchivedParkingRecord, ParkingRecord, db
+
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 1000
+# Columns copied from parking_records; rolled_up is implied by being archived
+ARCHIVED_COLUMNS = ('id', 'facility', 'user_id', 'vehicle_id', 'slot_id', 'entry_time', 'exit_time',
+                    'parking_type', 'fee', 'payment_status', 'status')
+
+# Every model that holds parking records, hot table last
+RECORD_MODELS = (ArchivedParkingRecord, ParkingRecord)
+
+
+class ArchiveConflict(Exception):
+    """Records changed while a batch was being moved"""
+
+
+def _archivable(cutoff, newest_id):
+    return (
+        ParkingRecord.exit_time.isnot(None),
+        ParkingRecord.exit_time < cutoff,
+        ParkingRecord.rolled_up.is_(True),
+        ParkingRecord.id < newest_id,
+    )
+
+
+def _move_batch(cutoff, newest_id, batch_size):
+    conditions = _archivable(cutoff, newest_id)
+    ids = [record_id for record_id, in db.session.query(ParkingRecord.id).filter(*conditions)
+           .order_by(ParkingRecord.id).limit(batch_size)]
+    if not ids:
+        return 0
+
+    source = select(*(getattr(ParkingRecord, column) for column in ARCHIVED_COLUMNS)).where(
+        ParkingRecord.id.in_(ids), *conditions
+    )
+    copied = db.session.execute(
+        insert(ArchivedParkingRecord).from_select(ARCHIVED_COLUMNS, source)
+    ).rowcount
+    deleted = db.session.execute(
+        delete(ParkingRecord).where(ParkingRecord.id.in_(ids), *conditions)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if copied != len(ids) or deleted != len(ids):
+        raise ArchiveConflict(f'{len(ids)} records to move, {copied} copied and {deleted} deleted')
+    return len(ids)
+
+
+def archive_parking_records(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                            pause=0.0, now=None):
+    """Move completed records that exited more than older_than_days ago into the archive.
+
+    Commits after every batch and sleeps pause seconds between batches so
+    gate traffic gets the database in between. Returns the number moved.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=older_than_days)
+    newest_id = db.session.query(func.max(ParkingRecord.id)).scalar()
+    if newest_id is None:
+        db.session.rollback()
+        return 0
+
+    total = 0
+    while True:
+        try:
+            moved = _move_batch(cutoff, newest_id, batch_size)
+            db.session.commit()
+        except ArchiveConflict as error:
+            db.session.rollback()
+            logging.warning(f"Archival stopped: {error}")
+            break
+        if not moved:
+            break
+        total += moved
+        if pause:
+            time.sleep(pause)
+    logging.info(f"Archived {total} parking records older than {cutoff:%Y-%m-%d}")
+    return total
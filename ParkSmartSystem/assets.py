@@ -0,0 +1,294 @@
+"""
+Static asset pipeline for the Car Parking System.
+
+`flask --app main build-assets` minifies the stylesheets and scripts under
+static/, names each copy after a hash of its content (css/style.3f2a9c1e.css)
+and writes gzip and, with the brotli package installed, brotli variants next
+to it, all under static/dist/. static/dist/manifest.json maps the source
+names to the built ones.
+
+When a manifest exists, url_for('static', filename='css/style.css') points
+at the built file, and the static view answers requests for built files
+with the smallest variant the client accepts and an immutable Cache-Control,
+so a kiosk downloads each version of an asset once. Sources without a built
+copy are served as before. Rebuild after changing an asset; old builds are
+removed. Set ASSETS_ENABLED to False to serve the sources.
+
+The minifier only drops comments and whitespace: it keeps line breaks where
+JavaScript could need them and leaves strings and template literals alone.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+
+from flask import request, send_from_directory
+from flask.sessions import SecureCookieSessionInterface
+
+ASSET_EXTENSIONS = ('.css', '.js')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 8
+# Compressed variants by preference: (Accept-Encoding token, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Characters around which JavaScript and CSS need no whitespace
+_JS_PUNCTUATION = set('{}()[];,:=<>+-*/%&|!?~^.')
+_CSS_PUNCTUATION = set('{};,>')
+# After these a line break can't end a statement, so it may go (not after
+# + - or /, which may end a++ or a regular expression)
+_JS_CONTINUES = set('{([;,=:&|?*%<>!.')
+# A slash after these starts a regular expression rather than a division
+_JS_REGEX_AFTER = set('(,=:[!&|?{};+-*%<>~^')
+
+
+def _brotli():
+    # Optional: without it only gzip variants are written
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _skip_string(source, i, quote):
+    """Index just past the string literal starting at source[i]"""
+    i += 1
+    while i < len(source) and source[i] != quote:
+        i += 2 if source[i] == '\\' else 1
+    return i + 1
+
+
+def _skip_template(source, i):
+    """Index just past the template literal starting at source[i], nested ${...} included"""
+    i += 1
+    while i < len(source) and source[i] != '`':
+        if source[i] == '\\':
+            i += 2
+        elif source.startswith('${', i):
+            i = _skip_code(source, i + 2)
+        else:
+            i += 1
+    return i + 1
+
+
+def _skip_code(source, i):
+    """Index just past the } closing the ${ that ended at source[i]"""
+    depth = 0
+    while i < len(source):
+        char = source[i]
+        if char in '\'"':
+            i = _skip_string(source, i, char)
+            continue
+        if char == '`':
+            i = _skip_template(source, i)
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            if depth == 0:
+                return i + 1
+            depth -= 1
+        i += 1
+    return i
+
+
+def _skip_regex(source, i):
+    i += 1
+    in_class = False
+    while i < len(source) and (source[i] != '/' or in_class):
+        if source[i] == '\\':
+            i += 1
+        elif source[i] == '[':
+            in_class = True
+        elif source[i] == ']':
+            in_class = False
+        i += 1
+    i += 1
+    while i < len(source) and source[i].isalpha():
+        i += 1
+    return i
+
+
+def _minify(source, punctuation, js):
+    out = []
+    i = 0
+    pending = ''  # whitespace seen since the last token: '', ' ' or '\n'
+    while i < len(source):
+        char = source[i]
+        if char.isspace():
+            pending = '\n' if js and (char == '\n' or pending == '\n') else pending or ' '
+            i += 1
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            comment = source[i:] if end < 0 else source[i:end + 2]
+            if js and '\n' in comment:
+                pending = '\n'
+            else:
+                pending = pending or ' '
+            i = len(source) if end < 0 else end + 2
+            continue
+        if js and source.startswith('//', i):
+            end = source.find('\n', i)
+            i = len(source) if end < 0 else end
+            continue
+
+        previous = out[-1][-1] if out else ''
+        if pending and previous:
+            if pending == '\n' and previous not in _JS_CONTINUES and char not in ')]}':
+                out.append('\n')
+            elif previous in punctuation or char in punctuation or (not js and previous == ':'):
+                # a - -b and a + +b need the space
+                if previous in '+-' and char == previous:
+                    out.append(' ')
+            else:
+                out.append(' ')
+        pending = ''
+
+        if char in '\'"':
+            end = _skip_string(source, i, char)
+        elif js and char == '`':
+            end = _skip_template(source, i)
+        elif js and char == '/' and (not previous or previous in _JS_REGEX_AFTER):
+            end = _skip_regex(source, i)
+        else:
+            end = i + 1
+        out.append(source[i:end])
+        i = end
+    return ''.join(out).strip() + '\n'
+
+
+def minify_css(source):
+    source = _minify(source, _CSS_PUNCTUATION, js=False)
+    # The last declaration of a block needs no semicolon
+    return source.replace(';}', '}')
+
+
+def minify_js(source):
+    return _minify(source, _JS_PUNCTUATION, js=True)
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def hashed_name(filename, content):
+    root, extension = os.path.splitext(filename)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{extension}"
+
+
+def build_assets(static_folder):
+    """Minify, fingerprint and precompress the assets; returns the manifest"""
+    dist = os.path.join(static_folder, DIST_DIR)
+    brotli = _brotli()
+    if brotli is None:
+        logging.warning("brotli is not installed; writing gzip variants only")
+    # Built from scratch so no stale copies are left behind
+    shutil.rmtree(dist, ignore_errors=True)
+
+    manifest = {}
+    for directory, subdirectories, filenames in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(dist):
+            subdirectories.clear()
+            continue
+        for filename in sorted(filenames):
+            extension = os.path.splitext(filename)[1]
+            if extension not in ASSET_EXTENSIONS:
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, encoding='utf-8') as source:
+                content = MINIFIERS[extension](source.read()).encode()
+            built = hashed_name(name, content)
+            target = os.path.join(dist, built)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as output:
+                output.write(content)
+            # mtime=0 keeps the gzip bytes identical between builds
+            with open(target + '.gz', 'wb') as output:
+                output.write(gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(target + '.br', 'wb') as output:
+                    output.write(brotli.compress(content, quality=11))
+            manifest[name] = f"{DIST_DIR}/{built}"
+
+    os.makedirs(dist, exist_ok=True)
+    with open(os.path.join(dist, MANIFEST_NAME), 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {}
+
+
+def _accepted_encodings():
+    # Encodings the client accepts, ignoring q-values other than q=0
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        token, _, params = part.strip().partition(';')
+        if token and not re.fullmatch(r'\s*q=0(\.0*)?\s*', params):
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+class StaticSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions that leave static file responses alone.
+
+    Flask adds Vary: Cookie to every response whose request touched the
+    session, which flask_login does for all of them; static files are the
+    same for everyone and should be cached as such.
+    """
+
+    def save_session(self, app, session, response):
+        if request.endpoint != 'static':
+            super().save_session(app, session, response)
+
+
+def init_assets(app):
+    """Point static URLs at the built assets and serve them precompressed"""
+    app.config.setdefault('ASSETS_ENABLED', True)
+    if type(app.session_interface) is SecureCookieSessionInterface:
+        app.session_interface = StaticSessionInterface()
+    manifest = load_manifest(app.static_folder) if app.config['ASSETS_ENABLED'] else {}
+    if not manifest:
+        return
+    built = set(manifest.values())
+    serve_source = app.view_functions['static']
+
+    @app.url_defaults
+    def _fingerprint_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def static(filename):
+        if filename not in built:
+            return serve_source(filename=filename)
+        accepted = _accepted_encodings()
+        for encoding, suffix in ENCODINGS:
+            if encoding in accepted and os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+                response = send_from_directory(app.static_folder, filename + suffix,
+                                               mimetype=_mimetype(filename), max_age=IMMUTABLE_MAX_AGE)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename, max_age=IMMUTABLE_MAX_AGE)
+        # The name changes with the content, so caches never need to ask again
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
+
+
+def _mimetype(filename):
+    return {'.css': 'text/css', '.js': 'text/javascript'}[os.path.splitext(filename)[1]]
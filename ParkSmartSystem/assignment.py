@@ -0,0 +1,320 @@
+"""
+Slot assignment strategies for the Car Parking System.
+
+Which free slot a detected vehicle is sent to is decided by a strategy:
+
+    nearest_entrance  the free slot with the shortest walk to the entrance
+    fill_level_first  the nearest slot in the fullest area that still has
+                      room, so cars (and lighting and ventilation) stay
+                      concentrated and areas fill one at a time
+    balance_by_area   the nearest slot in the emptiest area, spreading
+                      traffic over ramps and exits
+    random            any free slot, the old behaviour
+
+On top of every strategy, the areas listed in the VIP_AREAS config (the
+same ones tariff_registry charges the 'vip' tariff) are kept for VIP users,
+who are routed there first.
+
+The layout is precomputed when the occupancy index is warmed. Each slot
+gets a walking distance to the entrance of its location: great-circle
+metres to the entrance of the slot's location for slots with coordinates,
+otherwise a walk derived from its level and position in the row. Every area
+keeps its free slots in a heap keyed by that distance: adding a slot costs
+O(log n), removing one marks it and leaves it to be dropped when it reaches
+the top, and the slots are read in order in O(log n) each. A decision only
+orders the handful of areas and takes the first acceptable slot of the
+chosen one.
+
+The strategies are deterministic, so cars detected at the same time would
+all be sent to the same slot. An assigned slot is therefore held for
+HOLD_SECONDS, or until it is occupied. Held slots are moved out of their
+area's free slots into its held ones, so later cars don't pass over them,
+and only get a held slot if every free one is unacceptable. Holds are per
+process.
+"""
+import heapq
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+
+from facilities import FacilityLocal
+from occupancy import occupancy_index
+from spatial import haversine
+from tariffs import tariff_registry
+
+# Walk equivalent of climbing one level, and the width of one bay
+LEVEL_WALK_M = 40.0
+SLOT_PITCH_M = 2.5
+# Outdoor walks are measured to the entrance of the first lot
+DEFAULT_ENTRANCES = {'outdoor': (40.7128, -74.0060)}
+DEFAULT_STRATEGY = 'fill_level_first'
+RANDOM_ATTEMPTS = 8
+# Time for a car to drive from the barrier to its slot
+HOLD_SECONDS = 120
+
+
+class RankedSlots:
+    """Slot keys (walking distance, id) in a heap with lazy deletion.
+
+    add is O(log n) and discard O(1); discarded keys stay in the heap until
+    they reach the top or outnumber the live ones, when the heap is rebuilt.
+    Iterating yields the live keys in order, O(log n) each.
+    """
+
+    def __init__(self):
+        self._heap = []
+        # Keys in the heap, and those of them that haven't been discarded
+        self._entries = set()
+        self._live = set()
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, key):
+        return key in self._live
+
+    def __iter__(self):
+        heap, live = self._heap, self._live
+        if not heap:
+            return
+        # discard never leaves a removed key on top, and the top is usually all a decision reads
+        yield heap[0]
+        # Then walk the heap as a tree, smallest frontier node first
+        frontier = [(heap[child], child) for child in (1, 2) if child < len(heap)]
+        heapq.heapify(frontier)
+        while frontier:
+            key, i = heapq.heappop(frontier)
+            if key in live:
+                yield key
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+
+    def add(self, key):
+        if key in self._live:
+            return
+        self._live.add(key)
+        if key not in self._entries:
+            self._entries.add(key)
+            heapq.heappush(self._heap, key)
+
+    def discard(self, key):
+        if key not in self._live:
+            return
+        self._live.discard(key)
+        heap = self._heap
+        while heap and heap[0] not in self._live:
+            self._entries.discard(heapq.heappop(heap))
+        if len(heap) > 2 * len(self._live) + 16:
+            self._heap = sorted(self._live)
+            self._entries = set(self._live)
+
+    def choice(self):
+        if not self._live:
+            return None
+        # At most half the heap is discarded keys
+        while True:
+            key = random.choice(self._heap)
+            if key in self._live:
+                return key
+
+
+class AreaState:
+    """Free slots of one area, nearest to the entrance first, and its held ones"""
+
+    def __init__(self, name, vip=False):
+        self.name = name
+        self.vip = vip
+        self.total = 0
+        self.nearest = float('inf')
+        self.free = RankedSlots()
+        self.held = RankedSlots()
+
+    @property
+    def free_ratio(self):
+        return (len(self.free) + len(self.held)) / self.total if self.total else 0.0
+
+    def ranked(self, held=False):
+        return self.held if held else self.free
+
+
+class NearestEntrance:
+    """Shortest walk first, whichever area it is in"""
+
+    def candidates(self, areas, held=False):
+        return heapq.merge(*(area.ranked(held) for area in areas))
+
+
+class FillLevelFirst:
+    """Fullest area that still has room first, nearest slot within it"""
+
+    def candidates(self, areas, held=False):
+        ordered = sorted((area for area in areas if area.ranked(held)),
+                         key=lambda area: (area.free_ratio, area.nearest))
+        return chain.from_iterable(area.ranked(held) for area in ordered)
+
+
+class BalanceByArea:
+    """Emptiest area first, nearest slot within it"""
+
+    def candidates(self, areas, held=False):
+        ordered = sorted((area for area in areas if area.ranked(held)),
+                         key=lambda area: (-area.free_ratio, area.nearest))
+        return chain.from_iterable(area.ranked(held) for area in ordered)
+
+
+class RandomSlot:
+    """Any free slot, weighted so that every free slot is equally likely"""
+
+    def candidates(self, areas, held=False):
+        slots = [area.ranked(held) for area in areas if area.ranked(held)]
+        if not slots:
+            return iter(())
+        weights = [len(ranked) for ranked in slots]
+        picks = (random.choices(slots, weights)[0].choice() for _ in range(RANDOM_ATTEMPTS))
+        # After a few rejected picks fall back to a full pass
+        return chain((key for key in picks if key is not None), heapq.merge(*slots))
+
+
+STRATEGIES = {
+    'nearest_entrance': NearestEntrance,
+    'fill_level_first': FillLevelFirst,
+    'balance_by_area': BalanceByArea,
+    'random': RandomSlot,
+}
+
+
+def _number(text):
+    # "Level 2" -> 2, "L215" -> 215, "North Lot" -> 0
+    match = re.search(r'(\d+)\D*$', text or '')
+    return int(match.group(1)) if match else 0
+
+
+class SlotAssigner:
+    """Layout-aware choice of free slots, synced with the occupancy index"""
+
+    def __init__(self, strategy=DEFAULT_STRATEGY, entrances=None):
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._areas = {}
+        self._area_of = {}
+        self._holds = OrderedDict()
+        self.entrances = dict(DEFAULT_ENTRANCES if entrances is None else entrances)
+        self.configure(strategy)
+
+    def configure(self, strategy):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown slot assignment strategy: {strategy}")
+        self.strategy_name = strategy
+        self.strategy = STRATEGIES[strategy]()
+
+    def walking_distance(self, slot, position):
+        """Metres from the entrance of the slot's location to the slot, the
+        position'th of its area (counting from 1)"""
+        entrance = self.entrances.get(slot.location)
+        if entrance and slot.latitude is not None and slot.longitude is not None:
+            return haversine(entrance[0], entrance[1], slot.latitude, slot.longitude)
+        level = _number(slot.area) if slot.location == 'indoor' else 0
+        return max(level - 1, 0) * LEVEL_WALK_M + position * SLOT_PITCH_M
+
+    def rebuild(self, index):
+        keys = {}
+        areas = {}
+        area_of = {}
+        for location in index.locations():
+            by_area = {}
+            for slot in index.slots(location):
+                by_area.setdefault(slot.area, []).append(slot)
+            for name, slots in by_area.items():
+                area = areas[(location, name)] = AreaState(name, tariff_registry.is_vip_area(name))
+                slots.sort(key=lambda slot: (_number(slot.slot_number), slot.id))
+                for position, slot in enumerate(slots, 1):
+                    key = keys[slot.id] = (self.walking_distance(slot, position), slot.id)
+                    area_of[slot.id] = area
+                    area.total += 1
+                    area.nearest = min(area.nearest, key[0])
+                    if not index.is_occupied(slot.id):
+                        area.free.add(key)
+        with self._lock:
+            self._keys = keys
+            self._areas = areas
+            self._area_of = area_of
+            for slot_id in list(self._holds):
+                area = area_of.get(slot_id)
+                if area is None or keys[slot_id] not in area.free:
+                    del self._holds[slot_id]
+                else:
+                    area.free.discard(keys[slot_id])
+                    area.held.add(keys[slot_id])
+
+    def distance(self, slot_id):
+        """Walking distance in metres to the slot, None if it is unknown"""
+        key = self._keys.get(slot_id)
+        return key[0] if key else None
+
+    def on_occupancy_change(self, slot, occupied):
+        with self._lock:
+            key = self._keys.get(slot.id)
+            area = self._area_of.get(slot.id)
+            if key is None or area is None:
+                return
+            if occupied:
+                area.free.discard(key)
+                area.held.discard(key)
+                self._holds.pop(slot.id, None)
+            elif slot.id not in self._holds:
+                area.free.add(key)
+
+    def assign(self, location, area=None, vip=False, accept=None):
+        """Choose a free slot of the location (and area), or None.
+
+        accept(slot_id) may veto candidates, e.g. slots booked soon.
+        """
+        with self._lock:
+            areas = [state for (state_location, name), state in self._areas.items()
+                     if state_location == location and (area is None or name == area)]
+            # VIP areas are kept for VIP users, who get them first
+            groups = [[state for state in areas if state.vip], [state for state in areas if not state.vip]]
+            if not vip:
+                groups = groups[1:]
+            now = time.monotonic()
+            self._expire_holds(now)
+            # Fall back to a held slot rather than turning the car away
+            chosen = self._first_accepted(groups, accept, held=False)
+            if chosen is None:
+                chosen = self._first_accepted(groups, accept, held=True)
+            if chosen is None:
+                return None
+            key = self._keys[chosen]
+            area = self._area_of[chosen]
+            area.free.discard(key)
+            area.held.add(key)
+            self._holds.pop(chosen, None)
+            self._holds[chosen] = now + HOLD_SECONDS
+        return occupancy_index.get(chosen)
+
+    def _first_accepted(self, groups, accept, held):
+        # Called with the lock held
+        for group in groups:
+            for _, slot_id in self.strategy.candidates(group, held):
+                if accept is None or accept(slot_id):
+                    return slot_id
+        return None
+
+    def _expire_holds(self, now):
+        # Holds are added in expiry order, so the expired ones are at the front
+        while self._holds and next(iter(self._holds.values())) <= now:
+            slot_id, _ = self._holds.popitem(last=False)
+            key = self._keys.get(slot_id)
+            area = self._area_of.get(slot_id)
+            if key is not None and area is not None and key in area.held:
+                area.held.discard(key)
+                area.free.add(key)
+
+
+slot_assigner = FacilityLocal(SlotAssigner, broadcast=('configure',))
+occupancy_index.add_warm_listener(slot_assigner.rebuild)
+occupancy_index.add_listener(slot_assigner.on_occupancy_change)
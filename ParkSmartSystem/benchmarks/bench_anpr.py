@@ -0,0 +1,190 @@
+"""
+Benchmark of camera frame recognition in the request vs. the ANPR pipeline.
+--cameras camera threads send --reads frames of each of --cars cars (a car
+waiting at the barrier is read several times, two of the reads are
+byte-identical) through the Flask test client, while a probe thread keeps
+listing the free indoor slots the way the parking pages poll them.
+
+  inline    a view recognizes the frame in the request, as a synchronous
+            endpoint would, and then assigns a slot
+  pipeline  /api/simulate-license-detection queues the frame for the
+            --workers process pool and the camera collects the outcome
+            by job id
+
+The stub recognizer burns --work-ms of CPU per frame. Reported are frames
+per second, submit latency, how many reads were folded into an earlier one,
+how many submits were turned away with 503 (and retried), and the latency
+of the slot list probe while the cameras run.
+
+Usage:
+  python benchmarks/bench_anpr.py [--cars 200] [--reads 3] [--cameras 8] [--workers 4] [--work-ms 50]
+"""
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import jsonify, request
+from sqlalchemy import insert
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+
+PASSWORD = 'bench'
+# Cameras retry a 503 sooner than its Retry-After, to keep the queue full
+RETRY_SECONDS = 0.05
+
+
+def seed(app, n_cars):
+    from extensions import db
+    from models import User, Vehicle, normalize_plate
+    from utils import init_parking_slots
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='camera', email='camera@example.com')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.flush()
+        db.session.execute(insert(Vehicle), [
+            {'license_plate': f'CAM-{i:05d}', 'plate_key': normalize_plate(f'CAM-{i:05d}'), 'user_id': user.id}
+            for i in range(n_cars)
+        ])
+        init_parking_slots(5, max(1, n_cars // 5), 0, 0, occupied_ratio=0)
+        db.session.commit()
+
+
+def add_inline_view(app, work_ms):
+    from anpr import resolve_detection, stub_recognizer
+
+    def inline_detection():
+        # What a synchronous endpoint would do: hold the worker for the inference
+        read = stub_recognizer(base64.b64decode(request.get_json()['image']), work_ms)
+        payload, status_code = resolve_detection(read[0], 'Indoor')
+        return jsonify(payload), status_code
+
+    app.add_url_rule('/bench/inline-detection', 'inline_detection', inline_detection, methods=['POST'])
+
+
+def logged_in_client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'camera', 'password': PASSWORD})
+    return client
+
+
+def frames_for(car, n_reads):
+    # The reads alternate between two renderings of the plate
+    spellings = [f'CAM-{car:05d}', f'CAM {car:05d}']
+    return [base64.b64encode(spellings[i % 2].encode()).decode() for i in range(n_reads)]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] * 1e3 if values else 0.0
+
+
+def camera(app, mode, cars, n_reads, submits, jobs, counts):
+    client = logged_in_client(app)
+    for car in cars:
+        for frame in frames_for(car, n_reads):
+            while True:
+                started = time.perf_counter()
+                if mode == 'inline':
+                    response = client.post('/bench/inline-detection', json={'image': frame})
+                else:
+                    response = client.post('/api/simulate-license-detection', json={'image': frame})
+                submits.append(time.perf_counter() - started)
+                if response.status_code != 503:
+                    break
+                counts['rejected'] += 1
+                time.sleep(RETRY_SECONDS)
+            data = response.get_json()
+            if data.get('duplicate') or data.get('duplicate_of'):
+                counts['duplicates'] += 1
+            if response.status_code == 202:
+                jobs.append(data['job_id'])
+    # Collect the outcome of every frame still being recognized
+    for job_id in jobs:
+        if client.get(f'/api/simulate-license-detection/{job_id}?wait=30').get_json().get('duplicate_of'):
+            counts['duplicates'] += 1
+
+
+def probe(app, stop, latencies):
+    client = logged_in_client(app)
+    while not stop.is_set():
+        started = time.perf_counter()
+        client.get('/api/parking-slots?location=indoor')
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.01)
+
+
+def run_mode(app, mode, n_cars, n_reads, n_cameras):
+    submits = []
+    probes = []
+    counts = Counter()
+    stop = threading.Event()
+    prober = threading.Thread(target=probe, args=(app, stop, probes))
+    cameras = [threading.Thread(target=camera, args=(app, mode, range(i, n_cars, n_cameras), n_reads,
+                                                     submits, [], counts))
+               for i in range(n_cameras)]
+    prober.start()
+    started = time.perf_counter()
+    for thread in cameras:
+        thread.start()
+    for thread in cameras:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    prober.join()
+
+    frames = n_cars * n_reads
+    print(f"{mode:<10}{frames / elapsed:>10.1f}{percentile(submits, 0.5):>11.1f}{percentile(submits, 0.99):>11.1f}"
+          f"{counts['duplicates']:>8}{counts['rejected']:>10}{percentile(probes, 0.5):>12.1f}"
+          f"{percentile(probes, 0.99):>12.1f}")
+
+
+def run_benchmark(args):
+    from anpr import anpr_pipeline
+    from app import create_app
+    from occupancy import occupancy_index
+
+    app = create_app({
+        'ANPR_WORKERS': args.workers,
+        'ANPR_RECOGNIZER_OPTIONS': {'work_ms': args.work_ms},
+        'METRICS_ENABLED': False,
+    })
+    seed(app, args.cars)
+    add_inline_view(app, args.work_ms)
+    with app.app_context():
+        occupancy_index.warm()
+    # Let the spawned pool processes start before timing
+    client = logged_in_client(app)
+    for _ in range(args.workers * 2):
+        client.post('/api/simulate-license-detection', json={'image': base64.b64encode(b'WARM-UP').decode(),
+                                                              'wait': 30})
+
+    print(f"Cars: {args.cars} x {args.reads} reads, cameras: {args.cameras}, "
+          f"pool: {args.workers} processes, recognition: {args.work_ms} ms of CPU")
+    print(f"{'mode':<10}{'frames/s':>10}{'submit p50':>11}{'submit p99':>11}{'folded':>8}{'rejected':>10}"
+          f"{'probe p50':>12}{'probe p99':>12}   (ms)")
+    for mode in ('inline', 'pipeline'):
+        run_mode(app, mode, args.cars, args.reads, args.cameras)
+    anpr_pipeline.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--cars', type=int, default=200)
+    parser.add_argument('--reads', type=int, default=3)
+    parser.add_argument('--cameras', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--work-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'anpr.db')}"
+        run_benchmark(args)
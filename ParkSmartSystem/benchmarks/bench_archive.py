@@ -0,0 +1,229 @@
+"""
+Benchmark of the hot parking_records table before and after archiving.
+Seeds --records completed stays spread over --years years for --users
+users, with the last ARCHIVE_AFTER_DAYS (90) days left to the live table,
+and reports the latency of the queries gates and pages run on every request:
+
+  active       a user's open parkings (dashboard, gate checks)
+  history      the first page of a user's history
+  gate         a vehicle parking and leaving through the API
+
+before and after `archive-records` has moved the old stays out. Archival
+itself runs twice on copies of the same database, in --batch-size batches
+and as a single transaction, while a gate process keeps parking a car: the
+gate's worst wait shows how long each run held the write lock.
+
+Usage:
+  python benchmarks/bench_archive.py [--records 200000] [--users 2000] [--years 3]
+                                     [--batch-size 1000] [--samples 2000]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+
+PASSWORD = 'bench'
+INSERT_CHUNK_SIZE = 50000
+
+
+def bench_config(path):
+    return {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'METRICS_ENABLED': False}
+
+
+def seed(app, args):
+    from archive import ARCHIVE_AFTER_DAYS
+    from commands import init_database
+    from extensions import db
+    from models import ParkingRecord, ParkingSlot, User, Vehicle
+
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    with app.app_context():
+        init_database()
+        db.session.execute(insert(User), [
+            {'username': f'user{i}', 'email': f'user{i}@example.com', 'password': ''}
+            for i in range(args.users)
+        ])
+        gate = User(username='gate', email='gate@example.com')
+        gate.set_password(PASSWORD)
+        db.session.add(gate)
+        db.session.flush()
+        db.session.add(Vehicle(license_plate='GATE-0001', user_id=gate.id))
+        user_ids = [user_id for user_id, in db.session.query(User.id).filter(User.id != gate.id)]
+        db.session.execute(insert(Vehicle), [
+            {'license_plate': f'AR-{user_id:05d}', 'user_id': user_id} for user_id in user_ids
+        ])
+        vehicles = dict(db.session.query(Vehicle.user_id, Vehicle.id))
+        slot_ids = [slot_id for slot_id, in db.session.query(ParkingSlot.id)]
+        db.session.commit()
+
+        # Stays in entry order, as they would have been recorded
+        span = args.years * 365 * 1440
+        entries = sorted(rng.uniform(0, span) for _ in range(args.records))
+        first = now - timedelta(minutes=span)
+        for offset in range(0, args.records, INSERT_CHUNK_SIZE):
+            rows = []
+            for minute in entries[offset:offset + INSERT_CHUNK_SIZE]:
+                user_id = rng.choice(user_ids)
+                entry = first + timedelta(minutes=minute - 600)
+                rows.append({'user_id': user_id, 'vehicle_id': vehicles[user_id], 'slot_id': rng.choice(slot_ids),
+                             'entry_time': entry, 'exit_time': entry + timedelta(minutes=rng.uniform(20, 480)),
+                             'parking_type': 'Indoor', 'fee': 5.0, 'payment_status': 'Paid',
+                             'status': 'completed', 'rolled_up': True})
+            db.session.execute(insert(ParkingRecord), rows)
+        db.session.commit()
+        recent = sum(minute - 600 > span - ARCHIVE_AFTER_DAYS * 1440 for minute in entries)
+        db.session.remove()
+    return user_ids, recent
+
+
+def login(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'gate', 'password': PASSWORD})
+    return client
+
+
+def gate_ids(app):
+    from models import ParkingSlot, User, Vehicle
+
+    with app.app_context():
+        user = User.query.filter_by(username='gate').one()
+        vehicle_id = Vehicle.query.filter_by(user_id=user.id).one().id
+        slot_id = ParkingSlot.query.filter_by(is_occupied=False).order_by(ParkingSlot.id).first().id
+    return vehicle_id, slot_id
+
+
+def park_and_leave(client, vehicle_id, slot_id):
+    """Park the gate's vehicle and take it out again; False on an error"""
+    response = client.post('/api/parking-entry', json={'vehicle_id': vehicle_id, 'slot_id': slot_id})
+    if response.status_code != 200:
+        return False
+    response = client.post('/api/parking-exit', json={'record_id': response.get_json()['record_id']})
+    return response.status_code == 200
+
+
+def timed(function, arguments):
+    latencies = []
+    for argument in arguments:
+        started = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(label, path, user_ids, args):
+    from app import create_app
+    from extensions import db
+    from history import get_active_parkings, get_history_page
+    from models import ParkingRecord
+
+    app = create_app(bench_config(path))
+    client = login(app)
+    vehicle_id, slot_id = gate_ids(app)
+    rng = random.Random(11)
+    users = [rng.choice(user_ids) for _ in range(args.samples)]
+    with app.app_context():
+        hot = db.session.query(ParkingRecord).count()
+        results = {
+            'active': timed(get_active_parkings, users),
+            'history': timed(get_history_page, users),
+        }
+        db.session.remove()
+    results['gate'] = timed(lambda _: park_and_leave(client, vehicle_id, slot_id), range(args.samples // 10))
+    for name, latencies in results.items():
+        print(f"{label:<10}{name:<10}{hot:>10}{percentile(latencies, 0.5) * 1e3:>10.2f}"
+              f"{percentile(latencies, 0.99) * 1e3:>10.2f}")
+
+
+def gate(path, ready, stop, results):
+    from app import create_app
+
+    app = create_app(bench_config(path))
+    client = login(app)
+    vehicle_id, slot_id = gate_ids(app)
+    park_and_leave(client, vehicle_id, slot_id)
+    ready.set()
+    latencies, errors = [], 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        if not park_and_leave(client, vehicle_id, slot_id):
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+    results.put((latencies, errors))
+
+
+def archive_under_load(label, path, batch_size):
+    """Archive with a gate process parking meanwhile; returns the number of records moved"""
+    from app import create_app
+    from archive import archive_parking_records
+
+    ready, stop, results = multiprocessing.Event(), multiprocessing.Event(), multiprocessing.Queue()
+    process = multiprocessing.Process(target=gate, args=(path, ready, stop, results))
+    process.start()
+    ready.wait()
+
+    app = create_app(bench_config(path))
+    with app.app_context():
+        started = time.perf_counter()
+        moved = archive_parking_records(batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+    stop.set()
+    latencies, errors = results.get()
+    process.join()
+    print(f"{label:<22}{moved:>10}{elapsed:>10.1f}{len(latencies) / elapsed:>10.0f}"
+          f"{percentile(latencies, 0.99) * 1e3:>10.1f}{max(latencies, default=float('nan')) * 1e3:>10.1f}"
+          f"{errors:>8}")
+    return moved
+
+
+def run_benchmark(args, tmp):
+    from app import create_app
+
+    path = os.path.join(tmp, 'archive.db')
+    started = time.perf_counter()
+    user_ids, recent = seed(create_app(bench_config(path)), args)
+    print(f"Seeded {args.records} completed stays ({recent} in the last 90 days) for {args.users} users "
+          f"in {time.perf_counter() - started:.1f} s")
+    single = os.path.join(tmp, 'single.db')
+    shutil.copyfile(path, single)
+
+    print(f"\n{'table':<10}{'query':<10}{'hot rows':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    measure('live', path, user_ids, args)
+
+    print(f"\n{'archival':<22}{'moved':>10}{'seconds':>10}{'gate/s':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    archive_under_load(f'batches of {args.batch_size}', path, args.batch_size)
+    archive_under_load('one transaction', single, args.records)
+
+    print()
+    measure('archived', path, user_ids, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    with tempfile.TemporaryDirectory() as tmp:
+        run_benchmark(args, tmp)
@@ -0,0 +1,114 @@
+"""
+Benchmark of page-load bytes with and without the static asset pipeline.
+Renders every page for a logged-in user and fetches the stylesheets and
+scripts it links from /static, first as the sources (ASSETS_ENABLED off)
+and then after `flask build-assets` (which this runs, leaving static/dist
+behind). Per page it reports the HTML size and the asset bytes sent:
+
+  source       the unversioned files as they are served today
+  minified     the built files to a client that accepts no compression
+  gzip / br    the precompressed variants (br needs the brotli package)
+  repeat       requests a repeat visit still makes for the assets: sources
+               are served with Cache-Control: no-cache, so each is
+               revalidated; built files are immutable and come from cache
+
+CDN assets (Bootstrap, Font Awesome) are not ours to serve and are left out.
+
+Usage:
+  python benchmarks/bench_assets.py
+"""
+import argparse
+import importlib.util
+import os
+import re
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+
+PASSWORD = 'bench'
+PAGES = ['/', '/dashboard', '/indoor-parking', '/outdoor-parking', '/digital-card']
+ASSET_URL = re.compile(r'(?:href|src)="(/static/[^"]+)"')
+
+
+def seed(app):
+    from commands import init_database
+    from extensions import db
+    from models import User, Vehicle
+
+    with app.app_context():
+        init_database()
+        user = User(username='assets', email='assets@example.com')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Vehicle(license_plate='AS-0001', user_id=user.id))
+        db.session.commit()
+
+
+def page_assets(client, page):
+    html = client.get(page).data
+    return len(html), ASSET_URL.findall(html.decode())
+
+
+def asset_bytes(client, urls, encoding):
+    total = 0
+    for url in urls:
+        response = client.get(url, headers={'Accept-Encoding': encoding} if encoding else {})
+        assert response.status_code == 200, (url, response.status_code)
+        total += len(response.data)
+    return total
+
+
+def repeat_requests(client, urls):
+    """Requests a browser still sends for cached copies of the assets"""
+    return sum('immutable' not in (client.get(url).headers.get('Cache-Control') or '') for url in urls)
+
+
+def login(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'assets', 'password': PASSWORD})
+    return client
+
+
+def run_benchmark():
+    from app import create_app
+    from assets import build_assets
+
+    before = create_app({'ASSETS_ENABLED': False, 'METRICS_ENABLED': False})
+    seed(before)
+    build_assets(before.static_folder)
+    after = create_app({'METRICS_ENABLED': False})
+    old, new = login(before), login(after)
+    has_brotli = importlib.util.find_spec('brotli') is not None
+
+    print(f"{'page':<18}{'html':>8}{'source':>9}{'minified':>10}{'gzip':>8}{'br':>8}{'repeat':>12}")
+    totals = [0] * 5
+    for page in PAGES:
+        html_bytes, sources = page_assets(old, page)
+        _, built = page_assets(new, page)
+        row = [
+            asset_bytes(old, sources, 'gzip, br'),
+            asset_bytes(new, built, None),
+            asset_bytes(new, built, 'gzip'),
+            asset_bytes(new, built, 'br, gzip') if has_brotli else None,
+        ]
+        totals = [total + (value or 0) for total, value in zip(totals, [html_bytes] + row)]
+        repeat = f"{repeat_requests(old, sources)} -> {repeat_requests(new, built)}"
+        print(f"{page:<18}{html_bytes:>8}{row[0]:>9}{row[1]:>10}{row[2]:>8}"
+              f"{row[3] if has_brotli else '-':>8}{repeat:>12}")
+    print(f"{'all pages':<18}{totals[0]:>8}{totals[1]:>9}{totals[2]:>10}{totals[3]:>8}"
+          f"{totals[4] if has_brotli else '-':>8}")
+    print(f"Assets: {totals[3] / totals[1]:.0%} of the source bytes with gzip"
+          + (f", {totals[4] / totals[1]:.0%} with brotli" if has_brotli else " (install brotli for .br variants)"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.parse_args()
+
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'assets.db')}"
+        run_benchmark()
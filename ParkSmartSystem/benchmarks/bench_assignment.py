@@ -0,0 +1,123 @@
+"""
+Simulation comparing slot assignment strategies.
+Builds a garage of --levels levels with --slots-per-level slots each, then
+replays the same stream of --arrivals arrivals (Poisson, with log-normal
+stays sized for --occupancy average occupancy) under every strategy in
+assignment.STRATEGIES. Reports decisions per second, the mean walk from the
+entrance to the assigned slot, how many levels hold at least one car on
+average (lit and ventilated levels) and how many vehicles were turned away.
+
+Usage:
+  python benchmarks/bench_assignment.py [--levels 6] [--slots-per-level 250] [--arrivals 50000]
+                                        [--occupancy 0.7] [--mean-stay 120]
+"""
+import argparse
+import heapq
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask  # noqa: E402
+
+from assignment import slot_assigner, STRATEGIES  # noqa: E402
+from database import configure_database  # noqa: E402
+from extensions import db  # noqa: E402
+from occupancy import occupancy_index  # noqa: E402
+from utils import init_parking_slots  # noqa: E402
+
+
+def arrival_stream(n_arrivals, capacity, occupancy, mean_stay, seed):
+    """[(arrival_minute, stay_minutes)] shared by every strategy"""
+    rng = random.Random(seed)
+    rate = occupancy * capacity / mean_stay
+    sigma = 0.75
+    mu = math.log(mean_stay) - sigma ** 2 / 2
+    now = 0.0
+    stream = []
+    for _ in range(n_arrivals):
+        now += rng.expovariate(rate)
+        stream.append((now, rng.lognormvariate(mu, sigma)))
+    return stream
+
+
+def simulate(strategy, stream, area_of):
+    occupancy_index.warm()
+    slot_assigner.configure(strategy)
+    random.seed(0)
+
+    departures = []
+    cars_per_area = {}
+    decisions = []
+    walked = 0.0
+    parked = 0
+    rejected = 0
+    areas_in_use = 0
+    for arrival, stay in stream:
+        while departures and departures[0][0] <= arrival:
+            _, slot_id = heapq.heappop(departures)
+            occupancy_index.set_occupied(slot_id, False)
+            cars_per_area[area_of[slot_id]] -= 1
+
+        started = time.perf_counter()
+        slot = slot_assigner.assign('indoor')
+        decisions.append(time.perf_counter() - started)
+
+        areas_in_use += sum(1 for cars in cars_per_area.values() if cars)
+        if slot is None:
+            rejected += 1
+            continue
+        occupancy_index.set_occupied(slot.id, True)
+        cars_per_area[slot.area] = cars_per_area.get(slot.area, 0) + 1
+        heapq.heappush(departures, (arrival + stay, slot.id))
+        walked += slot_assigner.distance(slot.id)
+        parked += 1
+
+    decisions.sort()
+    return {
+        'per_second': len(decisions) / sum(decisions),
+        'p99_us': decisions[int(len(decisions) * 0.99)] * 1e6,
+        'walk_m': walked / parked,
+        'levels_in_use': areas_in_use / len(stream),
+        'rejected': rejected,
+    }
+
+
+def run_benchmark(levels, slots_per_level, n_arrivals, occupancy, mean_stay, seed):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'assignment.db')}"
+        configure_database(app)
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            init_parking_slots(levels, slots_per_level, 0, 0, occupied_ratio=0)
+            occupancy_index.warm()
+            area_of = {slot.id: slot.area for slot in occupancy_index.slots('indoor')}
+            stream = arrival_stream(n_arrivals, len(area_of), occupancy, mean_stay, seed)
+
+            print(f"Levels: {levels} x {slots_per_level} slots, arrivals: {n_arrivals}, "
+                  f"target occupancy: {occupancy:.0%}, mean stay: {mean_stay} min")
+            print(f"{'strategy':<18}{'decisions/s':>12}{'p99 us':>9}{'walk m':>9}{'levels lit':>12}{'rejected':>10}")
+            for strategy in STRATEGIES:
+                result = simulate(strategy, stream, area_of)
+                print(f"{strategy:<18}{result['per_second']:>12.0f}{result['p99_us']:>9.1f}"
+                      f"{result['walk_m']:>9.1f}{result['levels_in_use']:>12.2f}{result['rejected']:>10}")
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--levels', type=int, default=6)
+    parser.add_argument('--slots-per-level', type=int, default=250)
+    parser.add_argument('--arrivals', type=int, default=50000)
+    parser.add_argument('--occupancy', type=float, default=0.7)
+    parser.add_argument('--mean-stay', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    run_benchmark(args.levels, args.slots_per_level, args.arrivals, args.occupancy, args.mean_stay, args.seed)
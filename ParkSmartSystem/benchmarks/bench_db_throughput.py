@@ -0,0 +1,205 @@
+"""
+Load benchmark for parking entry/exit throughput per database backend.
+Writer processes act as gates that park and release vehicles (conditional
+slot UPDATE, record INSERT, then record close and slot release, one commit
+each), while reader processes repeatedly list free slots and recent history
+as the web pages do. Each process uses its own engine configured by
+database.configure_database, as a gunicorn worker would.
+
+Usage:
+  python benchmarks/bench_db_throughput.py [--writers 8] [--readers 4] [--seconds 10]
+                                           [--slots 200] [--journal-mode WAL]
+                                           [--database-url postgresql://...]
+
+Without --database-url a temporary SQLite file is used; compare
+--journal-mode DELETE (the old default) with WAL. For PostgreSQL the URL
+names an existing database on the server; the benchmark creates and drops
+its own scratch database next to it.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import configure_database, normalize_url  # noqa: E402
+from extensions import db  # noqa: E402
+from models import User, Vehicle, ParkingSlot, ParkingRecord  # noqa: E402
+from utils import claim_slot, release_slot, close_parking_record  # noqa: E402
+
+SCRATCH_DATABASE = 'parking_bench'
+
+
+def create_bench_app(url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    configure_database(app)
+    db.init_app(app)
+    return app
+
+
+def seed(url, n_slots, n_writers):
+    app = create_bench_app(url)
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.flush()
+        for i in range(n_writers):
+            db.session.add(Vehicle(license_plate=f'BENCH{i:03d}', user_id=user.id))
+        for i in range(n_slots):
+            db.session.add(ParkingSlot(slot_number=f'B{i:04d}', location='indoor',
+                                       area=f'Level {i % 3 + 1}', is_occupied=False))
+        db.session.commit()
+        user_id = user.id
+        slot_ids = [slot_id for (slot_id,) in db.session.query(ParkingSlot.id)]
+        db.session.remove()
+        db.engine.dispose()
+    return user_id, slot_ids
+
+
+def writer(url, gate, user_id, slot_ids, deadline, results):
+    app = create_bench_app(url)
+    stats = Counter()
+    latencies = []
+    with app.app_context():
+        while time.time() < deadline:
+            slot_id = random.choice(slot_ids)
+            started = time.perf_counter()
+            try:
+                if not claim_slot(slot_id):
+                    db.session.rollback()
+                    stats['rejected'] += 1
+                    continue
+                record = ParkingRecord(user_id=user_id, vehicle_id=gate + 1, slot_id=slot_id,
+                                       parking_type='Indoor')
+                db.session.add(record)
+                db.session.commit()
+                record_id = record.id
+
+                close_parking_record(record_id, datetime.utcnow())
+                release_slot(slot_id)
+                db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                stats['errors'] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            stats['cycles'] += 1
+        db.session.remove()
+        db.engine.dispose()
+    results.put(('writer', stats, latencies))
+
+
+def reader(url, user_id, deadline, results):
+    app = create_bench_app(url)
+    stats = Counter()
+    latencies = []
+    with app.app_context():
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                ParkingSlot.query.filter_by(location='indoor', is_occupied=False).all()
+                ParkingRecord.query.filter_by(user_id=user_id).order_by(
+                    ParkingRecord.entry_time.desc()
+                ).limit(20).all()
+                db.session.rollback()
+            except OperationalError:
+                db.session.rollback()
+                stats['errors'] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            stats['reads'] += 1
+        db.session.remove()
+        db.engine.dispose()
+    results.put(('reader', stats, latencies))
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_processes(url, n_writers, n_readers, n_slots, seconds):
+    user_id, slot_ids = seed(url, n_slots, n_writers)
+    results = multiprocessing.Queue()
+    deadline = time.time() + seconds
+    processes = [multiprocessing.Process(target=writer, args=(url, gate, user_id, slot_ids, deadline, results))
+                 for gate in range(n_writers)]
+    processes += [multiprocessing.Process(target=reader, args=(url, user_id, deadline, results))
+                  for _ in range(n_readers)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    totals = {'writer': Counter(), 'reader': Counter()}
+    latencies = {'writer': [], 'reader': []}
+    for kind, stats, values in collected:
+        totals[kind].update(stats)
+        latencies[kind].extend(values)
+
+    writes, reads = totals['writer'], totals['reader']
+    print(f"Backend: {make_url(url).get_backend_name()}"
+          + (f" (journal_mode={os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')})"
+             if url.startswith('sqlite') else ''))
+    print(f"Writers: {n_writers}, readers: {n_readers}, slots: {n_slots}, duration: {elapsed:.1f} s")
+    print(f"Entry+exit cycles:  {writes['cycles']} ({writes['cycles'] / elapsed:.0f}/s), "
+          f"p50 {percentile(latencies['writer'], 0.5) * 1e3:.1f} ms, "
+          f"p99 {percentile(latencies['writer'], 0.99) * 1e3:.1f} ms")
+    print(f"Reads:              {reads['reads']} ({reads['reads'] / elapsed:.0f}/s), "
+          f"p50 {percentile(latencies['reader'], 0.5) * 1e3:.1f} ms, "
+          f"p99 {percentile(latencies['reader'], 0.99) * 1e3:.1f} ms")
+    print(f"Rejected claims: {writes['rejected']}, lock errors: {writes['errors'] + reads['errors']}")
+
+
+def run_benchmark(database_url, n_writers, n_readers, n_slots, seconds):
+    if database_url is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            run_processes(f"sqlite:///{os.path.join(tmp, 'bench.db')}", n_writers, n_readers, n_slots, seconds)
+        return
+
+    # Work in a scratch database so the target database is never touched
+    database_url = normalize_url(database_url)
+    admin = create_engine(database_url, isolation_level='AUTOCOMMIT')
+    with admin.connect() as connection:
+        connection.execute(text(f"DROP DATABASE IF EXISTS {SCRATCH_DATABASE}"))
+        connection.execute(text(f"CREATE DATABASE {SCRATCH_DATABASE}"))
+    try:
+        url = make_url(database_url).set(database=SCRATCH_DATABASE)
+        run_processes(url.render_as_string(hide_password=False), n_writers, n_readers, n_slots, seconds)
+    finally:
+        with admin.connect() as connection:
+            connection.execute(text(f"DROP DATABASE IF EXISTS {SCRATCH_DATABASE}"))
+        admin.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--slots', type=int, default=200)
+    parser.add_argument('--journal-mode', default='WAL', help='SQLite journal mode, e.g. WAL or DELETE')
+    parser.add_argument('--database-url', help='PostgreSQL server to benchmark instead of SQLite')
+    args = parser.parse_args()
+    # Read by database.py in every worker process
+    os.environ['SQLITE_JOURNAL_MODE'] = args.journal_mode
+    run_benchmark(args.database_url, args.writers, args.readers, args.slots, args.seconds)
@@ -0,0 +1,187 @@
+"""
+Benchmark of exit gate verification with signed exit tokens.
+Reports, for --tokens tokens of open parking records:
+
+  issue        signing a token, as the digital card does for each active parking
+  verify       checking a token's signature and age, the CPU work at the gate
+  forged       rejecting a token with a flipped bit
+  seen-set     verify plus the replay check, with --seen-size records remembered
+
+and then lets --cars parked vehicles out through /api/parking-exit, half by
+record_id (the record is read and closed in the request) and half by token
+(checked in memory, written behind the request), with their latency and the
+SQL statements each request ran. Once the token exits have been written,
+their records are checked against the fees the gate reported and every
+token is presented again, which must be refused.
+
+Usage:
+  python benchmarks/bench_exit_tokens.py [--tokens 100000] [--seen-size 100000] [--cars 1000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+
+PASSWORD = 'bench'
+Record = namedtuple('Record', ['id', 'user_id', 'vehicle_id', 'slot_id', 'entry_time', 'parking_type'])
+
+
+def timed(label, function, values):
+    started = time.perf_counter()
+    for value in values:
+        function(value)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<12}{len(values) / elapsed:>14,.0f}{elapsed / len(values) * 1e6:>10.2f}")
+
+
+def bench_tokens(app, args):
+    from exit_tokens import InvalidExitToken, exit_gate
+
+    gate = exit_gate.for_facility()
+    gate.seen_size = args.seen_size
+    now = datetime.utcnow()
+    records = [Record(i, i % 5000 + 1, i % 7000 + 1, i % 900 + 1, now - timedelta(minutes=i % 600), 'Indoor')
+               for i in range(1, args.tokens + 1)]
+    tokens = [gate.issue(record) for record in records]
+    # Flip one bit of the signature
+    forged = [token[:-2] + ('A' if token[-2] != 'A' else 'B') + token[-1] for token in tokens]
+
+    def reject(token):
+        try:
+            gate.verify(token)
+        except InvalidExitToken:
+            return
+        raise AssertionError('A forged token was accepted')
+
+    def check_once(token):
+        claims = gate.verify(token)
+        with gate._condition:
+            gate._forget_expired(now)
+            if claims.record_id in gate._seen:
+                raise AssertionError('Token seen twice')
+            gate._seen[claims.record_id] = claims.issued_at + gate.max_age
+            if len(gate._seen) > gate.seen_size:
+                gate._seen.popitem(last=False)
+
+    print(f"Token length: {len(tokens[0])} characters")
+    print(f"{'':<12}{'per second':>14}{'µs each':>10}")
+    timed('issue', gate.issue, records)
+    timed('verify', gate.verify, tokens)
+    timed('forged', reject, forged)
+    timed('seen-set', check_once, tokens)
+    gate._seen.clear()
+
+
+def seed(app, n_cars):
+    from commands import init_database
+    from extensions import db
+    from gate_events import apply_gate_events
+    from models import ParkingRecord, ParkingSlot, User, Vehicle
+    from sqlalchemy import insert
+
+    with app.app_context():
+        init_database()
+        user = User(username='exits', email='exits@example.com')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.flush()
+        db.session.execute(insert(Vehicle), [
+            {'license_plate': f'EX-{i:05d}', 'user_id': user.id} for i in range(n_cars)
+        ])
+        vehicle_ids = [vehicle_id for vehicle_id, in db.session.query(Vehicle.id).filter_by(user_id=user.id)]
+        slot_ids = [slot_id for slot_id, in db.session.query(ParkingSlot.id).filter_by(is_occupied=False)]
+        db.session.commit()
+        # Parked an hour ago, so every exit is charged
+        entry = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+        apply_gate_events([{'type': 'entry', 'vehicle_id': vehicle_id, 'slot_id': slot_id,
+                            'parking_type': 'Indoor', 'timestamp': entry}
+                           for vehicle_id, slot_id in zip(vehicle_ids, slot_ids)])
+        records = ParkingRecord.query.filter(ParkingRecord.exit_time.is_(None)).order_by(ParkingRecord.id).all()
+        db.session.expunge_all()
+        db.session.remove()
+    return records
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def exit_all(label, client, bodies):
+    from query_stats import count_queries
+
+    latencies, statements, responses = [], 0, []
+    for body in bodies:
+        with count_queries() as queries:
+            started = time.perf_counter()
+            response = client.post('/api/parking-exit', json=body)
+            latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.get_json()
+        statements += queries.count
+        responses.append(response.get_json())
+    print(f"{label:<12}{len(bodies) / sum(latencies):>10,.0f}{percentile(latencies, 0.5) * 1e3:>10.2f}"
+          f"{percentile(latencies, 0.99) * 1e3:>10.2f}{statements / len(bodies):>12.1f}")
+    return responses
+
+
+def bench_gate(app, args):
+    from extensions import db
+    from exit_tokens import exit_gate
+    from models import ParkingRecord
+
+    records = seed(app, args.cars)
+    by_id, by_token = records[::2], records[1::2]
+    with app.app_context():
+        tokens = [exit_gate.issue(record) for record in by_token]
+    client = app.test_client()
+    client.post('/login', data={'username': 'exits', 'password': PASSWORD})
+    # Warm the user cache and the occupancy index first
+    client.get('/api/parking-slots')
+
+    print(f"\n{'exit by':<12}{'exits/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'statements':>12}")
+    exit_all('record_id', client, [{'record_id': record.id} for record in by_id])
+    responses = exit_all('token', client, [{'token': token} for token in tokens])
+
+    with app.app_context():
+        started = time.perf_counter()
+        exit_gate.flush()
+        print(f"Token exits written {time.perf_counter() - started:.2f} s after the last one, "
+              f"in {exit_gate.stats['batches']} transactions")
+        fees = dict(db.session.query(ParkingRecord.id, ParkingRecord.fee).filter(
+            ParkingRecord.id.in_([record.id for record in by_token]), ParkingRecord.exit_time.isnot(None)))
+        db.session.remove()
+    mismatched = sum(fees.get(response['record_id']) != response['fee'] for response in responses)
+    replayed = sum(client.post('/api/parking-exit', json={'token': token}).status_code == 200 for token in tokens)
+    print(f"Written: {len(fees)} of {len(tokens)}, fees differing from the gate's: {mismatched}, "
+          f"replays let out: {replayed}")
+    if len(fees) != len(tokens) or mismatched or replayed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--tokens', type=int, default=100000)
+    parser.add_argument('--seen-size', type=int, default=100000)
+    parser.add_argument('--cars', type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    with tempfile.TemporaryDirectory() as tmp:
+        from app import create_app
+
+        config = {
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(tmp, 'exits.db')}",
+            'METRICS_ENABLED': False,
+            'FACILITIES': {'main': {'name': 'Main', 'layout': {'indoor_levels': 1, 'slots_per_level': args.cars,
+                                                               'outdoor_lots': 0, 'occupied_ratio': 0}}},
+        }
+        app = create_app(config)
+        with app.app_context():
+            bench_tokens(app, args)
+        bench_gate(app, args)
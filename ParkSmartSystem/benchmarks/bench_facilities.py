@@ -0,0 +1,183 @@
+"""
+Benchmark of how a busy facility slows down the others.
+Sets up --facilities car parks; --busy-gates processes park and release
+cars at the first one as fast as they can through /api/parking-entry and
+/api/parking-exit, while --quiet-gates processes do the same at random
+other facilities and record their latency. Each process runs its own app,
+as a gunicorn worker would, and visits each of its facilities once before
+the clock starts. Two layouts are compared:
+
+  shared   every facility in the main SQLite database, so all sites take
+           turns on its write lock
+  split    a SQLite file per facility (FACILITY_DATABASE_URL)
+
+Each layout runs once with the quiet gates alone and once next to the busy
+site. SQLite runs with synchronous=FULL (an fsync per commit) unless
+SQLITE_SYNCHRONOUS says otherwise.
+
+Usage:
+  python benchmarks/bench_facilities.py [--facilities 100] [--busy-gates 4] [--quiet-gates 2]
+                                        [--seconds 10] [--dir /path/on/real/disk]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+
+PASSWORD = 'bench'
+
+
+def facility_codes(n_facilities):
+    return [f'site{i:03d}' for i in range(n_facilities)]
+
+
+def bench_config(database_url, facility_url, n_facilities, n_slots):
+    layout = {'indoor_levels': 1, 'slots_per_level': n_slots, 'outdoor_lots': 0, 'occupied_ratio': 0}
+    return {
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'FACILITIES': {code: {'name': code, 'layout': layout} for code in facility_codes(n_facilities)},
+        'FACILITY_DATABASE_URL': facility_url,
+        'METRICS_ENABLED': False,
+    }
+
+
+def seed(config, n_gates, results):
+    from app import create_app
+    from commands import init_database
+    from extensions import db
+    from facilities import use_facility
+    from models import ParkingSlot, User, Vehicle
+
+    app = create_app(config)
+    with app.app_context():
+        init_database()
+        for i in range(n_gates):
+            user = User(username=f'gate{i}', email=f'gate{i}@example.com')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Vehicle(license_plate=f'FG-{i:04d}', user_id=user.id))
+        db.session.commit()
+        slot_ids = {}
+        for code in config['FACILITIES']:
+            with use_facility(code):
+                slot_ids[code] = [slot_id for slot_id, in
+                                  db.session.query(ParkingSlot.id).order_by(ParkingSlot.slot_number)]
+        db.session.remove()
+    results.put(slot_ids)
+
+
+def park_and_leave(client, index, facility, slot_ids):
+    """Park vehicle index + 1 in slot index of the facility and take it out again; False on an error"""
+    headers = {'X-Facility': facility}
+    response = client.post('/api/parking-entry', json={'vehicle_id': index + 1,
+                                                       'slot_id': slot_ids[facility][index]}, headers=headers)
+    if response.status_code != 200:
+        return False
+    response = client.post('/api/parking-exit', json={'record_id': response.get_json()['record_id']},
+                           headers=headers)
+    return response.status_code == 200
+
+
+def gate(config, index, facilities, slot_ids, start, seconds, results, busy=False):
+    from app import create_app
+
+    app = create_app(config)
+    client = app.test_client()
+    client.post('/login', data={'username': f'gate{index}', 'password': PASSWORD})
+    # Open each facility's engine and indexes before measuring
+    for facility in facilities:
+        park_and_leave(client, index, facility, slot_ids)
+    start.wait()
+    deadline = time.time() + seconds
+
+    stats = Counter()
+    latencies = []
+    while time.time() < deadline:
+        started = time.perf_counter()
+        if not park_and_leave(client, index, random.choice(facilities), slot_ids):
+            stats['errors'] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        stats['cycles'] += 1
+    results.put((busy, stats, latencies))
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_mode(label, config, slot_ids, n_busy, n_quiet, seconds):
+    codes = list(config['FACILITIES'])
+    busy, quiet = codes[:1], codes[1:]
+    results = multiprocessing.Queue()
+    start = multiprocessing.Barrier(n_busy + n_quiet)
+    # Busy gates use the first slots, quiet gates the ones after them
+    processes = [multiprocessing.Process(target=gate, args=(config, i, busy, slot_ids, start, seconds, results, True))
+                 for i in range(n_busy)]
+    processes += [multiprocessing.Process(target=gate, args=(config, n_busy + i, quiet, slot_ids, start, seconds,
+                                                             results))
+                  for i in range(n_quiet)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    totals = {True: Counter(), False: Counter()}
+    latencies = []
+    for is_busy, stats, values in collected:
+        totals[is_busy].update(stats)
+        if not is_busy:
+            latencies.extend(values)
+    errors = totals[True]['errors'] + totals[False]['errors']
+    print(f"{label:<14}{totals[True]['cycles'] / seconds:>10.0f}{totals[False]['cycles'] / seconds:>11.0f}"
+          f"{percentile(latencies, 0.5) * 1e3:>10.1f}{percentile(latencies, 0.99) * 1e3:>10.1f}"
+          f"{max(latencies, default=float('nan')) * 1e3:>10.1f}{errors:>8}")
+
+
+def run_layout(layout, args, tmp):
+    database_url = f"sqlite:///{os.path.join(tmp, layout, 'main.db')}"
+    facility_url = f"sqlite:///{os.path.join(tmp, layout, '{facility}.db')}" if layout == 'split' else None
+    os.makedirs(os.path.join(tmp, layout))
+    config = bench_config(database_url, facility_url, args.facilities, args.busy_gates + args.quiet_gates)
+
+    # Seeded in a process of its own so this one holds no per-facility state
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=seed, args=(config, args.busy_gates + args.quiet_gates, results))
+    process.start()
+    slot_ids = results.get()
+    process.join()
+
+    run_mode(f'{layout} idle', config, slot_ids, 0, args.quiet_gates, args.seconds)
+    run_mode(f'{layout} busy', config, slot_ids, args.busy_gates, args.quiet_gates, args.seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--facilities', type=int, default=100)
+    parser.add_argument('--busy-gates', type=int, default=4)
+    parser.add_argument('--quiet-gates', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--dir', help='Directory for the SQLite files (default: the system temporary directory)')
+    args = parser.parse_args()
+
+    # Read when each new connection is opened
+    os.environ.setdefault('SQLITE_SYNCHRONOUS', 'FULL')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    print(f"Facilities: {args.facilities}, busy gates: {args.busy_gates}, quiet gates: {args.quiet_gates}, "
+          f"{args.seconds} s per run")
+    print(f"{'layout':<14}{'busy/s':>10}{'quiet/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for layout in ('shared', 'split'):
+            run_layout(layout, args, tmp)
@@ -0,0 +1,165 @@
+"""
+Benchmark of availability forecast training and lookups.
+Seeds --records synthetic stays spread over --days days (rush hours, quiet
+weekends, a long tail of all-day stays) and reports:
+
+  rebuild      `retrain-forecast --rebuild` over every day but the last
+  nightly      the incremental retrain of the last day alone
+  lookup       AvailabilityForecaster.forecast from the in-memory table,
+               with and without the live adjustment
+  sql          the same question answered on demand: one COUNT of the
+               stays parked at that time on every past same weekday
+
+The incremental profiles are checked against a rebuild over all days.
+
+Usage:
+  python benchmarks/bench_forecast.py [--records 1000000] [--days 120] [--lookups 100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, insert
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+
+INSERT_CHUNK_SIZE = 50000
+# Relative arrivals per hour of the day
+HOURLY_ARRIVALS = np.array([1, 1, 1, 1, 1, 2, 4, 9, 12, 9, 6, 6, 7, 6, 6, 7, 8, 9, 7, 5, 4, 3, 2, 1], dtype=float)
+
+
+def synthetic_stays(rng, n_records, first_day, n_days, slot_ids):
+    day = rng.integers(0, n_days, n_records)
+    weekend = (np.array([(first_day + timedelta(days=int(d))).weekday() for d in range(n_days)]) >= 5)[day]
+    # Weekends draw from a flatter profile
+    hour = np.where(weekend, rng.integers(8, 20, n_records),
+                    rng.choice(24, n_records, p=HOURLY_ARRIVALS / HOURLY_ARRIVALS.sum()))
+    entry = day * 1440 + hour * 60 + rng.integers(0, 60, n_records)
+    dwell = np.where(rng.random(n_records) < 0.9, rng.lognormal(4.5, 0.8, n_records), rng.uniform(480, 720, n_records))
+    order = np.argsort(entry)
+    return entry[order], (entry + dwell)[order], rng.choice(slot_ids, n_records)
+
+
+def insert_stays(user_id, vehicle_id, first_day, entries, exits, slots):
+    from extensions import db
+    from models import ParkingRecord
+
+    start = datetime.combine(first_day, datetime.min.time())
+    for offset in range(0, len(entries), INSERT_CHUNK_SIZE):
+        db.session.execute(insert(ParkingRecord), [
+            {'user_id': user_id, 'vehicle_id': vehicle_id, 'slot_id': int(slot),
+             'entry_time': start + timedelta(minutes=float(entry)), 'exit_time': start + timedelta(minutes=float(exit)),
+             'parking_type': 'Indoor', 'fee': 0.0, 'payment_status': 'Paid', 'status': 'completed'}
+            for entry, exit, slot in zip(entries[offset:offset + INSERT_CHUNK_SIZE],
+                                         exits[offset:offset + INSERT_CHUNK_SIZE],
+                                         slots[offset:offset + INSERT_CHUNK_SIZE])
+        ])
+    db.session.commit()
+
+
+def profile_rows():
+    from models import ForecastProfile
+
+    return {
+        (row.area, row.weekday, row.time_bin): (row.days, row.arrivals, round(row.occupied, 6), row.full_days,
+                                                row.departures, round(row.dwell_minutes, 3))
+        for row in ForecastProfile.query
+    }
+
+
+def sql_forecast(area, at, first_day):
+    """Average occupancy at the same time on every past same weekday, counted on demand"""
+    from extensions import db
+    from models import ParkingRecord, ParkingSlot
+
+    counts = []
+    moment = at - timedelta(days=7)
+    while moment.date() >= first_day:
+        counts.append(db.session.query(func.count(ParkingRecord.id)).join(ParkingSlot).filter(
+            ParkingSlot.area == area, ParkingRecord.entry_time <= moment, ParkingRecord.exit_time > moment
+        ).scalar())
+        moment -= timedelta(days=7)
+    return sum(counts) / len(counts) if counts else None
+
+
+def run_benchmark(args):
+    from app import create_app
+    from extensions import db
+    from forecast import forecaster
+    from models import User, Vehicle, ParkingSlot
+    from occupancy import occupancy_index
+    from utils import init_parking_slots
+
+    app = create_app({'METRICS_ENABLED': False})
+    rng = np.random.default_rng(7)
+    first_day = (datetime.utcnow() - timedelta(days=args.days)).date()
+    last_day = first_day + timedelta(days=args.days - 1)
+
+    with app.app_context():
+        db.create_all()
+        init_parking_slots(5, 200, 3, 200, occupied_ratio=0)
+        user = User(username='forecast', email='forecast@example.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.flush()
+        vehicle = Vehicle(license_plate='FC-0001', user_id=user.id)
+        db.session.add(vehicle)
+        db.session.commit()
+        slot_ids = np.array([slot_id for slot_id, in db.session.query(ParkingSlot.id)])
+        areas = sorted({area for area, in db.session.query(ParkingSlot.area)})
+
+        entries, exits, slots = synthetic_stays(rng, args.records, first_day, args.days, slot_ids)
+        # The last day is trained by the nightly retrain
+        history = entries < (args.days - 1) * 1440
+        started = time.perf_counter()
+        insert_stays(user.id, vehicle.id, first_day, entries[history], exits[history], slots[history])
+        print(f"Records: {args.records} over {args.days} days, {len(areas)} areas "
+              f"(seeded in {time.perf_counter() - started:.1f} s)")
+
+        started = time.perf_counter()
+        days = forecaster.retrain(rebuild=True, until=last_day)
+        print(f"rebuild      {time.perf_counter() - started:8.2f} s   {days} days, {int(history.sum())} records")
+
+        insert_stays(user.id, vehicle.id, first_day, entries[~history], exits[~history], slots[~history])
+        started = time.perf_counter()
+        days = forecaster.retrain(until=last_day + timedelta(days=1))
+        print(f"nightly      {time.perf_counter() - started:8.2f} s   {days} day, {int((~history).sum())} records")
+
+        incremental = profile_rows()
+        forecaster.retrain(rebuild=True, until=last_day + timedelta(days=1))
+        mismatches = sum(incremental.get(key) != values for key, values in profile_rows().items())
+
+        occupancy_index.warm()
+        forecaster.load()
+        now = datetime.utcnow()
+        times = [now + timedelta(minutes=int(minutes)) for minutes in rng.integers(0, 7 * 1440, args.lookups)]
+        names = [areas[i] for i in rng.integers(0, len(areas), args.lookups)]
+        for label, horizon in (('lookup live', [now + timedelta(hours=1)] * args.lookups), ('lookup', times)):
+            started = time.perf_counter()
+            for area, at in zip(names, horizon):
+                forecaster.forecast(area, at, now)
+            print(f"{label:<13}{(time.perf_counter() - started) / args.lookups * 1e6:8.2f} us/forecast")
+
+        n_sql = 20
+        started = time.perf_counter()
+        for area, at in zip(names[:n_sql], times[:n_sql]):
+            sql_forecast(area, at, first_day)
+        print(f"sql          {(time.perf_counter() - started) / n_sql * 1e3:8.2f} ms/forecast")
+        print(f"Incremental vs. rebuilt profiles: {mismatches} mismatched rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'forecast.db')}"
+        run_benchmark(args)
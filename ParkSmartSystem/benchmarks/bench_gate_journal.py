@@ -0,0 +1,148 @@
+"""
+Benchmark of gate entry/exit latency with and without the gate journal.
+--gates threads each park a car in a slot of their own and take it out
+again through /api/parking-entry and /api/parking-exit, for --seconds per
+mode:
+
+  direct-full    a transaction per request, SQLite synchronous=FULL (an
+                 fsync per commit, as on a database that guarantees
+                 durability)
+  direct-normal  a transaction per request, SQLite synchronous=NORMAL (the
+                 default: WAL commits are not synced)
+  journal        GATE_JOURNAL set: requests are acknowledged once the
+                 journal is synced and written to the database behind them
+                 (SQLite synchronous=FULL, batched)
+
+Throughput and p50/p99/max latency are printed per mode, and for the
+journal how many requests shared each fdatasync and how long the database
+took to catch up afterwards. With --database-url the direct mode runs once
+against that database instead of the two SQLite modes.
+
+Usage:
+  python benchmarks/bench_gate_journal.py [--gates 16] [--seconds 10] [--dir /path/on/real/disk]
+                                          [--database-url postgresql://...]
+
+The SQLite files and the journal are created in a temporary directory
+inside --dir (default: the system temporary directory); fsync costs depend
+a lot on that disk. A --database-url must name an empty database.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+
+PASSWORD = 'bench'
+
+
+def seed(app, n_gates):
+    from extensions import db
+    from models import User, Vehicle
+    from utils import init_parking_slots
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for i in range(n_gates):
+            user = User(username=f'gate{i}', email=f'gate{i}@example.com')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Vehicle(license_plate=f'GT-{i:04d}', user_id=user.id))
+        init_parking_slots(1, n_gates, 0, 0, occupied_ratio=0)
+        db.session.commit()
+        db.session.remove()
+
+
+def gate(app, index, deadline, latencies, errors):
+    client = app.test_client()
+    client.post('/login', data={'username': f'gate{index}', 'password': PASSWORD})
+    # Gate i owns vehicle i + 1 and slot i + 1, so gates never collide
+    vehicle_id = slot_id = index + 1
+    while time.time() < deadline:
+        started = time.perf_counter()
+        response = client.post('/api/parking-entry', json={'vehicle_id': vehicle_id, 'slot_id': slot_id})
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+            continue
+        record_id = response.get_json()['record_id']
+        started = time.perf_counter()
+        response = client.post('/api/parking-exit', json={'record_id': record_id})
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+
+def run_mode(mode, database_url, journal_path, n_gates, seconds):
+    from app import create_app
+    from journal import gate_journal
+    from occupancy import occupancy_index
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'GATE_JOURNAL': journal_path,
+        'METRICS_ENABLED': False,
+    })
+    seed(app, n_gates)
+    with app.app_context():
+        occupancy_index.warm()
+
+    latencies, errors = [], []
+    deadline = time.time() + seconds
+    threads = [threading.Thread(target=gate, args=(app, i, deadline, latencies, errors)) for i in range(n_gates)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    extra = ''
+    if journal_path:
+        started = time.perf_counter()
+        gate_journal.close()
+        catch_up = time.perf_counter() - started
+        extra = (f"  {len(latencies) / max(gate_journal.stats['syncs'], 1):.1f} requests/fsync, "
+                 f"database caught up {catch_up * 1e3:.0f} ms after")
+        gate_journal.stats.clear()
+    latencies.sort()
+    count = len(latencies)
+    print(f"{mode:<14}{count / seconds:>8.0f}{latencies[count // 2] * 1e3:>10.2f}"
+          f"{latencies[int(count * 0.99)] * 1e3:>10.2f}{latencies[-1] * 1e3:>10.2f}{len(errors):>8}{extra}")
+
+    from extensions import db
+    with app.app_context():
+        db.engine.dispose()
+
+
+def run_benchmark(args, tmp):
+    print(f"Gates: {args.gates}, {args.seconds} s per mode")
+    print(f"{'mode':<14}{'req/s':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    if args.database_url:
+        run_mode('direct', args.database_url, None, args.gates, args.seconds)
+        run_mode('journal', args.database_url, os.path.join(tmp, 'gate.journal'), args.gates, args.seconds)
+        return
+    for synchronous in ('FULL', 'NORMAL'):
+        # Read when each new connection is opened
+        os.environ['SQLITE_SYNCHRONOUS'] = synchronous
+        run_mode(f'direct-{synchronous.lower()}', f"sqlite:///{os.path.join(tmp, f'direct-{synchronous}.db')}",
+                 None, args.gates, args.seconds)
+    # The journal is truncated once applied, so the database must still sync its own commits
+    os.environ['SQLITE_SYNCHRONOUS'] = 'FULL'
+    run_mode('journal', f"sqlite:///{os.path.join(tmp, 'journal.db')}", os.path.join(tmp, 'gate.journal'),
+             args.gates, args.seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--gates', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--dir', help='Directory for the SQLite files and the journal')
+    parser.add_argument('--database-url', help='An empty database to fill (default: temporary SQLite)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        run_benchmark(args, tmp)
@@ -0,0 +1,336 @@
+"""
+Load test of gate and kiosk traffic through the whole application.
+Seeds a database with --users users (one vehicle each) and a car park of
+about --slots slots, then runs --clients virtual clients for --seconds.
+Each client logs in as its own user and repeatedly picks a scenario from
+--mix by weight:
+
+  gate       detect its plate, park in the suggested slot, then exit
+  poll       list the free indoor or outdoor slots, as the parking pages do
+  dashboard  open the dashboard
+
+With --target client the app runs in this process behind the Flask test
+client. With --target gunicorn, `gunicorn --preload main:app` is started
+with --workers workers on a local port and driven over HTTP. Throughput and
+p50/p99 latency are printed per request, and --output also saves them as
+JSON, with the git commit and the options, so that runs on different
+commits can be diffed.
+
+Usage:
+  python benchmarks/bench_load.py [--target client|gunicorn] [--users 2000] [--slots 1000]
+                                  [--clients 8] [--seconds 20] [--warmup 2]
+                                  [--mix gate=2,poll=5,dashboard=1] [--workers 4]
+                                  [--database-url postgresql://...] [--output results.json]
+
+Without --database-url a temporary SQLite file is used. A --database-url
+must name an empty database; the benchmark creates its tables and fills it.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar
+
+from sqlalchemy import insert
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+
+PASSWORD = 'bench'
+AREAS_PER_LOCATION = 5
+SEED_BATCH_SIZE = 5000
+
+
+def seed(n_users, n_slots):
+    """Fill the database named by DATABASE_URL; returns the number of slots"""
+    from app import create_app
+    from extensions import db
+    from models import User, Vehicle, ParkingSlot, normalize_plate
+    from utils import init_parking_slots
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        # Everyone shares one password, stored the way User.set_password does
+        template = User()
+        template.set_password(PASSWORD)
+        password = template.password
+        for first in range(0, n_users, SEED_BATCH_SIZE):
+            ids = range(first, min(first + SEED_BATCH_SIZE, n_users))
+            db.session.execute(insert(User), [
+                {'id': i + 1, 'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password': password}
+                for i in ids
+            ])
+            db.session.execute(insert(Vehicle), [
+                {'id': i + 1, 'license_plate': f'BN-{i:06d}', 'plate_key': normalize_plate(f'BN-{i:06d}'),
+                 'make': 'Bench', 'model': 'Load', 'color': 'Grey', 'user_id': i + 1}
+                for i in ids
+            ])
+        per_area = max(1, n_slots // (2 * AREAS_PER_LOCATION))
+        init_parking_slots(AREAS_PER_LOCATION, per_area, AREAS_PER_LOCATION, per_area, occupied_ratio=0)
+        db.session.commit()
+        total = ParkingSlot.query.count()
+        db.session.remove()
+        db.engine.dispose()
+    return total
+
+
+class TestClientSession:
+    """Requests through the Flask test client of an in-process app"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, username):
+        # A successful login redirects, a failed one renders the form again
+        return self.client.post('/login', data={'username': username, 'password': PASSWORD}).status_code == 302
+
+    def request(self, method, path, payload=None):
+        response = self.client.open(path, method=method, json=payload)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpSession:
+    """Requests over HTTP with a cookie jar of its own"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def _open(self, request):
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                return response.status, response.read(), response.headers.get_content_type()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read(), error.headers.get_content_type()
+
+    def login(self, username):
+        body = urllib.parse.urlencode({'username': username, 'password': PASSWORD}).encode()
+        request = urllib.request.Request(self.base_url + '/login', data=body)
+        # The redirect is followed, so a successful login ends up on the dashboard
+        with self.opener.open(request, timeout=30) as response:
+            return urllib.parse.urlparse(response.geturl()).path == '/dashboard'
+
+    def request(self, method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        status, body, content_type = self._open(request)
+        return status, json.loads(body) if content_type == 'application/json' else None
+
+
+def gate(session, user, samples):
+    parking_type = random.choice(('Indoor', 'Outdoor'))
+    status, body = timed(samples, 'detect', session, 'POST', '/api/simulate-license-detection',
+                         {'license_plate': f'BN-{user:06d}', 'parking_type': parking_type})
+    if status != 200:
+        return
+    status, body = timed(samples, 'entry', session, 'POST', '/api/parking-entry',
+                         {'vehicle_id': body['vehicle_id'], 'slot_id': body['slot_id'],
+                          'parking_type': parking_type})
+    if status != 200:
+        return
+    timed(samples, 'exit', session, 'POST', '/api/parking-exit', {'record_id': body['record_id']})
+
+
+def poll(session, user, samples):
+    location = random.choice(('indoor', 'outdoor'))
+    timed(samples, 'poll', session, 'GET', f'/api/parking-slots?location={location}')
+
+
+def dashboard(session, user, samples):
+    timed(samples, 'dashboard', session, 'GET', '/dashboard')
+
+
+SCENARIOS = {'gate': gate, 'poll': poll, 'dashboard': dashboard}
+
+
+def timed(samples, name, session, method, path, payload=None):
+    started = time.perf_counter()
+    status, body = session.request(method, path, payload)
+    samples.append((name, started, time.perf_counter() - started, status))
+    return status, body
+
+
+def run_client(make_session, user, mix, deadline, samples, errors):
+    session = make_session()
+    if not session.login(f'bench{user}'):
+        errors.append(f'login failed for bench{user}')
+        return
+    scenarios, weights = zip(*mix.items())
+    while time.perf_counter() < deadline:
+        SCENARIOS[random.choices(scenarios, weights)[0]](session, user, samples)
+
+
+def drive(make_session, n_users, n_clients, seconds, warmup, mix):
+    samples = []
+    errors = []
+    users = random.sample(range(n_users), n_clients)
+    start = time.perf_counter()
+    deadline = start + warmup + seconds
+    threads = [threading.Thread(target=run_client, args=(make_session, user, mix, deadline, samples, errors))
+               for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError('; '.join(errors))
+    measured_from = start + warmup
+    return [sample for sample in samples if sample[1] >= measured_from]
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(samples, seconds):
+    by_name = defaultdict(list)
+    statuses = defaultdict(Counter)
+    for name, _, duration, status in samples:
+        by_name[name].append(duration)
+        statuses[name][status] += 1
+    operations = {}
+    for name in sorted(by_name):
+        durations = sorted(by_name[name])
+        operations[name] = {
+            'requests': len(durations),
+            'per_second': round(len(durations) / seconds, 1),
+            'p50_ms': round(percentile(durations, 0.5) * 1e3, 2),
+            'p99_ms': round(percentile(durations, 0.99) * 1e3, 2),
+            'statuses': {str(status): count for status, count in sorted(statuses[name].items())},
+        }
+    return {
+        'requests': len(samples),
+        'per_second': round(len(samples) / seconds, 1),
+        'server_errors': sum(1 for sample in samples if sample[3] >= 500),
+        'operations': operations,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, env):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', '--preload', 'main:app'],
+        cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            urllib.request.urlopen(base_url + '/login', timeout=1).close()
+            return process, base_url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'unknown scenario {name!r}, expected one of {", ".join(SCENARIOS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def run_load(args, database_url):
+    os.environ['DATABASE_URL'] = database_url
+    random.seed(args.seed)
+    n_slots = seed(args.users, args.slots)
+
+    if args.target == 'gunicorn':
+        process, base_url = start_gunicorn(args.workers, dict(os.environ))
+        try:
+            samples = drive(lambda: HttpSession(base_url), args.users, args.clients, args.seconds,
+                            args.warmup, args.mix)
+        finally:
+            process.terminate()
+            process.wait()
+    else:
+        from app import create_app
+        app = create_app()
+        samples = drive(lambda: TestClientSession(app), args.users, args.clients, args.seconds,
+                        args.warmup, args.mix)
+
+    result = summarize(samples, args.seconds)
+    result.update({
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        # The URL may hold a password, so only the backend is recorded
+        'options': dict({key: value for key, value in vars(args).items() if key not in ('database_url', 'output')},
+                        slots=n_slots, database=database_url.split(':', 1)[0].split('+')[0]),
+    })
+    return result
+
+
+def report(result):
+    options = result['options']
+    print(f"Target: {options['target']}"
+          + (f" ({options['workers']} workers)" if options['target'] == 'gunicorn' else '')
+          + f", database: {options['database']}, users: {options['users']}, slots: {options['slots']}, "
+          f"clients: {options['clients']}, {options['seconds']:g} s")
+    print(f"Total: {result['requests']} requests ({result['per_second']:.0f}/s), "
+          f"server errors: {result['server_errors']}")
+    for name, operation in result['operations'].items():
+        statuses = ', '.join(f'{status}: {count}' for status, count in operation['statuses'].items())
+        print(f"  {name:<10} {operation['requests']:>7} ({operation['per_second']:>7.1f}/s)  "
+              f"p50 {operation['p50_ms']:7.2f} ms  p99 {operation['p99_ms']:7.2f} ms  [{statuses}]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--target', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--slots', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=2, help='Seconds of traffic not measured')
+    parser.add_argument('--mix', type=parse_mix, default='gate=2,poll=5,dashboard=1')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--database-url', help='An empty database to fill (default: temporary SQLite)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Save the results as JSON')
+    args = parser.parse_args()
+    if args.clients > args.users:
+        parser.error('--clients may not exceed --users')
+
+    if args.database_url:
+        result = run_load(args, args.database_url)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            result = run_load(args, f"sqlite:///{os.path.join(tmp, 'load.db')}")
+    report(result)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
@@ -0,0 +1,87 @@
+"""
+Benchmark for fuzzy license plate matching.
+Builds an in-memory key set of N random plates, as plates.PlateLookup does
+for fuzzy mode, and times edit-distance-1 lookups of plates with one OCR
+mistake, compared with a linear scan over all keys.
+
+Usage:
+  python benchmarks/bench_plates.py [--plates 1000000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from models import normalize_plate  # noqa: E402
+from plates import PLATE_ALPHABET, plate_neighbours  # noqa: E402
+
+
+def random_plate(rng):
+    letters = ''.join(rng.choice(PLATE_ALPHABET[:26]) for _ in range(3))
+    digits = ''.join(rng.choice(PLATE_ALPHABET[26:]) for _ in range(4))
+    return f"{letters}-{digits}"
+
+
+def misread(rng, key):
+    position = rng.randrange(len(key))
+    action = rng.choice(['substitute', 'delete', 'insert'])
+    if action == 'substitute':
+        return key[:position] + rng.choice(PLATE_ALPHABET) + key[position + 1:]
+    if action == 'delete':
+        return key[:position] + key[position + 1:]
+    return key[:position] + rng.choice(PLATE_ALPHABET) + key[position:]
+
+
+def within_one_edit(a, b):
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        return sum(x != y for x, y in zip(a, b)) <= 1
+    if len(a) > len(b):
+        a, b = b, a
+    for i in range(len(b)):
+        if a == b[:i] + b[i + 1:]:
+            return True
+    return False
+
+
+def run_benchmark(n_plates, n_queries, seed=7):
+    rng = random.Random(seed)
+
+    start = time.perf_counter()
+    keys = {normalize_plate(random_plate(rng)) for _ in range(n_plates)}
+    build_time = time.perf_counter() - start
+    memory = sys.getsizeof(keys) + sum(sys.getsizeof(key) for key in keys)
+
+    sample = rng.sample(sorted(keys), n_queries)
+    queries = [misread(rng, key) for key in sample]
+
+    start = time.perf_counter()
+    found = 0
+    for query, expected in zip(queries, sample):
+        matches = [candidate for candidate in plate_neighbours(query) if candidate in keys]
+        found += expected in matches or query == expected
+    probe_time = time.perf_counter() - start
+
+    scan_queries = queries[:max(1, n_queries // 100)]
+    start = time.perf_counter()
+    for query in scan_queries:
+        [key for key in keys if within_one_edit(query, key)]
+    scan_time = time.perf_counter() - start
+
+    print(f"Plates: {len(keys)}, queries: {n_queries}")
+    print(f"Key set build:        {build_time:.2f} s, {memory / 1e6:.0f} MB")
+    print(f"Neighbour probing:    {probe_time / n_queries * 1e6:.0f} us/query")
+    print(f"Linear scan:          {scan_time / len(scan_queries) * 1e3:.0f} ms/query")
+    print(f"Recovered plates:     {found}/{n_queries}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--plates', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+    run_benchmark(args.plates, args.queries)
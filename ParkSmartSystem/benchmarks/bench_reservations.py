@@ -0,0 +1,218 @@
+"""
+Benchmark for reservation availability queries and event-day booking load.
+Seeds --slots slots with --bookings future bookings, then times
+"which slots are free from 14:00 to 18:00" and single-slot conflict checks
+with the in-memory interval index against the equivalent SQL queries.
+Finally --processes worker processes book random slots and windows for
+--seconds, as gunicorn workers would, and the database is checked for
+overlapping bookings afterwards.
+
+Usage:
+  python benchmarks/bench_reservations.py [--slots 2000] [--bookings 200000] [--queries 200]
+                                          [--processes 4] [--seconds 10]
+                                          [--database-url postgresql://...]
+
+Without --database-url a temporary SQLite file is used. A --database-url
+must name an empty database; the benchmark creates its tables and fills it.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, exists, insert, select
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app  # noqa: E402
+from extensions import db  # noqa: E402
+from models import User, Vehicle, ParkingSlot, Reservation  # noqa: E402
+from occupancy import occupancy_index  # noqa: E402
+from reservations import book_slot, reservation_index, ReservationConflict  # noqa: E402
+from utils import init_parking_slots  # noqa: E402
+
+HORIZON_DAYS = 14
+N_VEHICLES = 100
+
+
+def seed(n_slots, n_bookings, origin):
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User), [{'id': 1, 'username': 'bench', 'email': 'bench@example.com',
+                                           'password': 'bench'}])
+        db.session.execute(insert(Vehicle), [{'id': i, 'license_plate': f'RS-{i:04d}', 'plate_key': f'RS{i:04d}',
+                                              'user_id': 1} for i in range(1, N_VEHICLES + 1)])
+        per_area = max(1, n_slots // 10)
+        init_parking_slots(5, per_area, 5, per_area, occupied_ratio=0)
+        slot_ids = [slot_id for (slot_id,) in db.session.query(ParkingSlot.id)]
+
+        # Back-to-back bookings of 1-8 hours with gaps, per slot, over the horizon
+        rows = []
+        per_slot = max(1, n_bookings // len(slot_ids))
+        span = timedelta(days=HORIZON_DAYS) / per_slot
+        for slot_id in slot_ids:
+            for i in range(per_slot):
+                start = origin + span * i + timedelta(minutes=random.randint(0, 60))
+                length = min(timedelta(hours=random.randint(1, 8)), span - timedelta(minutes=61))
+                rows.append({'user_id': 1, 'vehicle_id': random.randint(1, N_VEHICLES), 'slot_id': slot_id,
+                             'start_time': start, 'end_time': start + max(length, timedelta(minutes=15)),
+                             'status': 'booked', 'created_at': origin - timedelta(days=1)})
+        for first in range(0, len(rows), 10000):
+            db.session.execute(insert(Reservation), rows[first:first + 10000])
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+    return slot_ids, len(rows)
+
+
+def sql_free_slots(location, start, end):
+    clash = exists().where(and_(
+        Reservation.slot_id == ParkingSlot.id, Reservation.end_time > start,
+        Reservation.start_time < end, Reservation.status == 'booked'
+    ))
+    return db.session.execute(
+        select(ParkingSlot.id).where(ParkingSlot.location == location, ~clash)
+    ).all()
+
+
+def sql_conflict(slot_id, start, end):
+    return db.session.execute(select(Reservation.id).where(
+        Reservation.slot_id == slot_id, Reservation.end_time > start,
+        Reservation.start_time < end, Reservation.status == 'booked'
+    ).limit(1)).first()
+
+
+def timed(function, windows):
+    durations = []
+    for window in windows:
+        started = time.perf_counter()
+        function(*window)
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1e3
+
+
+def run_queries(slot_ids, n_queries, origin):
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        occupancy_index.warm()
+        reservation_index.warm()
+        print(f"Index warm-up:                  {(time.perf_counter() - started) * 1e3:.0f} ms")
+
+        windows = []
+        for _ in range(n_queries):
+            start = origin + timedelta(days=random.uniform(0, HORIZON_DAYS), hours=3)
+            windows.append((start, start + timedelta(hours=4)))
+        slot_windows = [(random.choice(slot_ids), start, end) for start, end in windows]
+
+        index_free = timed(lambda start, end: reservation_index.free_slots('indoor', start, end), windows)
+        sql_free = timed(lambda start, end: sql_free_slots('indoor', start, end), windows)
+        index_check = timed(reservation_index.conflicts, slot_windows)
+        sql_check = timed(sql_conflict, slot_windows)
+        print(f"Free slots for a 4 h window:    index {index_free:.3f} ms, SQL {sql_free:.3f} ms (median)")
+        print(f"Conflict check of one slot:     index {index_check * 1e3:.1f} us, SQL {sql_check * 1e3:.1f} us")
+
+        start, end = windows[0]
+        assert {slot.id for slot in reservation_index.free_slots('indoor', start, end)} == \
+            {slot_id for (slot_id,) in sql_free_slots('indoor', start, end)}
+        db.session.remove()
+        db.engine.dispose()
+
+
+def booker(slot_ids, origin, deadline, results):
+    app = create_app()
+    stats = Counter()
+    latencies = []
+    with app.app_context():
+        while time.time() < deadline:
+            # Event day: everyone wants the same few hours
+            start = origin + timedelta(days=HORIZON_DAYS + 1, minutes=15 * random.randint(0, 16))
+            end = start + timedelta(hours=random.randint(1, 4))
+            started = time.perf_counter()
+            try:
+                book_slot(1, random.randint(1, N_VEHICLES), random.choice(slot_ids), start, end)
+                db.session.commit()
+                stats['booked'] += 1
+            except ReservationConflict:
+                db.session.rollback()
+                stats['conflicts'] += 1
+            except OperationalError:
+                db.session.rollback()
+                stats['errors'] += 1
+            latencies.append(time.perf_counter() - started)
+        db.session.remove()
+        db.engine.dispose()
+    results.put((stats, latencies))
+
+
+def run_bookers(slot_ids, n_processes, seconds, origin):
+    results = multiprocessing.Queue()
+    deadline = time.time() + seconds
+    processes = [multiprocessing.Process(target=booker, args=(slot_ids, origin, deadline, results))
+                 for _ in range(n_processes)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    stats = Counter()
+    latencies = []
+    for process_stats, values in collected:
+        stats.update(process_stats)
+        latencies.extend(values)
+    latencies.sort()
+    attempts = len(latencies)
+    print(f"Booking, {n_processes} processes:         {attempts / seconds:.0f} attempts/s, "
+          f"{stats['booked']} booked, {stats['conflicts']} conflicts, {stats['errors']} lock errors, "
+          f"p50 {latencies[attempts // 2] * 1e3:.1f} ms, p99 {latencies[int(attempts * 0.99)] * 1e3:.1f} ms")
+
+    app = create_app()
+    with app.app_context():
+        other = Reservation.__table__.alias('other')
+        overlaps = db.session.execute(select(Reservation.id).join(other, and_(
+            other.c.slot_id == Reservation.slot_id, other.c.id > Reservation.id,
+            other.c.status == 'booked', Reservation.status == 'booked',
+            other.c.start_time < Reservation.end_time, other.c.end_time > Reservation.start_time
+        )).limit(10)).all()
+        print(f"Overlapping bookings in the database: {len(overlaps)}")
+        db.session.remove()
+        db.engine.dispose()
+    if overlaps:
+        sys.exit(1)
+
+
+def run_benchmark(args, database_url):
+    os.environ['DATABASE_URL'] = database_url
+    random.seed(args.seed)
+    origin = datetime.utcnow().replace(microsecond=0) + timedelta(hours=3)
+    slot_ids, n_bookings = seed(args.slots, args.bookings, origin)
+    print(f"Database: {database_url.split(':', 1)[0]}, slots: {len(slot_ids)}, bookings: {n_bookings}")
+    run_queries(slot_ids, args.queries, origin)
+    run_bookers(slot_ids, args.processes, args.seconds, origin)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--slots', type=int, default=2000)
+    parser.add_argument('--bookings', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--database-url', help='An empty database to fill (default: temporary SQLite)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.database_url:
+        run_benchmark(args, args.database_url)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            run_benchmark(args, f"sqlite:///{os.path.join(tmp, 'reservations.db')}")
@@ -0,0 +1,81 @@
+"""
+Benchmark for the nearest-outdoor-slot search.
+Compares the grid index in spatial.py against a brute-force, vectorized
+NumPy haversine scan over the same free slots.
+
+Usage:
+  python benchmarks/bench_spatial.py [--slots 50000] [--queries 2000] [--k 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from spatial import EARTH_RADIUS_M, GridIndex  # noqa: E402
+
+BASE_LAT, BASE_LNG = 40.7128, -74.0060
+SPREAD = 0.05  # degrees, a few kilometres around the base point
+
+
+def numpy_nearest(lats, lngs, lat, lng, k):
+    phi1 = np.radians(lat)
+    phi2 = np.radians(lats)
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(lngs - lng)
+    a = np.sin(d_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    distances = 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+    if k < len(distances):
+        candidates = np.argpartition(distances, k)[:k]
+    else:
+        candidates = np.arange(len(distances))
+    order = candidates[np.argsort(distances[candidates])]
+    return order, distances[order]
+
+
+def run_benchmark(n_slots, n_queries, k, seed=42):
+    rng = random.Random(seed)
+    lats = np.array([BASE_LAT + rng.uniform(-SPREAD, SPREAD) for _ in range(n_slots)])
+    lngs = np.array([BASE_LNG + rng.uniform(-SPREAD, SPREAD) for _ in range(n_slots)])
+    queries = [(BASE_LAT + rng.uniform(-SPREAD, SPREAD), BASE_LNG + rng.uniform(-SPREAD, SPREAD))
+               for _ in range(n_queries)]
+
+    start = time.perf_counter()
+    grid = GridIndex()
+    for i in range(n_slots):
+        grid.insert(i, float(lats[i]), float(lngs[i]))
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    grid_results = [grid.nearest(lat, lng, k) for lat, lng in queries]
+    grid_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    numpy_results = [numpy_nearest(lats, lngs, lat, lng, k) for lat, lng in queries]
+    numpy_time = time.perf_counter() - start
+
+    mismatches = 0
+    for grid_hits, (order, distances) in zip(grid_results, numpy_results):
+        if not np.allclose([d for d, _, _ in grid_hits], distances, atol=1e-6):
+            mismatches += 1
+
+    print(f"Slots: {n_slots}, queries: {n_queries}, k={k}")
+    print(f"Grid build:           {build_time * 1000:.1f} ms")
+    print(f"Grid index query:     {grid_time / n_queries * 1e6:.1f} us/query")
+    print(f"NumPy brute force:    {numpy_time / n_queries * 1e6:.1f} us/query")
+    print(f"Speedup:              {numpy_time / grid_time:.1f}x")
+    print(f"Result mismatches:    {mismatches}")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--slots', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.slots, args.queries, args.k) else 1)
@@ -0,0 +1,57 @@
+"""
+Benchmark for worker cold start time and memory.
+Starts fresh interpreters that import main (building the app as a gunicorn
+worker would without --preload), then serve a first request, and reports
+the time and resident memory after each step.
+
+Usage:
+  python benchmarks/bench_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = r'''
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+booted = time.perf_counter()
+boot_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+main.app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({
+    'boot_ms': (booted - start) * 1000,
+    'first_request_ms': (served - booted) * 1000,
+    'boot_rss_mb': boot_rss / 1024,
+    'served_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+'''
+
+
+def run_benchmark(runs):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'startup.db')}")
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, '-c', CHILD], cwd=PROJECT_DIR, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"Runs: {runs} (median)")
+    print(f"Import + create_app:  {statistics.median(s['boot_ms'] for s in samples):.0f} ms, "
+          f"{statistics.median(s['boot_rss_mb'] for s in samples):.1f} MB RSS")
+    print(f"First request:        {statistics.median(s['first_request_ms'] for s in samples):.0f} ms, "
+          f"{statistics.median(s['served_rss_mb'] for s in samples):.1f} MB RSS")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    run_benchmark(args.runs)
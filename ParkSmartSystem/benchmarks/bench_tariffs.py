@@ -0,0 +1,83 @@
+"""
+Benchmark for bulk parking fee repricing.
+Prices N random stays with a banded, capped tariff using the vectorized
+TariffRegistry.batch_fees, as reprice_parking_records does per chunk, and
+compares it with Tariff.fee called once per record on a subset.
+
+Usage:
+  python benchmarks/bench_tariffs.py [--records 1000000] [--per-record 50000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tariffs import TariffRegistry, to_epoch_minutes  # noqa: E402
+
+TARIFFS = {
+    'standard': {'rate': 2.0, 'minimum_fee': 2.0},
+    'indoor': {
+        'bands': [(0, 7, 1.0), (7, 19, 3.0), (19, 24, 1.5)],
+        'daily_cap': 25.0,
+        'grace_minutes': 10,
+        'minimum_fee': 2.0,
+    },
+    'outdoor': {'rate': 1.5, 'daily_cap': 18.0, 'grace_minutes': 15},
+    'vip': {'rate': 5.0, 'minimum_fee': 5.0},
+}
+
+
+def random_stays(rng, n_records):
+    month_start = datetime(2024, 1, 1)
+    names, entries, exits = [], [], []
+    for _ in range(n_records):
+        entry = month_start + timedelta(minutes=rng.randrange(31 * 24 * 60))
+        # Mostly short stays with a long tail of multi-day ones
+        duration = rng.expovariate(1 / 180) if rng.random() < 0.95 else rng.uniform(1440, 5 * 1440)
+        names.append(rng.choice(['indoor', 'outdoor', 'vip', 'standard']))
+        entries.append(entry)
+        exits.append(entry + timedelta(minutes=duration))
+    return names, entries, exits
+
+
+def run_benchmark(n_records, n_per_record, seed=7):
+    rng = random.Random(seed)
+    registry = TariffRegistry(TARIFFS)
+    names, entries, exits = random_stays(rng, n_records)
+
+    start = time.perf_counter()
+    entry_minutes, exit_minutes = to_epoch_minutes(entries), to_epoch_minutes(exits)
+    convert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fees = registry.batch_fees(names, entry_minutes, exit_minutes)
+    batch_time = time.perf_counter() - start
+
+    subset = min(n_per_record, n_records)
+    start = time.perf_counter()
+    expected = [registry.get(names[i]).fee(entries[i], exits[i]) for i in range(subset)]
+    single_time = time.perf_counter() - start
+
+    mismatches = int(np.sum(np.abs(fees[:subset] - np.array(expected)) > 0.011))
+
+    print(f"Records: {n_records}, per-record subset: {subset}")
+    print(f"Datetime conversion:  {convert_time:.2f} s")
+    print(f"Vectorized batch:     {batch_time:.2f} s ({batch_time / n_records * 1e9:.0f} ns/record)")
+    print(f"Per-record fee():     {single_time / subset * 1e6:.1f} us/record "
+          f"(~{single_time / subset * n_records:.1f} s for all)")
+    print(f"Mismatches (> 1c):    {mismatches}/{subset}")
+    print(f"Total revenue:        ${fees.sum():,.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--per-record', type=int, default=50000)
+    args = parser.parse_args()
+    run_benchmark(args.records, args.per_record)
@@ -0,0 +1,172 @@
+"""
+Multi-threaded stress test for slot reservation.
+Many threads act as gates that repeatedly park and release vehicles on a
+small pool of slots, so most claims collide. Every successful claim is
+tracked in a shared holder count; a slot ever held by two gates at once is
+a double booking. At the end the database is checked too: each slot may
+have at most one open parking record and it must agree with is_occupied.
+
+Usage:
+  python benchmarks/stress_parking_entry.py [--threads 16] [--slots 10] [--seconds 10]
+                                            [--hold-ms 2] [--naive]
+
+--naive runs the old read-check-write path for comparison.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import Flask
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from extensions import db  # noqa: E402
+from models import User, Vehicle, ParkingSlot, ParkingRecord  # noqa: E402
+from utils import claim_slot, release_slot, close_parking_record  # noqa: E402
+
+
+def create_stress_app(db_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def seed(app, n_slots, n_threads):
+    with app.app_context():
+        db.create_all()
+        user = User(username='stress', email='stress@example.com')
+        user.set_password('stress')
+        db.session.add(user)
+        db.session.flush()
+        for i in range(n_threads):
+            db.session.add(Vehicle(license_plate=f'STRESS{i:03d}', user_id=user.id))
+        for i in range(n_slots):
+            db.session.add(ParkingSlot(slot_number=f'S{i:03d}', location='indoor', area='Level 1',
+                                       is_occupied=False))
+        db.session.commit()
+        return user.id
+
+
+def naive_claim(slot_id):
+    slot = db.session.get(ParkingSlot, slot_id)
+    if slot.is_occupied:
+        return False
+    time.sleep(0.001)  # a real request does other work between read and write
+    slot.is_occupied = True
+    return True
+
+
+def gate_worker(app, gate, user_id, slot_ids, deadline, naive, hold, holders, lock, stats):
+    vehicle_id = gate + 1
+    with app.app_context():
+        while time.time() < deadline:
+            slot_id = random.choice(slot_ids)
+            try:
+                claimed = naive_claim(slot_id) if naive else claim_slot(slot_id)
+                if not claimed:
+                    db.session.rollback()
+                    stats['rejected'] += 1
+                    continue
+                record = ParkingRecord(user_id=user_id, vehicle_id=vehicle_id, slot_id=slot_id,
+                                       parking_type='Indoor')
+                db.session.add(record)
+                db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                stats['busy'] += 1
+                continue
+
+            with lock:
+                holders[slot_id] += 1
+                if holders[slot_id] > 1:
+                    stats['double_bookings'] += 1
+                stats['entries'] += 1
+            time.sleep(random.uniform(0, hold))
+
+            # Release before the exit commits so the next claim can't race the counter
+            with lock:
+                holders[slot_id] -= 1
+            while True:
+                try:
+                    close_parking_record(record.id, datetime.utcnow())
+                    if naive:
+                        db.session.get(ParkingSlot, slot_id).is_occupied = False
+                    else:
+                        release_slot(slot_id)
+                    db.session.commit()
+                    break
+                except OperationalError:
+                    db.session.rollback()
+                    stats['busy'] += 1
+        db.session.remove()
+
+
+def check_database(app):
+    with app.app_context():
+        open_counts = dict(db.session.query(ParkingRecord.slot_id, func.count())
+                           .filter(ParkingRecord.exit_time.is_(None))
+                           .group_by(ParkingRecord.slot_id).all())
+        problems = 0
+        for slot in ParkingSlot.query.all():
+            open_records = open_counts.get(slot.id, 0)
+            if open_records > 1 or bool(open_records) != bool(slot.is_occupied):
+                problems += 1
+        return problems
+
+
+def run_stress(n_threads, n_slots, seconds, naive, hold_ms=2):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_stress_app(os.path.join(tmp, 'stress.db'))
+        user_id = seed(app, n_slots, n_threads)
+        with app.app_context():
+            slot_ids = [slot_id for (slot_id,) in db.session.query(ParkingSlot.id)]
+
+        holders = Counter()
+        stats = Counter()
+        lock = threading.Lock()
+        deadline = time.time() + seconds
+        threads = [threading.Thread(target=gate_worker,
+                                    args=(app, gate, user_id, slot_ids, deadline, naive,
+                                          hold_ms / 1000, holders, lock, stats))
+                   for gate in range(n_threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        db_problems = check_database(app)
+        with app.app_context():
+            db.engine.dispose()
+
+    print(f"Mode: {'naive read-check-write' if naive else 'atomic conditional UPDATE'}")
+    print(f"Threads: {n_threads}, slots: {n_slots}, duration: {elapsed:.1f} s")
+    print(f"Entries: {stats['entries']} ({stats['entries'] / elapsed:.0f}/s)")
+    print(f"Rejected claims: {stats['rejected']}, busy retries: {stats['busy']}")
+    print(f"Double bookings: {stats['double_bookings']}")
+    print(f"Inconsistent slots in database: {db_problems}")
+    return stats['double_bookings'] == 0 and db_problems == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--slots', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--hold-ms', type=float, default=2, help='max time a car stays parked')
+    parser.add_argument('--naive', action='store_true')
+    args = parser.parse_args()
+    ok = run_stress(args.threads, args.slots, args.seconds, args.naive, args.hold_ms)
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
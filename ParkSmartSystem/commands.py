@@ -0,0 +1,155 @@
+"""
+Flask CLI commands for the Car Parking System.
+
+Setup and maintenance jobs run here rather than when a worker boots:
+
+    flask --app main init-db          create tables and seed the parking slots
+    flask --app main reprice-fees     recompute fees with the current tariffs
+    flask --app main export-records   stream parking records to a file
+    flask --app main refresh-rollups  fold completed stays into the rollups
+    flask --app main retrain-forecast train the availability forecasts (nightly)
+    flask --app main archive-records  move old completed records to the archive
+    flask --app main build-assets     minify and fingerprint the static assets
+
+Maintenance commands run for every facility, or the one named by --facility.
+"""
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from archive import archive_parking_records, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+from assets import build_assets
+from extensions import db
+from facilities import DEFAULT_FACILITY, facility_registry, use_facility
+from exports import export_parking_records, EXPORT_FORMATS
+from forecast import forecaster, ForecastConflict
+from occupancy import add_occupancy_changed_column
+from plates import add_plate_key_column, backfill_plate_keys
+from rollups import refresh_rollups, rebuild_rollups
+from utils import init_parking_slots, reprice_parking_records
+
+
+def init_database():
+    """Create missing tables, seed the parking slots of every facility and index old plates"""
+    db.create_all()
+    for code in facility_registry.codes():
+        if facility_registry.has_own_database(code):
+            facility_registry.create_tables(db.metadata, code)
+        with use_facility(code):
+            # create_all doesn't add columns to existing tables
+            add_occupancy_changed_column()
+            init_parking_slots(**facility_registry.get(code).layout)
+    add_plate_key_column()
+    backfill_plate_keys()
+
+
+def facility_option(default=None):
+    return click.option('--facility', default=default,
+                        help='Facility code' if default else 'Only this facility (default: every facility)')
+
+
+def facility_codes(facility):
+    if facility is None:
+        return facility_registry.codes()
+    if facility not in facility_registry:
+        raise click.BadParameter(f"Unknown facility {facility}", param_hint='--facility')
+    return [facility]
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database tables and seed the parking slots"""
+    init_database()
+    click.echo("Database initialized")
+
+
+@click.command('reprice-fees')
+@click.option('--start', type=click.DateTime(), help='Only records that entered on or after this time')
+@click.option('--end', type=click.DateTime(), help='Only records that entered before this time')
+@facility_option()
+@with_appcontext
+def reprice_fees_command(start, end, facility):
+    """Recompute fees of completed parking records with the current tariffs"""
+    for code in facility_codes(facility):
+        with use_facility(code):
+            count = reprice_parking_records(start, end)
+            click.echo(f"{code}: repriced {count} parking records")
+            # Rollup revenue was summed from the old fees
+            rebuild_rollups()
+            click.echo(f"{code}: rebuilt occupancy rollups")
+
+
+@click.command('export-records')
+@click.option('--start', type=click.DateTime(), help='Only records that entered on or after this time')
+@click.option('--end', type=click.DateTime(), help='Only records that entered before this time')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv')
+@click.option('--output', type=click.Path(allow_dash=True), default='-', help='Output file, - for stdout')
+@facility_option(DEFAULT_FACILITY)
+@with_appcontext
+def export_records_command(start, end, export_format, output, facility):
+    """Stream parking records of one facility to a CSV, Parquet or Arrow file"""
+    mode = 'w' if export_format == 'csv' else 'wb'
+    with use_facility(facility_codes(facility)[0]), click.open_file(output, mode) as stream:
+        for chunk in export_parking_records(export_format, start, end):
+            stream.write(chunk)
+
+
+@click.command('refresh-rollups')
+@click.option('--rebuild', is_flag=True, help='Drop the rollups and rebuild them from all records')
+@facility_option()
+@with_appcontext
+def refresh_rollups_command(rebuild, facility):
+    """Fold completed parking records into the occupancy rollups"""
+    for code in facility_codes(facility):
+        with use_facility(code):
+            count = rebuild_rollups() if rebuild else refresh_rollups()
+        click.echo(f"{code}: rolled up {count} parking records")
+
+
+@click.command('retrain-forecast')
+@click.option('--rebuild', is_flag=True, help='Drop the profiles and train them from all records')
+@facility_option()
+@with_appcontext
+def retrain_forecast_command(rebuild, facility):
+    """Train the availability forecasts on the days since the last run"""
+    for code in facility_codes(facility):
+        with use_facility(code):
+            try:
+                days = forecaster.retrain(rebuild=rebuild)
+            except ForecastConflict as error:
+                raise click.ClickException(f"{code}: {error}")
+        click.echo(f"{code}: trained {days} days of parking records")
+
+
+@click.command('archive-records')
+@click.option('--older-than', type=int, help='Days since exit (default: ARCHIVE_AFTER_DAYS, 90)')
+@click.option('--batch-size', type=int, help='Records per transaction (default: ARCHIVE_BATCH_SIZE, 1000)')
+@click.option('--pause', type=float, default=0.0, help='Seconds to wait between batches')
+@facility_option()
+@with_appcontext
+def archive_records_command(older_than, batch_size, pause, facility):
+    """Move completed records that left long ago into parking_records_archive"""
+    older_than = older_than or current_app.config.get('ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS)
+    batch_size = batch_size or current_app.config.get('ARCHIVE_BATCH_SIZE', ARCHIVE_BATCH_SIZE)
+    for code in facility_codes(facility):
+        with use_facility(code):
+            count = archive_parking_records(older_than, batch_size, pause)
+        click.echo(f"{code}: archived {count} parking records")
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Minify, fingerprint and precompress the static assets into static/dist"""
+    manifest = build_assets(current_app.static_folder)
+    for name, built in sorted(manifest.items()):
+        click.echo(f"{name} -> {built}")
+    click.echo("Restart the workers to serve the new assets")
+
+
+def register_commands(app):
+    for command in (init_db_command, reprice_fees_command, export_records_command,
+                    refresh_rollups_command, retrain_forecast_command, archive_records_command,
+                    build_assets_command):
+        app.cli.add_command(command)
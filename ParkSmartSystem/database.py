@@ -0,0 +1,90 @@
+"""
+Database engine configuration for the Car Parking System.
+
+DATABASE_URL selects the backend; without it the app uses the SQLite file
+mydatabase.db next to the code. Settings can be tuned with environment
+variables:
+
+    SQLite:      SQLITE_JOURNAL_MODE (WAL), SQLITE_SYNCHRONOUS (NORMAL),
+                 SQLITE_BUSY_TIMEOUT_MS (5000)
+    PostgreSQL:  DB_POOL_SIZE (10), DB_MAX_OVERFLOW (20), DB_POOL_TIMEOUT (30),
+                 DB_POOL_RECYCLE (1800); facilities with a schema of their own
+                 (see facilities.py) get a pool of DB_FACILITY_POOL_SIZE (2)
+                 plus DB_FACILITY_MAX_OVERFLOW (5) connections each
+
+In WAL mode readers no longer block behind a writer's commit, and with
+synchronous=NORMAL a commit only appends to the log instead of syncing the
+database file. SQLite still allows one writer at a time; busy_timeout makes
+a second writer wait for the lock instead of failing at once with "database
+is locked". PostgreSQL connections come from a sized pool and are
+pre-pinged, so a connection dropped by the server is replaced instead of
+failing a request.
+"""
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(__file__), 'mydatabase.db')
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def normalize_url(url):
+    """Use the psycopg2 driver the project depends on for bare PostgreSQL URLs"""
+    # Heroku-style postgres:// is no longer accepted by SQLAlchemy, and bare
+    # postgresql:// means psycopg 3 on SQLAlchemy 2.1
+    for scheme in ('postgres://', 'postgresql://'):
+        if url.startswith(scheme):
+            return 'postgresql+psycopg2://' + url[len(scheme):]
+    return url
+
+
+def database_url(default_path=DEFAULT_SQLITE_PATH):
+    return normalize_url(os.environ.get('DATABASE_URL') or f"sqlite:///{default_path}")
+
+
+def engine_options(url, facility=False):
+    """SQLALCHEMY_ENGINE_OPTIONS suited to the backend of the url"""
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        return {
+            'connect_args': {
+                # pysqlite's own lock wait, in seconds; the PRAGMA below covers raw SQLite calls
+                'timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000,
+                'check_same_thread': False,
+            },
+        }
+    if facility:
+        # Every facility schema has its own pool, so keep each one small
+        pool_size, max_overflow = _env_int('DB_FACILITY_POOL_SIZE', 2), _env_int('DB_FACILITY_MAX_OVERFLOW', 5)
+    else:
+        pool_size, max_overflow = _env_int('DB_POOL_SIZE', 10), _env_int('DB_MAX_OVERFLOW', 20)
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True,
+    }
+
+
+def configure_database(app, default_path=DEFAULT_SQLITE_PATH):
+    """Set the database URI and engine options on app unless already configured"""
+    url = app.config.setdefault('SQLALCHEMY_DATABASE_URI', database_url(default_path))
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(url))
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')}")
+    cursor.execute(f"PRAGMA synchronous={os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={_env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)}")
+    cursor.close()
@@ -0,0 +1,159 @@
+"""
+Live slot status events for the Car Parking System.
+
+Occupancy changes committed in this process are published once into a
+bounded ring buffer. Every Server-Sent Events subscriber shares that buffer
+and simply remembers the sequence number of the last event it sent, so a
+publish costs the same whether there are ten subscribers or ten thousand.
+A subscriber that falls further behind than the buffer holds is told to
+resync, and the client then reloads the full slot list once.
+
+Each event is serialised to JSON when it is published, not per subscriber.
+Changes committed by other worker processes are published when the
+occupancy index syncs them (see occupancy.py). While any stream is open, one
+thread per broker syncs it every OCCUPANCY_SYNC_SECONDS; the streams
+themselves only block on the broker until there is an event or a keepalive
+is due. Each facility has a buffer of its own.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from facilities import FacilityLocal, current_facility, use_facility
+from occupancy import OCCUPANCY_SYNC_SECONDS, occupancy_index
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+
+
+class SlotEventBroker:
+    """In-process fan-out of slot change events"""
+
+    def __init__(self, buffer_size=1024):
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._subscribers = 0
+        self._syncer = None
+
+    @property
+    def current_seq(self):
+        return self._seq
+
+    def publish(self, location, payload):
+        data = json.dumps(payload, separators=(',', ':'))
+        with self._condition:
+            self._seq += 1
+            self._events.append((self._seq, location, data))
+            self._condition.notify_all()
+            return self._seq
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    def subscribe(self, sync=None):
+        """Count a stream in; while any is open, sync() is called every
+        OCCUPANCY_SYNC_SECONDS by a single thread"""
+        with self._condition:
+            self._subscribers += 1
+            if sync is not None and self._syncer is None:
+                self._syncer = threading.Thread(target=self._run_syncer, args=(sync,), name='slot-event-sync',
+                                                daemon=True)
+                self._syncer.start()
+
+    def unsubscribe(self):
+        with self._condition:
+            self._subscribers -= 1
+
+    def _run_syncer(self, sync):
+        while True:
+            with self._condition:
+                if not self._subscribers:
+                    self._syncer = None
+                    return
+            try:
+                # Publishes other workers' changes into this broker
+                sync()
+            except Exception:
+                logger.exception('Syncing slot occupancy for live events failed')
+            time.sleep(OCCUPANCY_SYNC_SECONDS)
+
+    def wait_for_events(self, last_seq, timeout):
+        """Block until there are events after last_seq or the timeout passes.
+
+        Returns (events, missed) where events is a list of
+        (seq, location, data) tuples and missed is True if some events after
+        last_seq have already dropped out of the buffer.
+        """
+        with self._condition:
+            if self._seq <= last_seq:
+                self._condition.wait(timeout)
+            if self._seq <= last_seq:
+                return [], False
+            oldest = self._events[0][0]
+            missed = oldest > last_seq + 1
+            return [event for event in self._events if event[0] > last_seq], missed
+
+
+slot_event_broker = FacilityLocal(SlotEventBroker)
+
+
+def _publish_occupancy_change(slot, occupied):
+    slot_event_broker.publish(slot.location, {
+        'id': slot.id,
+        'slot_number': slot.slot_number,
+        'location': slot.location,
+        'area': slot.area,
+        'is_occupied': occupied,
+    })
+
+
+occupancy_index.add_listener(_publish_occupancy_change)
+
+
+def stream_slot_events(location, last_seq=None, broker=None, sync=True):
+    """Generate a text/event-stream of slot changes for one location"""
+    # The broker and facility are picked now; the stream is read after the request's facility is reset
+    facility = current_facility()
+    resync = None
+    if sync:
+        app = current_app._get_current_object()
+
+        def resync():
+            with app.app_context(), use_facility(facility):
+                occupancy_index.sync()
+    return _stream(location, last_seq, broker or slot_event_broker.for_facility(facility), resync)
+
+
+def _stream(location, last_seq, broker, resync=None):
+    if last_seq is None or last_seq > broker.current_seq:
+        last_seq = broker.current_seq
+    broker.subscribe(resync)
+    try:
+        yield 'retry: 5000\n\n'
+        quiet_since = time.monotonic()
+        while True:
+            wait = max(HEARTBEAT_SECONDS - (time.monotonic() - quiet_since), 0)
+            events, missed = broker.wait_for_events(last_seq, wait)
+            if missed:
+                yield f'id: {events[-1][0]}\nevent: resync\ndata: {{}}\n\n'
+                quiet_since = time.monotonic()
+            elif not events:
+                if time.monotonic() - quiet_since < HEARTBEAT_SECONDS:
+                    continue
+                yield ': keepalive\n\n'
+                quiet_since = time.monotonic()
+            for seq, event_location, data in events:
+                last_seq = seq
+                if event_location == location and not missed:
+                    yield f'id: {seq}\nevent: slot\ndata: {data}\n\n'
+                    quiet_since = time.monotonic()
+    finally:
+        # Closed by the server when the client goes away
+        broker.unsubscribe()
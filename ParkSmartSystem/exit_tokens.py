@@ -0,0 +1,274 @@
+"""
+Signed exit tokens for the Car Parking System.
+
+The digital card shows an exit token for every active parking, as a QR code
+when the qrcode package is installed. A token carries the record id, user,
+vehicle, slot, parking type and entry time of the stay and the time it was
+issued, packed into 29 bytes plus the parking type and signed with a
+16-byte HMAC-SHA256: 68 characters of base64url for an indoor stay. The key
+is derived from EXIT_TOKEN_KEY (default: the app's secret key) and the
+facility, so a token only opens the gates of the car park that issued it.
+
+POST /api/parking-exit with {"token": ...} opens the barrier for a token
+without reading the record: the signature, the token's age (at most
+EXIT_TOKEN_MAX_AGE seconds, a day by default) and a seen-set of the record
+ids that left recently are checked in memory, and the fee is worked out from
+the entry time, slot and tariff in the token. Records closed by record id or
+by a batch of gate events in this process are added to the seen-set too. The seen-set holds at most
+EXIT_TOKEN_SEEN_SIZE records and forgets them once their tokens have
+expired, when a replay would be refused anyway.
+
+The exit is then settled behind the request. With the gate journal enabled
+it is journaled like any other exit (see journal.py), which also checks the
+record is still open. Otherwise a background thread writes the pending exits
+with apply_gate_events, many per transaction; an exit that turns out to be
+closed already is logged, counted in stats['conflicts'] and skipped. The
+seen-set is per process: with
+several workers and no journal, a token replayed at another worker is only
+caught when its exit is settled. Pending exits are lost if the process dies;
+their records stay open and the same token can be used again.
+"""
+import base64
+import hmac
+import logging
+import struct
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from markupsafe import Markup
+
+from facilities import DEFAULT_FACILITY, FacilityLocal, use_facility
+from gate_events import apply_gate_events
+from journal import gate_journal
+from models import db
+from occupancy import occupancy_index
+from rollups import refresh_rollups
+from tariffs import EPOCH, tariff_registry
+
+logger = logging.getLogger(__name__)
+
+EXIT_TOKEN_MAX_AGE = 24 * 3600
+EXIT_TOKEN_SEEN_SIZE = 100000
+SETTLE_BATCH_SIZE = 500
+# Exits waiting to be written; beyond this the gate answers 503
+SETTLE_QUEUE_SIZE = 10000
+# Let a few more exits arrive before a batch is written
+SETTLE_DELAY_SECONDS = 0.01
+SETTLE_RETRY_SECONDS = 1
+
+TOKEN_VERSION = 1
+MAC_LENGTH = 16
+# version, record_id, user_id, vehicle_id, slot_id, entry time (µs), issued at (s); then the parking type
+_PAYLOAD = struct.Struct('>BIIIIqI')
+ONE_MICROSECOND = timedelta(microseconds=1)
+ONE_SECOND = timedelta(seconds=1)
+
+ExitClaims = namedtuple('ExitClaims', ['record_id', 'user_id', 'vehicle_id', 'slot_id', 'entry_time',
+                                       'parking_type', 'issued_at'])
+
+
+class InvalidExitToken(Exception):
+    """The token is malformed, forged, for another facility or expired"""
+
+
+class SettlementBacklog(Exception):
+    """Too many exits are waiting to be written"""
+
+
+def _qrcode():
+    # Optional: without it the card shows the token as text only
+    try:
+        import qrcode
+        import qrcode.image.svg
+    except ImportError:
+        return None
+    return qrcode
+
+
+def qr_code_svg(data):
+    """An inline SVG QR code of data, or None without the qrcode package"""
+    qrcode = _qrcode()
+    if qrcode is None:
+        return None
+    image = qrcode.make(data, image_factory=qrcode.image.svg.SvgPathImage, border=2)
+    return Markup(image.to_string(encoding='unicode'))
+
+
+class ExitTokenGate:
+    """Issues exit tokens and lets their vehicles out without a database round trip"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._app = None
+        self._mac = None
+        self._seen = OrderedDict()
+        self._pending = []
+        self._settling = 0
+        self._settler = None
+        self.max_age = EXIT_TOKEN_MAX_AGE
+        self.seen_size = EXIT_TOKEN_SEEN_SIZE
+        self.facility = DEFAULT_FACILITY
+        self.stats = Counter()
+
+    def init_app(self, app):
+        app.config.setdefault('EXIT_TOKEN_KEY', None)
+        app.config.setdefault('EXIT_TOKEN_MAX_AGE', EXIT_TOKEN_MAX_AGE)
+        app.config.setdefault('EXIT_TOKEN_SEEN_SIZE', EXIT_TOKEN_SEEN_SIZE)
+        self._app = app
+        self.max_age = app.config['EXIT_TOKEN_MAX_AGE']
+        self.seen_size = app.config['EXIT_TOKEN_SEEN_SIZE']
+        secret = app.config['EXIT_TOKEN_KEY'] or app.secret_key
+        if isinstance(secret, str):
+            secret = secret.encode()
+        # One key per facility, so a token is only good at the car park that issued it
+        key = hmac.digest(secret, f'exit-token:{self.facility}'.encode(), 'sha256')
+        # Keyed once; signing copies it rather than hashing the key again
+        self._mac = hmac.new(key, digestmod='sha256')
+
+    def issue(self, record, now=None):
+        """Exit token for an open parking record"""
+        now = now or datetime.utcnow()
+        payload = _PAYLOAD.pack(
+            TOKEN_VERSION, record.id, record.user_id, record.vehicle_id, record.slot_id,
+            (record.entry_time - EPOCH) // ONE_MICROSECOND, (now - EPOCH) // ONE_SECOND
+        ) + (record.parking_type or '').encode()
+        return base64.urlsafe_b64encode(payload + self._sign(payload)).rstrip(b'=').decode()
+
+    def verify(self, token, now=None):
+        """The claims of a token; raises InvalidExitToken unless it is genuine and unexpired"""
+        try:
+            data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        except (TypeError, ValueError):
+            raise InvalidExitToken('Invalid exit token') from None
+        payload, mac = data[:-MAC_LENGTH], data[-MAC_LENGTH:]
+        if len(payload) < _PAYLOAD.size or not hmac.compare_digest(mac, self._sign(payload)):
+            raise InvalidExitToken('Invalid exit token')
+        version, record_id, user_id, vehicle_id, slot_id, entry, issued = _PAYLOAD.unpack_from(payload)
+        if version != TOKEN_VERSION:
+            raise InvalidExitToken('Invalid exit token')
+        now = now or datetime.utcnow()
+        if (now - EPOCH) // ONE_SECOND - issued > self.max_age:
+            raise InvalidExitToken('Exit token has expired; show the digital card again')
+        return ExitClaims(record_id, user_id, vehicle_id, slot_id, EPOCH + entry * ONE_MICROSECOND,
+                          payload[_PAYLOAD.size:].decode() or None, issued)
+
+    def exit(self, token, now=None):
+        """Let the vehicle of a token out; returns (claims, duration_minutes, fee).
+
+        Raises InvalidExitToken for a bad token, ValueError if the record has
+        left already, and LookupError, JournalUnavailable or SettlementBacklog
+        if the exit can't be settled.
+        """
+        now = now or datetime.utcnow()
+        claims = self.verify(token, now)
+        with self._condition:
+            self._forget_expired(now)
+            if claims.record_id in self._seen:
+                self.stats['replays'] += 1
+                raise ValueError('Vehicle has already exited')
+            if not gate_journal.enabled and len(self._pending) >= SETTLE_QUEUE_SIZE:
+                raise SettlementBacklog('Too many exits are waiting to be written; try again shortly')
+            self._seen[claims.record_id] = claims.issued_at + self.max_age
+            if len(self._seen) > self.seen_size:
+                self._seen.popitem(last=False)
+
+        try:
+            if gate_journal.enabled:
+                duration, fee = gate_journal.exit(claims.user_id, claims.record_id)
+            else:
+                duration, fee = self._price(claims, now)
+                self._settle({'type': 'exit', 'record_id': claims.record_id, 'timestamp': now.isoformat()})
+        except ValueError:
+            raise
+        except Exception:
+            # Not let out, so the token may be tried again
+            with self._condition:
+                self._seen.pop(claims.record_id, None)
+            raise
+        self.stats['exits'] += 1
+        return claims, duration, fee
+
+    def record_exited(self, record_ids, now=None):
+        """Refuse the tokens of records that were closed without one"""
+        now = now or datetime.utcnow()
+        # No token of these records can have been issued later than now
+        expires = (now - EPOCH) // ONE_SECOND + self.max_age
+        with self._condition:
+            self._forget_expired(now)
+            for record_id in record_ids:
+                self._seen.pop(record_id, None)
+                self._seen[record_id] = expires
+            while len(self._seen) > self.seen_size:
+                self._seen.popitem(last=False)
+
+    def flush(self, timeout=None):
+        """Wait until every pending exit has been written; False on a timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._settling, timeout)
+
+    def _sign(self, payload):
+        mac = self._mac.copy()
+        mac.update(payload)
+        return mac.digest()[:MAC_LENGTH]
+
+    def _forget_expired(self, now):
+        # Called with the condition held; roughly in expiry order, which is enough to bound it
+        now_seconds = (now - EPOCH) // ONE_SECOND
+        while self._seen:
+            record_id, expires = next(iter(self._seen.items()))
+            if expires >= now_seconds:
+                break
+            del self._seen[record_id]
+
+    def _price(self, claims, now):
+        occupancy_index.ensure_warm()
+        slot = occupancy_index.get(claims.slot_id)
+        tariff = tariff_registry.select(claims.parking_type, slot.area if slot else None)
+        duration = int((now - claims.entry_time).total_seconds() // 60)
+        return duration, tariff.fee(claims.entry_time, now)
+
+    def _settle(self, event):
+        with self._condition:
+            self._pending.append(event)
+            if self._settler is None:
+                self._settler = threading.Thread(target=self._run_settler, name='exit-settler', daemon=True)
+                self._settler.start()
+            self._condition.notify_all()
+
+    def _run_settler(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+            time.sleep(SETTLE_DELAY_SECONDS)
+            with self._condition:
+                batch = self._pending[:SETTLE_BATCH_SIZE]
+                del self._pending[:len(batch)]
+                self._settling = len(batch)
+            with self._app.app_context(), use_facility(self.facility):
+                try:
+                    results = apply_gate_events(batch)
+                except Exception:
+                    logger.exception('Settling exits failed, retrying')
+                    db.session.rollback()
+                    with self._condition:
+                        self._pending[:0] = batch
+                        self._settling = 0
+                    time.sleep(SETTLE_RETRY_SECONDS)
+                    continue
+                for result in results:
+                    if not result['success']:
+                        # Left through another worker or with the record id meanwhile
+                        self.stats['conflicts'] += 1
+                        logger.warning('Exit of record %s was not settled: %s',
+                                       batch[result['index']]['record_id'], result['message'])
+                self.stats['settled'] += len(batch)
+                self.stats['batches'] += 1
+                refresh_rollups()
+            with self._condition:
+                self._settling = 0
+                self._condition.notify_all()
+
+
+exit_gate = FacilityLocal(ExitTokenGate, broadcast=('init_app',))
@@ -0,0 +1,199 @@
+"""
+Streaming export of parking records for the Car Parking System.
+
+Records are read with yield_per, so the database driver hands them over one
+chunk at a time, and each chunk is encoded and yielded before the next one is
+fetched. Memory use depends on the chunk size only, not on the size of the
+export, and an HTTP response can send its first bytes as soon as the first
+chunk is ready.
+
+CSV is always available. Parquet and Arrow IPC stream output need pyarrow;
+each chunk becomes one Parquet row group or one Arrow record batch.
+
+Archived records (see archive.py) are exported along with the hot ones.
+Vehicles are shared by all facilities and may live in another database than
+the records, so their plates are looked up once per chunk instead of joined.
+"""
+import csv
+from datetime import datetime
+
+from sqlalchemy import select, union_all
+
+from archive import RECORD_MODELS
+from facilities import current_facility, use_facility
+from models import ParkingSlot, Vehicle, db
+
+EXPORT_CHUNK_SIZE = 10000
+
+EXPORT_COLUMNS = [
+    'id', 'user_id', 'vehicle_id', 'license_plate', 'slot_number', 'area', 'parking_type',
+    'entry_time', 'exit_time', 'duration_minutes', 'fee', 'payment_status', 'status',
+]
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def _pyarrow(export_format):
+    # Imported on first use; pyarrow is optional and slow to import
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise RuntimeError(f"pyarrow is required for {export_format} exports")
+    return pyarrow
+
+
+def _arrow_schema(pa):
+    return pa.schema([
+        ('id', pa.int64()),
+        ('user_id', pa.int64()),
+        ('vehicle_id', pa.int64()),
+        ('license_plate', pa.string()),
+        ('slot_number', pa.string()),
+        ('area', pa.string()),
+        ('parking_type', pa.string()),
+        ('entry_time', pa.timestamp('us')),
+        ('exit_time', pa.timestamp('us')),
+        ('duration_minutes', pa.int64()),
+        ('fee', pa.float64()),
+        ('payment_status', pa.string()),
+        ('status', pa.string()),
+    ])
+
+
+def _records_statement(model, start, end, user_id):
+    # Labelled: SQLite can't tell which id a UNION is ordered by otherwise
+    statement = select(
+        model.id.label('id'), model.user_id, model.vehicle_id, ParkingSlot.slot_number, ParkingSlot.area,
+        model.parking_type, model.entry_time, model.exit_time, model.fee,
+        model.payment_status, model.status
+    ).outerjoin(ParkingSlot, model.slot_id == ParkingSlot.id)
+    if start is not None:
+        statement = statement.where(model.entry_time >= start)
+    if end is not None:
+        statement = statement.where(model.entry_time < end)
+    if user_id is not None:
+        statement = statement.where(model.user_id == user_id)
+    return statement
+
+
+def iter_record_chunks(start=None, end=None, user_id=None, chunk_size=EXPORT_CHUNK_SIZE, facility=None):
+    """Yield lists of export rows for records that entered in [start, end), oldest first"""
+    # Archived and hot records in one ordered stream
+    statement = union_all(*(_records_statement(model, start, end, user_id) for model in RECORD_MODELS))
+    statement = statement.order_by(statement.selected_columns.entry_time, statement.selected_columns.id)
+
+    # A streamed response is read after the request has reset its facility
+    with use_facility(facility or current_facility()):
+        result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        vehicle_ids = {row.vehicle_id for row in partition if row.vehicle_id is not None}
+        plates = dict(db.session.execute(
+            select(Vehicle.id, Vehicle.license_plate).where(Vehicle.id.in_(vehicle_ids))
+        ).all()) if vehicle_ids else {}
+        yield [_export_row(row, plates.get(row.vehicle_id)) for row in partition]
+
+
+def _export_row(row, license_plate):
+    duration = None
+    if row.entry_time and row.exit_time:
+        duration = int((row.exit_time - row.entry_time).total_seconds() // 60)
+    return (
+        row.id, row.user_id, row.vehicle_id, license_plate, row.slot_number, row.area,
+        row.parking_type, row.entry_time, row.exit_time, duration, row.fee,
+        row.payment_status, row.status,
+    )
+
+
+class _Echo:
+    """File-like object that hands back what is written to it"""
+
+    def write(self, value):
+        return value
+
+
+class _ChunkSink:
+    """Write-only file that collects bytes until they are drained"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_csv(chunks):
+    """Encode row chunks as CSV text, one string per chunk"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        yield ''.join(writer.writerow(
+            [value.isoformat() if isinstance(value, datetime) else value for value in row]
+        ) for row in rows)
+
+
+def _record_batch(pa, rows, schema):
+    columns = list(zip(*rows)) if rows else [[] for _ in EXPORT_COLUMNS]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+def iter_parquet(chunks):
+    """Encode row chunks as a Parquet file, one row group per chunk"""
+    pa = _pyarrow('parquet')
+    schema = _arrow_schema(pa)
+    sink = _ChunkSink()
+    writer = pa.parquet.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    for rows in chunks:
+        writer.write_batch(_record_batch(pa, rows, schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def iter_arrow(chunks):
+    """Encode row chunks as an Arrow IPC stream, one record batch per chunk"""
+    pa = _pyarrow('arrow')
+    schema = _arrow_schema(pa)
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), schema)
+    for rows in chunks:
+        writer.write_batch(_record_batch(pa, rows, schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_parking_records(export_format='csv', start=None, end=None, user_id=None,
+                           chunk_size=EXPORT_CHUNK_SIZE):
+    """Generator of encoded export chunks (str for CSV, bytes otherwise)"""
+    encoders = {'csv': iter_csv, 'parquet': iter_parquet, 'arrow': iter_arrow}
+    if export_format not in encoders:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if export_format != 'csv':
+        _pyarrow(export_format)
+    return encoders[export_format](iter_record_chunks(start, end, user_id, chunk_size, current_facility()))
@@ -1,7 +1,8 @@
-
-
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager
-
-db = SQLAlchemy()
-login_manager = LoginManager()
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import LoginManager
+
+from facilities import FacilitySession
+
+# Site tables are read and written in the current facility's database (see facilities.py)
+db = SQLAlchemy(session_options={'class_': FacilitySession})
+login_manager = LoginManager()
@@ -0,0 +1,313 @@
+"""
+Facilities (car park sites) for the Car Parking System.
+
+One deployment serves many sites. Each request runs for one facility, taken
+from the X-Facility header, the facility query argument (which browsers keep
+in their session) or DEFAULT_FACILITY, and everything it touches is scoped
+to that facility:
+
+- Site tables (slots, records, reservations, rollups, forecasts) carry a
+  facility column, filled in from the current facility on insert, and every
+  ORM statement on them is filtered by it (with_loader_criteria), so queries
+  need not mention it. Users and vehicles are shared by all sites.
+- A facility may keep its site tables in a database of its own, so a busy
+  site's writes and locks don't hold up the others: a SQLite file
+  (database_url) or, on PostgreSQL, a schema of the main database (schema).
+  FacilitySession.get_bind sends site tables to that engine and shared tables
+  to the main database; queries never join across the two.
+- The in-memory caches and indexes are FacilityLocal: one instance per
+  facility, created on first use, behind a proxy that dispatches to the
+  instance of the current facility.
+
+Facilities are configured with the FACILITIES dict, for example:
+
+    FACILITIES = {
+        'main': {'name': 'Main garage'},
+        'airport': {'name': 'Airport P1', 'database_url': 'sqlite:////var/lib/parksmart/airport.db',
+                    'layout': {'indoor_levels': 6, 'slots_per_level': 200, 'outdoor_lots': 0}},
+        'harbour': {'name': 'Harbour', 'schema': 'harbour'},
+    }
+
+FACILITY_DATABASE_URL, a URL containing {facility}, gives every facility but
+the default one a database of its own unless it names one. layout is passed
+to init_parking_slots when `flask init-db` seeds the facility.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+from flask import abort, g, jsonify, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import with_loader_criteria
+from sqlalchemy.sql.util import find_tables
+
+from database import engine_options, normalize_url
+
+DEFAULT_FACILITY = 'main'
+DEFAULT_FACILITIES = {DEFAULT_FACILITY: {'name': 'Main garage'}}
+
+_current = ContextVar('facility', default=DEFAULT_FACILITY)
+# Names of the tables that live in the facility's database
+_routed_tables = set()
+
+
+def current_facility():
+    """Code of the facility the current request or job runs for"""
+    return _current.get()
+
+
+@contextmanager
+def use_facility(code):
+    """Run a block for another facility, e.g. in a background thread or CLI command"""
+    token = _current.set(code)
+    try:
+        yield code
+    finally:
+        _current.reset(token)
+
+
+class FacilityRouted:
+    """Model mixin: the table is kept in the facility's database"""
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if '__tablename__' in cls.__dict__:
+            _routed_tables.add(cls.__tablename__)
+
+
+class FacilityScoped(FacilityRouted):
+    """Model mixin: rows belong to a facility and are only seen from it"""
+
+    facility = sa.Column(sa.String(20), default=current_facility, nullable=False, index=True)
+
+
+class Facility:
+    """A configured site"""
+
+    def __init__(self, code, name=None, database_url=None, schema=None, layout=None):
+        self.code = code
+        self.name = name or code
+        self.database_url = database_url
+        self.schema = schema
+        self.layout = layout or {}
+
+    def to_dict(self):
+        return {'code': self.code, 'name': self.name}
+
+
+class FacilityRegistry:
+    """Configured facilities and the engines of those with their own database"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._facilities = {}
+        self._engines = {}
+        self._main_url = None
+        self.configure(DEFAULT_FACILITIES)
+
+    def configure(self, config, main_url=None, url_template=None):
+        facilities = {}
+        for code, options in config.items():
+            options = dict(options)
+            if options.get('database_url') is None and url_template and code != DEFAULT_FACILITY \
+                    and not options.get('schema'):
+                options['database_url'] = url_template.format(facility=code)
+            facility = Facility(code, **options)
+            if facility.database_url:
+                facility.database_url = normalize_url(facility.database_url)
+                if make_url(facility.database_url).get_backend_name() != 'sqlite':
+                    raise ValueError(f"Facility {code}: use a schema of the main database for PostgreSQL")
+            if facility.schema and main_url and make_url(main_url).get_backend_name() != 'postgresql':
+                raise ValueError(f"Facility {code}: schemas need a PostgreSQL database")
+            facilities[code] = facility
+        if DEFAULT_FACILITY not in facilities:
+            facilities[DEFAULT_FACILITY] = Facility(DEFAULT_FACILITY, **DEFAULT_FACILITIES[DEFAULT_FACILITY])
+
+        with self._lock:
+            old_engines = self._engines
+            self._facilities = facilities
+            self._engines = {}
+            self._main_url = main_url
+        for engine in old_engines.values():
+            engine.dispose()
+
+    def __contains__(self, code):
+        return code in self._facilities
+
+    def get(self, code=None):
+        return self._facilities.get(code or current_facility())
+
+    def codes(self):
+        return list(self._facilities)
+
+    def has_own_database(self, code):
+        facility = self._facilities[code]
+        return bool(facility.database_url or facility.schema)
+
+    def shares_database(self, code):
+        """Whether another facility keeps its site tables in the same database"""
+        if self.has_own_database(code):
+            return False
+        return any(not self.has_own_database(other) for other in self._facilities if other != code)
+
+    def engine(self, code=None):
+        """Engine of the facility's own database, or None for the main database"""
+        code = code or current_facility()
+        engine = self._engines.get(code)
+        if engine is not None:
+            return engine
+        facility = self._facilities.get(code)
+        if facility is None or not (facility.database_url or facility.schema):
+            return None
+        with self._lock:
+            engine = self._engines.get(code)
+            if engine is None:
+                url = facility.database_url or self._main_url
+                options = engine_options(url, facility=True)
+                if facility.schema:
+                    # Site tables resolve to the schema first, shared tables to public
+                    options.setdefault('connect_args', {})['options'] = f'-csearch_path={facility.schema},public'
+                engine = self._engines[code] = sa.create_engine(url, **options)
+        return engine
+
+    def create_tables(self, metadata, code):
+        """Create the site tables in the facility's own database"""
+        engine = self.engine(code)
+        facility = self._facilities[code]
+        if facility.database_url and make_url(facility.database_url).database:
+            os.makedirs(os.path.dirname(os.path.abspath(make_url(facility.database_url).database)), exist_ok=True)
+        if facility.schema:
+            with engine.begin() as connection:
+                connection.execute(sa.schema.CreateSchema(facility.schema, if_not_exists=True))
+        metadata.create_all(engine, tables=[metadata.tables[name] for name in sorted(_routed_tables)])
+
+    def dispose(self):
+        for engine in self._engines.values():
+            engine.dispose()
+
+
+facility_registry = FacilityRegistry()
+
+
+class FacilitySession(Session):
+    """Session that reads and writes site tables in the current facility's database"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _is_routed(mapper, clause):
+            engine = facility_registry.engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _is_routed(mapper, clause):
+    if mapper is not None:
+        table = sa.inspect(mapper).local_table
+        return getattr(table, 'name', None) in _routed_tables
+    if clause is not None:
+        return any(table.name in _routed_tables for table in find_tables(clause, include_crud=True))
+    return False
+
+
+@event.listens_for(FacilitySession, 'do_orm_execute')
+def _filter_by_facility(state):
+    if state.is_column_load or state.is_relationship_load:
+        # Lazy and deferred loads inherit the criteria of the statement that loaded the object
+        return
+    if not (state.is_select or state.is_update or state.is_delete):
+        return
+    if state.execution_options.get('all_facilities'):
+        return
+    facility = current_facility()
+    state.statement = state.statement.options(
+        with_loader_criteria(FacilityScoped, lambda cls: cls.facility == facility, include_aliases=True)
+    )
+
+
+class FacilityLocal:
+    """Proxy to one instance of a cache or index per facility.
+
+    Attribute access is forwarded to the instance of the current facility;
+    methods are looked up again on every call, so a method stored as a
+    callback follows the facility it is called in. Calls to the methods named
+    in broadcast (configuration and listener registration) are applied to
+    every instance, including those created later.
+    """
+
+    def __init__(self, factory, broadcast=()):
+        self._factory = factory
+        self._broadcast = frozenset(broadcast)
+        self._instances = {}
+        self._calls = []
+        self._lock = threading.Lock()
+
+    def for_facility(self, code=None):
+        code = code or current_facility()
+        instance = self._instances.get(code)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(code)
+                if instance is None:
+                    with use_facility(code):
+                        instance = self._factory()
+                        instance.facility = code
+                        for name, args, kwargs in self._calls:
+                            getattr(instance, name)(*args, **kwargs)
+                    self._instances[code] = instance
+        return instance
+
+    def instances(self):
+        return list(self._instances.values())
+
+    def _broadcast_call(self, name, args, kwargs):
+        with self._lock:
+            self._calls.append((name, args, kwargs))
+            instances = list(self._instances.items())
+        for code, instance in instances:
+            with use_facility(code):
+                getattr(instance, name)(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name in self._broadcast:
+            return lambda *args, **kwargs: self._broadcast_call(name, args, kwargs)
+        value = getattr(self.for_facility(), name)
+        if not callable(value):
+            return value
+
+        def method(*args, **kwargs):
+            return getattr(self.for_facility(), name)(*args, **kwargs)
+        return method
+
+
+def init_app(app):
+    """Read FACILITIES and select the facility of every request"""
+    app.config.setdefault('FACILITIES', DEFAULT_FACILITIES)
+    app.config.setdefault('FACILITY_DATABASE_URL', None)
+    facility_registry.configure(app.config['FACILITIES'], app.config['SQLALCHEMY_DATABASE_URI'],
+                                app.config['FACILITY_DATABASE_URL'])
+
+    @app.before_request
+    def _select_facility():
+        if request.endpoint == 'static':
+            # Static files are the same for every site; reading the session would add Vary: Cookie
+            return
+        code = request.args.get('facility')
+        if code and code in facility_registry and session.get('facility', DEFAULT_FACILITY) != code:
+            # Pages keep the site the user picked
+            session['facility'] = code
+        code = request.headers.get('X-Facility') or code or session.get('facility') or DEFAULT_FACILITY
+        if code not in facility_registry:
+            if request.path.startswith('/api/'):
+                return jsonify({'success': False, 'message': 'Facility not found'}), 404
+            abort(404)
+        g.facility_token = _current.set(code)
+
+    @app.teardown_request
+    def _reset_facility(exception=None):
+        token = g.pop('facility_token', None)
+        if token is not None:
+            _current.reset(token)
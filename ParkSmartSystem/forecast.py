@@ -0,0 +1,380 @@
+"""
+Availability forecasting for the Car Parking System.
+
+Forecasts answer questions like "will Level 2 be full at 17:30?" from the
+history in parking_records and its archive. forecast_profiles holds running
+sums for every area, day of the week and 15-minute bin of the (local) day:
+arrivals, vehicles parked at the start of the bin, days on which the area
+was full, and the number and total length of the stays that arrived in the
+bin.
+
+Training reads the stays that overlap the days being trained in id-ordered
+chunks and aggregates each chunk as NumPy arrays: occupancy is a difference
+array over the bins of the window (+1 in the bin a stay is first seen, -1 in
+the bin after it left) summed up with cumsum, arrivals and dwell times are
+bincounts. `flask retrain-forecast` is meant to run nightly; it only trains
+the whole days since the previous run (the latest trained_through), so its
+cost follows the new records, not the size of the history. --rebuild drops
+the sums and trains from the first record again. A completed stay's dwell
+time is added on the day it ends, so overnight stays are counted once.
+
+Workers keep the profiles of each facility in memory as one list of
+precomputed tuples per area and reload them when a retrain has moved
+trained_through, which they check at most every FORECAST_RELOAD_SECONDS. A
+forecast is a list lookup at weekday * 96 + bin. For times within FORECAST_LIVE_HOURS, the difference
+between the current occupancy (from the occupancy index) and the profile is
+carried forward, fading with the area's average dwell time.
+"""
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, func, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from archive import RECORD_MODELS
+from facilities import FacilityLocal
+from models import ForecastProfile, ParkingSlot, db
+from occupancy import occupancy_index
+from rollups import UNKNOWN_AREA, slots_per_area
+from tariffs import EPOCH, MINUTES_PER_DAY, ONE_MINUTE, _numpy, to_epoch_minutes
+
+BIN_MINUTES = 15
+BINS_PER_DAY = MINUTES_PER_DAY // BIN_MINUTES
+BINS_PER_WEEK = 7 * BINS_PER_DAY
+TRAIN_CHUNK_SIZE = 200000
+FORECAST_UTC_OFFSET_MINUTES = 0
+FORECAST_RELOAD_SECONDS = 300
+FORECAST_LIVE_HOURS = 4
+# 1970-01-01, day 0 of the epoch, was a Thursday
+EPOCH_WEEKDAY = 3
+EPOCH_DATE = EPOCH.date()
+PROFILE_FIELDS = ('days', 'arrivals', 'occupied', 'full_days', 'departures', 'dwell_minutes')
+
+
+class ForecastConflict(Exception):
+    """Another retrain covered the same days first"""
+
+
+def _stay_chunks(window_start, window_end, chunk_size):
+    """Stays overlapping the window, live and archived, in id-ordered chunks"""
+    for model in RECORD_MODELS:
+        query = db.session.query(
+            model.id, model.entry_time, model.exit_time, ParkingSlot.area
+        ).outerjoin(ParkingSlot, model.slot_id == ParkingSlot.id).filter(
+            model.entry_time < window_end,
+            or_(model.exit_time.is_(None), model.exit_time >= window_start)
+        )
+        last_id = 0
+        while True:
+            chunk = query.filter(model.id > last_id).order_by(model.id).limit(chunk_size).all()
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            yield chunk
+
+
+class AvailabilityForecaster:
+    """Per-area occupancy profiles by weekday and time of day"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # area -> [(occupied, full probability, arrivals per hour, average dwell)] per weekly bin
+        self._tables = {}
+        # area -> average dwell minutes over the whole week
+        self._dwell = {}
+        # area -> (location, capacity), from the occupancy index
+        self._capacity = {}
+        self._days = {}
+        self.trained_through = None
+        self._checked_at = None
+        self.utc_offset_minutes = FORECAST_UTC_OFFSET_MINUTES
+        self.reload_seconds = FORECAST_RELOAD_SECONDS
+        self.live_hours = FORECAST_LIVE_HOURS
+
+    def init_app(self, app):
+        """Read the FORECAST_* settings; profiles are loaded on first use"""
+        app.config.setdefault('FORECAST_UTC_OFFSET_MINUTES', FORECAST_UTC_OFFSET_MINUTES)
+        app.config.setdefault('FORECAST_RELOAD_SECONDS', FORECAST_RELOAD_SECONDS)
+        app.config.setdefault('FORECAST_LIVE_HOURS', FORECAST_LIVE_HOURS)
+        self.utc_offset_minutes = app.config['FORECAST_UTC_OFFSET_MINUTES']
+        self.reload_seconds = app.config['FORECAST_RELOAD_SECONDS']
+        self.live_hours = app.config['FORECAST_LIVE_HOURS']
+
+    # Serving
+
+    def ensure_loaded(self):
+        """Load the profiles, or reload them if they have been retrained since"""
+        if not self._capacity and occupancy_index.is_warm:
+            self._on_index_warm(occupancy_index)
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.reload_seconds:
+            return
+        self._checked_at = now
+        latest = db.session.query(func.max(ForecastProfile.trained_through)).scalar()
+        db.session.rollback()
+        if latest != self.trained_through:
+            self.load()
+
+    def load(self):
+        """Precompute the lookup tables from forecast_profiles (requires an app context)"""
+        rows = db.session.query(ForecastProfile).all()
+        db.session.rollback()
+        sums = {}
+        trained_through = None
+        for row in rows:
+            area_sums = sums.get(row.area)
+            if area_sums is None:
+                area_sums = sums[row.area] = [None] * BINS_PER_WEEK
+            area_sums[row.weekday * BINS_PER_DAY + row.time_bin] = row
+            if trained_through is None or row.trained_through > trained_through:
+                trained_through = row.trained_through
+
+        tables, dwell, days = {}, {}, {}
+        for area, area_sums in sums.items():
+            departures = sum(row.departures for row in area_sums if row is not None)
+            minutes = sum(row.dwell_minutes for row in area_sums if row is not None)
+            dwell[area] = minutes / departures if departures else None
+            days[area] = sum(row.days for row in area_sums[::BINS_PER_DAY] if row is not None)
+            table = []
+            for row in area_sums:
+                if row is None or not row.days:
+                    table.append(None)
+                    continue
+                table.append((
+                    row.occupied / row.days,
+                    row.full_days / row.days,
+                    row.arrivals / row.days * 60 / BIN_MINUTES,
+                    row.dwell_minutes / row.departures if row.departures else dwell[area],
+                ))
+            tables[area] = table
+
+        with self._lock:
+            self._tables = tables
+            self._dwell = dwell
+            self._days = days
+            self.trained_through = trained_through
+        logging.info(f"Loaded availability forecasts for {len(tables)} areas through {trained_through}")
+
+    def _on_index_warm(self, index):
+        capacity = {}
+        for location in index.locations():
+            for slot in index.slots(location):
+                area_location, count = capacity.get(slot.area, (location, 0))
+                capacity[slot.area] = (area_location, count + 1)
+        self._capacity = capacity
+
+    def _weekly_bin(self, at):
+        minutes = (at - EPOCH) / ONE_MINUTE + self.utc_offset_minutes
+        day, minute = divmod(minutes, MINUTES_PER_DAY)
+        return (int(day) + EPOCH_WEEKDAY) % 7 * BINS_PER_DAY + int(minute) // BIN_MINUTES
+
+    def next_local_time(self, time_of_day, now=None):
+        """The next (naive UTC) time the local clock shows time_of_day"""
+        now = now or datetime.utcnow()
+        local = now + timedelta(minutes=self.utc_offset_minutes)
+        at = datetime.combine(local.date(), time_of_day)
+        if at < local:
+            at += timedelta(days=1)
+        return at - timedelta(minutes=self.utc_offset_minutes)
+
+    def areas(self):
+        return sorted(self._tables)
+
+    def forecast(self, area, at, now=None):
+        """Expected availability of an area at a (naive UTC) time.
+
+        Returns None for an area without a trained profile. The occupancy
+        index must be warm for the live adjustment.
+        """
+        table = self._tables.get(area)
+        if table is None:
+            return None
+        expected = table[self._weekly_bin(at)]
+        if expected is None:
+            return None
+        occupied, full_probability, arrivals, dwell = expected
+        location, capacity = self._capacity.get(area, (None, 0))
+
+        # Near-term forecasts start from the live occupancy: the gap to the
+        # profile shrinks as the vehicles that make it up leave
+        now = now or datetime.utcnow()
+        hours_ahead = (at - now).total_seconds() / 3600
+        live_adjusted = location is not None and 0 <= hours_ahead <= self.live_hours
+        if live_adjusted:
+            current = table[self._weekly_bin(now)]
+            live = capacity - occupancy_index.count_free(location, area)
+            typical_dwell = self._dwell.get(area) or dwell
+            if current is not None and typical_dwell:
+                occupied += (live - current[0]) * math.exp(-hours_ahead * 60 / typical_dwell)
+            else:
+                live_adjusted = False
+        if capacity:
+            occupied = min(max(occupied, 0.0), capacity)
+
+        return {
+            'area': area,
+            'at': at.isoformat(),
+            'capacity': capacity,
+            'expected_occupied': round(occupied, 1),
+            'expected_free': round(capacity - occupied, 1) if capacity else None,
+            'occupancy_rate': round(occupied / capacity, 3) if capacity else None,
+            'full_probability': round(full_probability, 3),
+            'arrivals_per_hour': round(arrivals, 1),
+            'average_dwell_minutes': round(dwell, 1) if dwell else None,
+            'live_adjusted': live_adjusted,
+            'days_trained': self._days.get(area, 0),
+        }
+
+    # Training
+
+    def local_today(self, now=None):
+        now = now or datetime.utcnow()
+        return (now + timedelta(minutes=self.utc_offset_minutes)).date()
+
+    def retrain(self, rebuild=False, until=None, chunk_size=TRAIN_CHUNK_SIZE):
+        """Train the whole local days since the last retrain, up to but not including until.
+
+        until defaults to today, so a nightly run trains yesterday. Returns
+        the number of days trained; raises ForecastConflict (after rolling
+        back) if another retrain covered the same days first.
+        """
+        until = until or self.local_today()
+        if rebuild:
+            db.session.query(ForecastProfile).delete(synchronize_session=False)
+            first_entry = min(filter(None, (db.session.query(func.min(model.entry_time)).scalar()
+                                            for model in RECORD_MODELS)), default=None)
+            start = (first_entry + timedelta(minutes=self.utc_offset_minutes)).date() if first_entry else until
+        else:
+            latest = db.session.query(func.max(ForecastProfile.trained_through)).scalar()
+            if latest is None:
+                return self.retrain(rebuild=True, until=until, chunk_size=chunk_size)
+            start = latest + timedelta(days=1)
+        n_days = (until - start).days
+        if n_days <= 0:
+            db.session.rollback()
+            return 0
+
+        try:
+            sums = self._aggregate(start, n_days, chunk_size)
+            self._merge(sums, start, until - timedelta(days=1))
+            db.session.commit()
+        except (ForecastConflict, IntegrityError) as error:
+            db.session.rollback()
+            raise ForecastConflict(f'Forecast already trained past {start}: {error}') from None
+        self._checked_at = None
+        return n_days
+
+    def _aggregate(self, start, n_days, chunk_size):
+        np = _numpy()
+        capacity = slots_per_area()
+        areas = sorted(capacity)
+        codes = {area: code for code, area in enumerate(areas)}
+        n_areas, n_bins = len(areas), n_days * BINS_PER_DAY
+
+        # Minutes are local from here on; the query bounds are UTC
+        start_minute = (start - EPOCH_DATE).days * MINUTES_PER_DAY
+        end_minute = start_minute + n_days * MINUTES_PER_DAY
+        window_start = EPOCH + timedelta(minutes=start_minute - self.utc_offset_minutes)
+        window_end = EPOCH + timedelta(minutes=end_minute - self.utc_offset_minutes)
+
+        starts = np.zeros(n_areas * (n_bins + 1))
+        arrivals = np.zeros(n_areas * n_bins)
+        departures = np.zeros(n_areas * BINS_PER_WEEK)
+        dwell = np.zeros(n_areas * BINS_PER_WEEK)
+
+        for chunk in _stay_chunks(window_start, window_end, chunk_size):
+            area = np.fromiter((codes.get(row.area or UNKNOWN_AREA, -1) for row in chunk), dtype=np.int64,
+                               count=len(chunk))
+            entry = to_epoch_minutes([row.entry_time for row in chunk]) + self.utc_offset_minutes
+            # Stays still open are parked until the end of the window
+            closed = np.fromiter((row.exit_time is not None for row in chunk), dtype=bool, count=len(chunk))
+            leave = to_epoch_minutes([row.exit_time or window_end for row in chunk]) + self.utc_offset_minutes
+            known = area >= 0
+            area, entry, leave, closed = area[known], entry[known], leave[known], closed[known]
+
+            # A stay is parked at the start of every bin in [first, last)
+            first = np.clip(np.ceil((entry - start_minute) / BIN_MINUTES), 0, n_bins).astype(np.int64)
+            last = np.clip(np.ceil((leave - start_minute) / BIN_MINUTES), 0, n_bins).astype(np.int64)
+            row_offset = area * (n_bins + 1)
+            size = n_areas * (n_bins + 1)
+            starts += np.bincount(row_offset + first, minlength=size)
+            starts -= np.bincount(row_offset + last, minlength=size)
+
+            arrived = (entry >= start_minute) & (entry < end_minute)
+            arrival_bin = ((entry[arrived] - start_minute) // BIN_MINUTES).astype(np.int64)
+            arrivals += np.bincount(area[arrived] * n_bins + arrival_bin, minlength=n_areas * n_bins)
+
+            # Dwell times go to the weekday and bin the stay arrived in
+            ended = closed & (leave >= start_minute) & (leave < end_minute)
+            entry_ended = entry[ended]
+            day, minute = np.divmod(entry_ended, MINUTES_PER_DAY)
+            weekly_bin = ((day.astype(np.int64) + EPOCH_WEEKDAY) % 7 * BINS_PER_DAY
+                          + (minute // BIN_MINUTES).astype(np.int64))
+            key = area[ended] * BINS_PER_WEEK + weekly_bin
+            departures += np.bincount(key, minlength=n_areas * BINS_PER_WEEK)
+            dwell += np.bincount(key, weights=leave[ended] - entry_ended, minlength=n_areas * BINS_PER_WEEK)
+
+        occupied = np.cumsum(starts.reshape(n_areas, n_bins + 1), axis=1)[:, :n_bins]
+        occupied = occupied.reshape(n_areas, n_days, BINS_PER_DAY)
+        slots = np.array([capacity[area] for area in areas], dtype=float)
+        full = occupied >= slots[:, None, None]
+
+        # Fold the days of the window onto the days of the week
+        weekdays = ((start - EPOCH_DATE).days + np.arange(n_days) + EPOCH_WEEKDAY) % 7
+        weekly_occupied = np.zeros((n_areas, 7, BINS_PER_DAY))
+        weekly_full = np.zeros((n_areas, 7, BINS_PER_DAY))
+        weekly_arrivals = np.zeros((n_areas, 7, BINS_PER_DAY))
+        np.add.at(weekly_occupied, (slice(None), weekdays), occupied)
+        np.add.at(weekly_full, (slice(None), weekdays), full)
+        np.add.at(weekly_arrivals, (slice(None), weekdays), arrivals.reshape(n_areas, n_days, BINS_PER_DAY))
+        days = np.broadcast_to(np.bincount(weekdays, minlength=7)[None, :, None], weekly_occupied.shape)
+
+        columns = [days, weekly_arrivals, weekly_occupied, weekly_full,
+                   departures.reshape(n_areas, 7, BINS_PER_DAY), dwell.reshape(n_areas, 7, BINS_PER_DAY)]
+        sums = {}
+        for code, weekday, time_bin in zip(*np.nonzero(days + columns[4])):
+            values = [column[code, weekday, time_bin].item() for column in columns]
+            # Counts are stored as integers, occupied and dwell_minutes as floats
+            sums[(areas[code], int(weekday), int(time_bin))] = [
+                value if field in ('occupied', 'dwell_minutes') else int(value)
+                for field, value in zip(PROFILE_FIELDS, values)
+            ]
+        return sums
+
+    def _merge(self, sums, start, trained_through):
+        existing = {
+            (row.area, row.weekday, row.time_bin): row.id
+            for row in db.session.query(ForecastProfile.id, ForecastProfile.area, ForecastProfile.weekday,
+                                        ForecastProfile.time_bin)
+        }
+
+        updates, inserts = [], []
+        for (area, weekday, time_bin), values in sums.items():
+            profile_id = existing.get((area, weekday, time_bin))
+            if profile_id is None:
+                inserts.append(dict(zip(PROFILE_FIELDS, values), area=area, weekday=weekday,
+                                    time_bin=time_bin, trained_through=trained_through))
+            else:
+                updates.append(dict(zip(('b_' + field for field in PROFILE_FIELDS), values), b_id=profile_id))
+
+        table = ForecastProfile.__table__
+        if updates:
+            # Rows trained past the start of the window were trained by someone else
+            result = db.session.execute(
+                update(table)
+                .where(table.c.id == bindparam('b_id'), table.c.trained_through < start)
+                .values({field: table.c[field] + bindparam('b_' + field) for field in PROFILE_FIELDS}
+                        | {'trained_through': trained_through}),
+                updates
+            )
+            if result.rowcount != len(updates):
+                raise ForecastConflict('Profiles changed during the retrain')
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+
+
+forecaster = FacilityLocal(AvailabilityForecaster, broadcast=('init_app',))
+occupancy_index.add_warm_listener(forecaster._on_index_warm)
@@ -0,0 +1,327 @@
+"""
+Batch ingestion of gate events for the Car Parking System.
+
+ANPR cameras buffer entry and exit events while their uplink is down and
+replay them in bursts. apply_gate_events validates a whole batch with a few
+set-based queries, replays the events in order against an in-memory view of
+the slots and open records they touch, and writes the outcome in a single
+transaction: one conditional UPDATE per group of slot transitions, one bulk
+INSERT for new records and one executemany UPDATE for closed ones.
+
+Vehicles may be given by vehicle_id or license_plate. Exits may name the
+record_id, or just the vehicle, in which case its open record is closed.
+The gate journal (journal.py) hands out record ids before the records are
+written; with preassigned_ids its entry events carry the record_id the new
+record is created with, and later exits in the batch may refer to it. The
+journal also updates the occupancy index itself, when it acknowledges an
+event, so it passes update_index=False.
+
+Entries into a slot booked for someone else within the walk-in horizon are
+refused like entries at the gate (reservations.reserved_for_others), as of
+the event's timestamp. Journaled entries were checked when they were
+acknowledged, so entries with preassigned ids are not checked again.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, update
+
+from models import ParkingRecord, ParkingSlot, Vehicle, db, normalize_plate
+from occupancy import stage_occupancy_change
+from reservations import reserved_for_others
+from tariffs import tariff_registry
+
+MAX_BATCH_SIZE = 10000
+IN_CHUNK_SIZE = 500
+
+
+class GateBatchConflict(Exception):
+    """Slots or records changed while the batch was applied; retry it"""
+
+
+def _chunked(values, size=IN_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _parse_time(value, default):
+    if not value:
+        return default
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _load_vehicles(vehicle_ids, plates):
+    by_id, by_plate = {}, {}
+    columns = (Vehicle.id, Vehicle.plate_key, Vehicle.user_id)
+    for chunk in _chunked(vehicle_ids):
+        for row in db.session.query(*columns).filter(Vehicle.id.in_(chunk)):
+            by_id[row.id] = row
+    for chunk in _chunked(plates):
+        for row in db.session.query(*columns).filter(Vehicle.plate_key.in_(chunk)):
+            by_plate[row.plate_key] = row
+            by_id[row.id] = row
+    return by_id, by_plate
+
+
+def _load_records(record_ids, open_vehicle_ids):
+    columns = (ParkingRecord.id, ParkingRecord.vehicle_id, ParkingRecord.slot_id,
+               ParkingRecord.entry_time, ParkingRecord.exit_time, ParkingRecord.parking_type)
+    by_id, open_by_vehicle = {}, {}
+    for chunk in _chunked(record_ids):
+        for row in db.session.query(*columns).filter(ParkingRecord.id.in_(chunk)):
+            by_id[row.id] = row
+    for chunk in _chunked(open_vehicle_ids):
+        rows = db.session.query(*columns).filter(
+            ParkingRecord.vehicle_id.in_(chunk),
+            ParkingRecord.exit_time.is_(None)
+        ).order_by(ParkingRecord.entry_time)
+        for row in rows:
+            by_id[row.id] = row
+            open_by_vehicle[row.vehicle_id] = row.id
+    return by_id, open_by_vehicle
+
+
+def _load_slots(slot_ids):
+    states, areas = {}, {}
+    for chunk in _chunked(slot_ids):
+        rows = db.session.query(ParkingSlot.id, ParkingSlot.is_occupied, ParkingSlot.area).filter(
+            ParkingSlot.id.in_(chunk)
+        )
+        for slot_id, is_occupied, area in rows:
+            states[slot_id] = bool(is_occupied)
+            areas[slot_id] = area
+    return states, areas
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _OpenRecord:
+    """A record opened or closed during the batch"""
+
+    __slots__ = ('record', 'record_id', 'vehicle_id', 'slot_id', 'entry_time', 'exit_time',
+                 'parking_type')
+
+    def __init__(self, record_id, vehicle_id, slot_id, entry_time, exit_time=None, parking_type=None,
+                 record=None):
+        self.record = record
+        self.record_id = record_id
+        self.vehicle_id = vehicle_id
+        self.slot_id = slot_id
+        self.entry_time = entry_time
+        self.exit_time = exit_time
+        self.parking_type = parking_type
+
+
+def apply_gate_events(events, now=None, preassigned_ids=False, update_index=True):
+    """Apply a list of entry/exit events in one transaction.
+
+    Returns one result dict per event, in order. Raises GateBatchConflict
+    (after rolling back) if another request changed a touched slot or record
+    while the batch was being applied.
+    """
+    now = now or datetime.utcnow()
+
+    # Collect every key the batch refers to so validation is set-based
+    vehicle_ids, plates, slot_ids, record_ids = set(), set(), set(), set()
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        if event.get('vehicle_id') is not None:
+            vehicle_ids.add(_as_int(event['vehicle_id']))
+        if event.get('license_plate'):
+            plates.add(normalize_plate(event['license_plate']))
+        if event.get('slot_id') is not None:
+            slot_ids.add(_as_int(event['slot_id']))
+        if event.get('record_id') is not None:
+            record_ids.add(_as_int(event['record_id']))
+    vehicle_ids.discard(None)
+    slot_ids.discard(None)
+    record_ids.discard(None)
+
+    vehicles_by_id, vehicles_by_plate = _load_vehicles(vehicle_ids, plates)
+    exit_vehicle_ids = {
+        vehicle.id
+        for event in events if isinstance(event, dict) and event.get('type') == 'exit'
+        for vehicle in [_resolve_vehicle(event, vehicles_by_id, vehicles_by_plate)] if vehicle
+    }
+    record_rows, open_by_vehicle = _load_records(record_ids, exit_vehicle_ids)
+    slot_ids.update(row.slot_id for row in record_rows.values())
+    initial_states, areas = _load_slots(slot_ids)
+
+    states = dict(initial_states)
+    records = {
+        row.id: _OpenRecord(row.id, row.vehicle_id, row.slot_id, row.entry_time, row.exit_time,
+                            row.parking_type)
+        for row in record_rows.values()
+    }
+    open_by_vehicle = {vehicle_id: records[record_id] for vehicle_id, record_id in open_by_vehicle.items()}
+    new_records = []
+    closed = []
+    results = []
+
+    for index, event in enumerate(events):
+        result = {'index': index, 'type': event.get('type') if isinstance(event, dict) else None}
+        try:
+            if not isinstance(event, dict):
+                raise ValueError('Event must be an object')
+            event_time = _parse_time(event.get('timestamp'), now)
+            if event.get('type') == 'entry':
+                result.update(_apply_entry(event, event_time, vehicles_by_id, vehicles_by_plate,
+                                           states, records if preassigned_ids else None,
+                                           open_by_vehicle, new_records,
+                                           check_reservations=not preassigned_ids))
+            elif event.get('type') == 'exit':
+                result.update(_apply_exit(event, event_time, vehicles_by_id, vehicles_by_plate,
+                                          states, areas, records, open_by_vehicle, closed))
+            else:
+                raise ValueError("Event type must be 'entry' or 'exit'")
+            result['success'] = True
+        except ValueError as error:
+            result.update(success=False, message=str(error))
+        results.append(result)
+
+    try:
+        _write_slot_transitions(initial_states, states)
+        db.session.add_all(open_record.record for open_record in new_records)
+        db.session.flush()
+        _write_closures(closed)
+    except GateBatchConflict:
+        db.session.rollback()
+        raise
+
+    # Records created in this batch only have ids after the flush
+    for result in results:
+        open_record = result.pop('_open_record', None)
+        if open_record is not None:
+            result['record_id'] = open_record.record.id if open_record.record else open_record.record_id
+
+    for slot_id, occupied in states.items():
+        if update_index and occupied != initial_states[slot_id]:
+            stage_occupancy_change(slot_id, occupied)
+    db.session.commit()
+    return results
+
+
+def _resolve_vehicle(event, vehicles_by_id, vehicles_by_plate):
+    if event.get('vehicle_id') is not None:
+        return vehicles_by_id.get(_as_int(event['vehicle_id']))
+    if event.get('license_plate'):
+        return vehicles_by_plate.get(normalize_plate(event['license_plate']))
+    return None
+
+
+def _apply_entry(event, entry_time, vehicles_by_id, vehicles_by_plate, states, records, open_by_vehicle,
+                 new_records, check_reservations=True):
+    vehicle = _resolve_vehicle(event, vehicles_by_id, vehicles_by_plate)
+    if vehicle is None:
+        raise ValueError('Vehicle not found')
+    slot_id = _as_int(event.get('slot_id'))
+    if slot_id not in states:
+        raise ValueError('Parking slot not found')
+    if states[slot_id]:
+        raise ValueError('Parking slot is already occupied')
+    if check_reservations and reserved_for_others(slot_id, vehicle.id, now=entry_time):
+        raise ValueError('Parking slot is reserved')
+
+    # records is only passed when entries carry their preassigned record_id
+    record_id = _as_int(event.get('record_id')) if records is not None else None
+    if records is not None and (record_id is None or record_id in records):
+        raise ValueError('Invalid record id')
+
+    states[slot_id] = True
+    parking_type = event.get('parking_type', 'Indoor')
+    record = ParkingRecord(
+        id=record_id,
+        user_id=vehicle.user_id,
+        vehicle_id=vehicle.id,
+        slot_id=slot_id,
+        parking_type=parking_type,
+        entry_time=entry_time
+    )
+    open_record = _OpenRecord(record_id, vehicle.id, slot_id, entry_time, parking_type=parking_type,
+                              record=record)
+    new_records.append(open_record)
+    if records is not None:
+        records[record_id] = open_record
+    open_by_vehicle[vehicle.id] = open_record
+    return {'slot_id': slot_id, '_open_record': open_record}
+
+
+def _apply_exit(event, exit_time, vehicles_by_id, vehicles_by_plate, states, areas, records,
+                open_by_vehicle, closed):
+    if event.get('record_id') is not None:
+        open_record = records.get(_as_int(event['record_id']))
+    else:
+        vehicle = _resolve_vehicle(event, vehicles_by_id, vehicles_by_plate)
+        if vehicle is None:
+            raise ValueError('Vehicle not found')
+        open_record = open_by_vehicle.get(vehicle.id)
+    if open_record is None:
+        raise ValueError('Parking record not found')
+    if open_record.exit_time is not None:
+        raise ValueError('Vehicle has already exited')
+    if exit_time < open_record.entry_time:
+        raise ValueError('Exit time is before entry time')
+
+    open_record.exit_time = exit_time
+    duration = int((exit_time - open_record.entry_time).total_seconds() // 60)
+    tariff = tariff_registry.select(open_record.parking_type, areas.get(open_record.slot_id))
+    fee = tariff.fee(open_record.entry_time, exit_time)
+    if open_record.record is not None:
+        open_record.record.exit_time = exit_time
+        open_record.record.fee = fee
+        open_record.record.payment_status = 'Paid'
+        open_record.record.status = 'completed'
+    else:
+        closed.append({'b_id': open_record.record_id, 'b_exit_time': exit_time, 'b_fee': fee})
+    if open_by_vehicle.get(open_record.vehicle_id) is open_record:
+        del open_by_vehicle[open_record.vehicle_id]
+    if open_record.slot_id in states:
+        states[open_record.slot_id] = False
+    return {'duration': duration, 'fee': fee, '_open_record': open_record}
+
+
+def _write_slot_transitions(initial_states, states):
+    """Move every touched slot from its initial to its final state, or conflict"""
+    groups = {}
+    for slot_id, final in states.items():
+        groups.setdefault((initial_states[slot_id], final), []).append(slot_id)
+    now = datetime.utcnow()
+    for (initial, final), group_ids in groups.items():
+        # Unchanged slots are re-asserted too so a concurrent change is noticed
+        expected = ParkingSlot.is_occupied.is_(True) if initial else ParkingSlot.is_occupied.isnot(True)
+        values = {'is_occupied': final}
+        if initial != final:
+            values['occupancy_changed_at'] = now
+        for chunk in _chunked(group_ids):
+            result = db.session.execute(
+                update(ParkingSlot)
+                .where(ParkingSlot.id.in_(chunk), expected)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != len(chunk):
+                raise GateBatchConflict('Parking slots changed during the batch, please retry')
+
+
+def _write_closures(closed):
+    if not closed:
+        return
+    table = ParkingRecord.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam('b_id'), table.c.exit_time.is_(None))
+        .values(exit_time=bindparam('b_exit_time'), fee=bindparam('b_fee'),
+                payment_status='Paid', status='completed')
+    )
+    result = db.session.execute(statement, closed)
+    if result.rowcount != len(closed):
+        raise GateBatchConflict('Parking records changed during the batch, please retry')
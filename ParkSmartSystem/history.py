@@ -0,0 +1,113 @@
+"""
+Parking history queries for the Car Parking System.
+
+History is paged with a keyset cursor on (entry_time, id) instead of
+OFFSET, so fetching an older page costs the same as the first one however
+long the customer's history is. The queries are backed by the composite
+indexes on parking_records and eager-load each record's vehicle and slot so
+templates don't issue a lazy load per row. Vehicles are loaded with a second
+IN query rather than a join: they are shared by all facilities and may live
+in another database than the records.
+
+Completed records older than the archive age live in
+parking_records_archive (see archive.py). History pages read only the hot
+table unless asked for the archive too; then both tables are paged with the
+same cursor and the two pages merged.
+"""
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload, selectinload
+
+from archive import RECORD_MODELS
+from models import ParkingRecord
+
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+
+
+def encode_cursor(record):
+    raw = f"{record.entry_time.isoformat()}|{record.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (entry_time, record_id) for a cursor, or None if it is invalid"""
+    try:
+        entry_time, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(entry_time), int(record_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _with_details(query, model=ParkingRecord):
+    return query.options(selectinload(model.vehicle), joinedload(model.slot))
+
+
+def get_active_parkings(user_id):
+    """Open parking records of a user"""
+    return _with_details(ParkingRecord.query.filter(
+        ParkingRecord.user_id == user_id,
+        ParkingRecord.exit_time.is_(None)
+    )).order_by(ParkingRecord.entry_time.desc()).all()
+
+
+def get_recent_history(user_id, limit=5):
+    """Most recently completed parking records of a user"""
+    return _with_details(ParkingRecord.query.filter(
+        ParkingRecord.user_id == user_id,
+        ParkingRecord.exit_time.isnot(None)
+    )).order_by(ParkingRecord.exit_time.desc()).limit(limit).all()
+
+
+def _history_query(model, user_id, position, limit):
+    query = model.query.filter(
+        model.user_id == user_id,
+        model.exit_time.isnot(None)
+    )
+    if position:
+        entry_time, record_id = position
+        query = query.filter(or_(
+            model.entry_time < entry_time,
+            and_(model.entry_time == entry_time, model.id < record_id)
+        ))
+    return _with_details(query, model).order_by(
+        model.entry_time.desc(),
+        model.id.desc()
+    ).limit(limit)
+
+
+def get_history_page(user_id, cursor=None, limit=HISTORY_PAGE_SIZE, archived=False):
+    """One page of completed records, newest entry first, archived ones included if asked.
+
+    Returns (records, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+    position = decode_cursor(cursor) if cursor else None
+
+    models = RECORD_MODELS if archived else (ParkingRecord,)
+    records = [record for model in models for record in _history_query(model, user_id, position, limit + 1)]
+    if len(models) > 1:
+        records.sort(key=lambda record: (record.entry_time, record.id), reverse=True)
+        records = records[:limit + 1]
+
+    if len(records) > limit:
+        records = records[:limit]
+        return records, encode_cursor(records[-1])
+    return records, None
+
+
+def record_to_dict(record):
+    return {
+        'id': record.id,
+        'license_plate': record.vehicle.license_plate,
+        'slot_number': record.slot.slot_number,
+        'area': record.slot.area,
+        'parking_type': record.parking_type,
+        'entry_time': record.entry_time.isoformat(),
+        'exit_time': record.exit_time.isoformat() if record.exit_time else None,
+        'duration': record.duration,
+        'fee': record.fee,
+        'payment_status': record.payment_status,
+    }
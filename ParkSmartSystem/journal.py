@@ -0,0 +1,405 @@
+"""
+Write-behind gate journal for the Car Parking System.
+
+Without it every entry and exit commits its own transaction in the request,
+so gate latency follows the database's fsync and its single writer lock.
+With GATE_JOURNAL set to a file path, entries and exits are instead checked
+against this process's view of the slots and open records, appended to the
+journal and acknowledged once the journal is synced to disk. Concurrent
+gates share one fdatasync (group commit): a request that finds no sync in
+progress syncs everything written so far while the others wait for it.
+
+A background applier writes the journaled events to parking_records and
+parking_slots with apply_gate_events, many events per transaction. The
+sequence number of the last event written is stored in journal_checkpoints
+in the same transaction, so when the journal is opened after a crash the
+events after the checkpoint are replayed. The file is truncated once
+everything in it has been applied.
+
+Record ids are handed out by the journal when a car enters, so its exit can
+refer to a record that is not written yet. The history, dashboard and
+rollups catch up once the applier has run, normally within milliseconds.
+
+The journal must be the only writer of gate events. The process that opens
+it holds a lock on the file, and in other processes the gate endpoints
+answer 503, so run a single gunicorn worker with threads
+(--workers 1 --threads 16) when GATE_JOURNAL is set.
+/api/gate-events/batch waits for the journal to be applied and holds new
+gate events while it writes its batch directly.
+
+Each facility has a journal of its own, GATE_JOURNAL for the default one and
+GATE_JOURNAL.<facility> for the others. Since the journal hands out record
+ids, it is only used by facilities that don't share their database with
+another facility (see facilities.py); the others write directly.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import func, text, update
+
+from facilities import DEFAULT_FACILITY, FacilityLocal, facility_registry, use_facility
+from gate_events import apply_gate_events
+from models import JournalCheckpoint, ParkingRecord, db
+from occupancy import occupancy_index
+from rollups import refresh_rollups
+from tariffs import tariff_registry
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = 'gate'
+APPLY_BATCH_SIZE = 500
+# Let a few more events arrive before the applier writes a batch
+APPLY_DELAY_SECONDS = 0.01
+APPLY_RETRY_SECONDS = 1
+COMPACT_BYTES = 1024 * 1024
+
+
+class JournalUnavailable(Exception):
+    """The journal is held by another process or can no longer be written"""
+
+
+class OpenRecord:
+    """A parking record without an exit, in the database or only journaled"""
+
+    __slots__ = ('user_id', 'slot_id', 'parking_type', 'entry_time')
+
+    def __init__(self, user_id, slot_id, parking_type, entry_time):
+        self.user_id = user_id
+        self.slot_id = slot_id
+        self.parking_type = parking_type
+        self.entry_time = entry_time
+
+
+def _read_journal(fd):
+    """[(sequence, event)] of the complete lines, and the bytes they take"""
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while True:
+        chunk = os.read(fd, 1 << 20)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    data = b''.join(chunks)
+
+    entries = []
+    position = 0
+    while True:
+        end = data.find(b'\n', position)
+        if end < 0:
+            break
+        try:
+            event = json.loads(data[position:end])
+            sequence = event.pop('seq')
+        except (ValueError, KeyError):
+            # A line torn by a crash was never acknowledged
+            break
+        entries.append((sequence, event))
+        position = end + 1
+    return entries, position
+
+
+class GateJournal:
+    """Append-only journal of gate events, applied to the database behind the requests"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._apply_lock = threading.Lock()
+        self._app = None
+        self._fd = None
+        self._failed = None
+        self._applier = None
+        self._stopping = False
+        self._held = False
+        self._syncing = False
+        self._open_records = {}
+        self._closed = set()
+        self._unapplied = []
+        self._written = 0
+        self._durable = 0
+        self._applied = 0
+        self._next_record_id = None
+        self.path = None
+        self.facility = DEFAULT_FACILITY
+        self.stats = Counter()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def init_app(self, app):
+        """Journal gate events to the GATE_JOURNAL file, if it is set"""
+        app.config.setdefault('GATE_JOURNAL', None)
+        self._app = app
+        path = app.config['GATE_JOURNAL']
+        if path and self.facility != DEFAULT_FACILITY:
+            path = f'{path}.{self.facility}'
+        # Record ids can't be handed out here if another facility inserts records too
+        self.path = None if facility_registry.shares_database(self.facility) else path
+
+    def entry(self, user_id, vehicle_id, slot_id, parking_type):
+        """Journal a vehicle parking in a slot; returns (record_id, slot_info).
+
+        Raises LookupError for an unknown slot, ValueError for an occupied
+        one and JournalUnavailable if the journal can't be used.
+        """
+        try:
+            slot_id = int(slot_id)
+        except (TypeError, ValueError):
+            raise LookupError('Parking slot not found') from None
+        occupancy_index.ensure_warm()
+        now = datetime.utcnow()
+        with self._condition:
+            self._ready()
+            slot = occupancy_index.get(slot_id)
+            if slot is None:
+                raise LookupError('Parking slot not found')
+            if occupancy_index.is_occupied(slot_id):
+                raise ValueError('Parking slot is already occupied')
+            record_id = self._next_record_id
+            sequence = self._append({'type': 'entry', 'record_id': record_id, 'vehicle_id': vehicle_id,
+                                     'slot_id': slot_id, 'parking_type': parking_type,
+                                     'timestamp': now.isoformat()})
+            self._next_record_id += 1
+            self._open_records[record_id] = OpenRecord(user_id, slot_id, parking_type, now)
+            occupancy_index.set_occupied(slot_id, True)
+        self._wait_durable(sequence)
+        return record_id, slot
+
+    def exit(self, user_id, record_id):
+        """Journal the exit of an open record; returns (duration_minutes, fee).
+
+        Raises LookupError if the user has no such record, ValueError if it
+        is already closed and JournalUnavailable if the journal can't be used.
+        """
+        try:
+            record_id = int(record_id)
+        except (TypeError, ValueError):
+            raise LookupError('Parking record not found') from None
+        occupancy_index.ensure_warm()
+        now = datetime.utcnow()
+        with self._condition:
+            self._ready()
+            record = self._open_records.get(record_id)
+            if record is not None and record.user_id == user_id:
+                sequence = self._append({'type': 'exit', 'record_id': record_id, 'timestamp': now.isoformat()})
+                del self._open_records[record_id]
+                self._closed.add(record_id)
+                occupancy_index.set_occupied(record.slot_id, False)
+            else:
+                record = None
+                closed = record_id in self._closed
+        if record is None:
+            # Tell a closed record from a missing one
+            if closed or db.session.query(ParkingRecord.id).filter_by(id=record_id, user_id=user_id).first():
+                raise ValueError('Vehicle has already exited')
+            raise LookupError('Parking record not found')
+        self._wait_durable(sequence)
+
+        slot = occupancy_index.get(record.slot_id)
+        tariff = tariff_registry.select(record.parking_type, slot.area if slot else None)
+        duration = int((now - record.entry_time).total_seconds() // 60)
+        return duration, tariff.fee(record.entry_time, now)
+
+    def apply_batch(self, events):
+        """Write a gate event batch straight to the database.
+
+        Waits until everything journaled has been applied and holds new gate
+        events until the batch is written.
+        """
+        with self._condition:
+            self._ready()
+            self._held = True
+            self._condition.wait_for(lambda: self._applied >= self._written or self._failed is not None)
+        try:
+            with self._apply_lock:
+                results = apply_gate_events(events)
+                self._load_open_records()
+            return results
+        finally:
+            with self._condition:
+                self._held = False
+                self._condition.notify_all()
+
+    def close(self):
+        """Apply everything journaled, stop the applier and release the file"""
+        with self._condition:
+            if self._fd is None:
+                return
+            self._condition.wait_for(lambda: self._applied >= self._written or self._failed is not None)
+            self._stopping = True
+            self._condition.notify_all()
+        self._applier.join()
+        with self._condition:
+            os.close(self._fd)
+            self._fd = None
+            self._applier = None
+            self._stopping = False
+        occupancy_index.for_facility(self.facility).sync_enabled = True
+
+    def _ready(self):
+        # Called with the condition held
+        if self._fd is None and self._failed is None:
+            self._open()
+        self._condition.wait_for(lambda: not self._held or self._failed is not None)
+        if self._failed is not None:
+            raise JournalUnavailable(self._failed)
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise JournalUnavailable('The gate journal is held by another worker process') from None
+        # Acknowledged events reach the index before the database, so don't resync it from there
+        occupancy_index.for_facility(self.facility).sync_enabled = False
+
+        JournalCheckpoint.__table__.create(db.session.get_bind(JournalCheckpoint), checkfirst=True)
+        checkpoint = db.session.get(JournalCheckpoint, CHECKPOINT_NAME)
+        if checkpoint is None:
+            checkpoint = JournalCheckpoint(name=CHECKPOINT_NAME, sequence=0)
+            db.session.add(checkpoint)
+        applied = checkpoint.sequence
+        db.session.commit()
+
+        entries, valid_bytes = _read_journal(fd)
+        os.ftruncate(fd, valid_bytes)
+        self._fd = fd
+        self._unapplied = [(sequence, event) for sequence, event in entries if sequence > applied]
+        self._applied = applied
+        self._written = self._durable = max([applied] + [sequence for sequence, _ in entries])
+        if self._unapplied:
+            logger.warning('Replaying %d gate events from %s', len(self._unapplied), self.path)
+            with self._apply_lock:
+                while self._unapplied:
+                    self._apply_batch()
+            occupancy_index.warm()
+        with self._apply_lock:
+            self._load_open_records()
+
+        self._applier = threading.Thread(target=self._run_applier, name='gate-journal', daemon=True)
+        self._applier.start()
+
+    def _load_open_records(self):
+        # Called with the apply lock held, once the database has caught up
+        rows = db.session.query(
+            ParkingRecord.id, ParkingRecord.user_id, ParkingRecord.slot_id,
+            ParkingRecord.parking_type, ParkingRecord.entry_time
+        ).filter(ParkingRecord.exit_time.is_(None))
+        last_id = db.session.query(func.max(ParkingRecord.id)).scalar()
+        open_records = {row.id: OpenRecord(row.user_id, row.slot_id, row.parking_type, row.entry_time)
+                        for row in rows}
+        db.session.commit()
+        with self._condition:
+            self._open_records = open_records
+            self._closed = set()
+            self._next_record_id = (last_id or 0) + 1
+
+    def _append(self, event):
+        # Called with the condition held
+        sequence = self._written + 1
+        line = json.dumps(dict(event, seq=sequence), separators=(',', ':')) + '\n'
+        try:
+            os.write(self._fd, line.encode())
+        except OSError as error:
+            self._fail(error)
+            raise JournalUnavailable(self._failed) from error
+        self._written = sequence
+        self._unapplied.append((sequence, event))
+        return sequence
+
+    def _wait_durable(self, sequence):
+        with self._condition:
+            while self._durable < sequence:
+                if self._failed is not None:
+                    raise JournalUnavailable(self._failed)
+                if self._syncing:
+                    self._condition.wait()
+                    continue
+                # Sync everything written so far on behalf of every waiting gate
+                self._syncing = True
+                target = self._written
+                self._condition.release()
+                try:
+                    os.fdatasync(self._fd)
+                    error = None
+                except OSError as sync_error:
+                    error = sync_error
+                finally:
+                    self._condition.acquire()
+                    self._syncing = False
+                if error is not None:
+                    self._fail(error)
+                    raise JournalUnavailable(self._failed) from error
+                self._durable = max(self._durable, target)
+                self.stats['syncs'] += 1
+                self._condition.notify_all()
+
+    def _fail(self, error):
+        # Called with the condition held; the in-memory state can't be trusted any more
+        self._failed = f'The gate journal could not be written: {error}'
+        logger.error(self._failed)
+        self._condition.notify_all()
+
+    def _run_applier(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopping or (
+                    self._unapplied and self._unapplied[0][0] <= self._durable))
+                if self._stopping and not self._unapplied:
+                    return
+            time.sleep(APPLY_DELAY_SECONDS)
+            with self._app.app_context(), use_facility(self.facility):
+                try:
+                    with self._apply_lock:
+                        self._apply_batch()
+                except Exception:
+                    logger.exception('Applying gate events failed, retrying')
+                    db.session.rollback()
+                    time.sleep(APPLY_RETRY_SECONDS)
+
+    def _apply_batch(self):
+        # Called with the apply lock held
+        with self._condition:
+            batch = [entry for entry in self._unapplied[:APPLY_BATCH_SIZE] if entry[0] <= self._durable]
+        if not batch:
+            return
+        last_sequence = batch[-1][0]
+        events = [event for _, event in batch]
+
+        # The checkpoint is committed together with the events it covers
+        db.session.execute(update(JournalCheckpoint).where(JournalCheckpoint.name == CHECKPOINT_NAME)
+                           .values(sequence=last_sequence))
+        record_ids = [event['record_id'] for event in events if event['type'] == 'entry']
+        if record_ids and db.session.get_bind(ParkingRecord).dialect.name == 'postgresql':
+            # Keep the id sequence ahead of the ids the journal handed out
+            db.session.execute(text("SELECT setval(pg_get_serial_sequence('parking_records', 'id'), :id)"),
+                               {'id': max(record_ids)}, bind_arguments={'mapper': ParkingRecord})
+        # The occupancy index was updated when the events were acknowledged
+        results = apply_gate_events(events, preassigned_ids=True, update_index=False)
+
+        for result in results:
+            if not result['success']:
+                # Only possible if something besides the journal changed the slots or records
+                logger.warning('Journaled gate event %s was not applied: %s',
+                               events[result['index']], result['message'])
+        self.stats['applied'] += len(events)
+        self.stats['batches'] += 1
+
+        with self._condition:
+            del self._unapplied[:len(batch)]
+            self._applied = last_sequence
+            self._closed.difference_update(event['record_id'] for event in events if event['type'] == 'exit')
+            if self._applied >= self._written and os.fstat(self._fd).st_size > COMPACT_BYTES:
+                os.ftruncate(self._fd, 0)
+            self._condition.notify_all()
+        refresh_rollups()
+
+
+gate_journal = FacilityLocal(GateJournal, broadcast=('init_app',))
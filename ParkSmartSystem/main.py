@@ -1,8 +1,10 @@
-from app import app, db
-import routes  # noqa: F401
+from app import create_app
+from commands import init_database
+
+app = create_app()
 
 if __name__ == "__main__":
     with app.app_context():
-        # Ensure tables are created
-        db.create_all()
+        # Ensure tables and slots exist for local development
+        init_database()
     app.run(host="0.0.0.0", port=5000, debug=True)
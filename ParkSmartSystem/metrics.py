@@ -0,0 +1,248 @@
+"""
+Request and SQL metrics for the Car Parking System.
+
+Each request's latency is recorded in a histogram per endpoint, together
+with the number of SQL statements it ran and the time they took. Statements
+slower than SLOW_QUERY_SECONDS are counted. Everything is served in the
+Prometheus text format at /metrics. With SLOW_QUERY_SAMPLES on, the text of
+the latest few slow statements is also kept and served as JSON at
+/metrics/slow-queries; it is off by default as it shows the schema.
+
+Both endpoints only answer clients whose address is in
+METRICS_ALLOWED_ADDRESSES or that send "Authorization: Bearer
+<METRICS_TOKEN>"; anyone else gets a 403. Neither is set by default, so
+metrics are collected but not served until one is. Behind a reverse proxy
+every client has the proxy's address, so use a token there.
+
+Every thread writes to its own shard of counters, so recording a request
+takes no lock; the shards are only summed when /metrics is scraped. A scrape
+may see a request half recorded, which Prometheus tolerates.
+
+Metrics are kept per worker process. With several gunicorn workers each
+scrape reports the worker that happened to serve it.
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from flask import current_app, g, has_app_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_SECONDS = 0.1
+SLOW_QUERY_SAMPLES = 50
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Shard:
+    """Counters written by a single thread"""
+
+    def __init__(self):
+        # (endpoint, method, status) -> request count
+        self.requests = {}
+        # endpoint -> [bucket counts..., +Inf count], latency sum
+        self.latency = {}
+        self.latency_sum = {}
+        # endpoint -> statements, seconds, slow statements
+        self.sql_queries = {}
+        self.sql_seconds = {}
+        self.sql_slow = {}
+
+
+class MetricsRegistry:
+    """Per-thread counter shards, summed on scrape"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, slow_query_samples=SLOW_QUERY_SAMPLES):
+        self.buckets = buckets
+        self.slow_queries = deque(maxlen=slow_query_samples)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe_request(self, endpoint, method, status, seconds, sql_queries, sql_seconds, sql_slow):
+        shard = self._shard()
+        key = (endpoint, method, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+
+        counts = shard.latency.get(endpoint)
+        if counts is None:
+            counts = shard.latency[endpoint] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, seconds)] += 1
+        shard.latency_sum[endpoint] = shard.latency_sum.get(endpoint, 0.0) + seconds
+
+        shard.sql_queries[endpoint] = shard.sql_queries.get(endpoint, 0) + sql_queries
+        shard.sql_seconds[endpoint] = shard.sql_seconds.get(endpoint, 0.0) + sql_seconds
+        if sql_slow:
+            shard.sql_slow[endpoint] = shard.sql_slow.get(endpoint, 0) + sql_slow
+
+    def add_slow_query(self, endpoint, statement, seconds):
+        # deque.append is atomic, older samples fall off the end
+        self.slow_queries.append({
+            'endpoint': endpoint,
+            'statement': statement,
+            'seconds': round(seconds, 6),
+            'at': time.time(),
+        })
+
+    def reset(self):
+        with self._lock:
+            self._shards = []
+            self._local = threading.local()
+        self.slow_queries.clear()
+
+    def _merged(self):
+        with self._lock:
+            shards = list(self._shards)
+        totals = {name: {} for name in ('requests', 'latency_sum', 'sql_queries', 'sql_seconds', 'sql_slow')}
+        latency = {}
+        for shard in shards:
+            for name, merged in totals.items():
+                for key, value in list(getattr(shard, name).items()):
+                    merged[key] = merged.get(key, 0) + value
+            for endpoint, counts in list(shard.latency.items()):
+                merged_counts = latency.setdefault(endpoint, [0] * len(counts))
+                for i, count in enumerate(list(counts)):
+                    merged_counts[i] += count
+        totals['latency'] = latency
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        totals = self._merged()
+        lines = [
+            '# HELP parksmart_http_requests_total Requests served, by endpoint, method and status.',
+            '# TYPE parksmart_http_requests_total counter',
+        ]
+        for (endpoint, method, status), count in sorted(totals['requests'].items()):
+            lines.append(f'parksmart_http_requests_total{{endpoint="{_escape(endpoint)}",method="{method}",'
+                         f'status="{status}"}} {count}')
+
+        lines += [
+            '# HELP parksmart_http_request_duration_seconds Request latency by endpoint.',
+            '# TYPE parksmart_http_request_duration_seconds histogram',
+        ]
+        for endpoint, counts in sorted(totals['latency'].items()):
+            label = _escape(endpoint)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'parksmart_http_request_duration_seconds_bucket{{endpoint="{label}",le="{le}"}} '
+                             f'{cumulative}')
+            lines.append(f'parksmart_http_request_duration_seconds_sum{{endpoint="{label}"}} '
+                         f'{totals["latency_sum"].get(endpoint, 0.0):.6f}')
+            lines.append(f'parksmart_http_request_duration_seconds_count{{endpoint="{label}"}} {cumulative}')
+
+        for name, kind, help_text, fmt in (
+            ('sql_queries', 'parksmart_sql_queries_total', 'SQL statements run, by endpoint.', '{}'),
+            ('sql_seconds', 'parksmart_sql_seconds_total', 'Time spent in SQL statements, by endpoint.', '{:.6f}'),
+            ('sql_slow', 'parksmart_sql_slow_queries_total',
+             'SQL statements slower than the slow query threshold, by endpoint.', '{}'),
+        ):
+            lines += [f'# HELP {kind} {help_text}', f'# TYPE {kind} counter']
+            for endpoint, value in sorted(totals[name].items()):
+                lines.append(f'{kind}{{endpoint="{_escape(endpoint)}"}} {fmt.format(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics_registry = MetricsRegistry()
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    # Statements on one connection run one at a time
+    conn.info['metrics_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_started', None)
+    if started is None or not has_app_context() or 'request_started' not in g:
+        return
+    elapsed = time.perf_counter() - started
+    g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+    if elapsed >= current_app.config['SLOW_QUERY_SECONDS']:
+        g.sql_slow = g.get('sql_slow', 0) + 1
+        if current_app.config['SLOW_QUERY_SAMPLES']:
+            # Statement text only; parameters may hold personal data
+            metrics_registry.add_slow_query(_endpoint(), statement, elapsed)
+
+
+def _record_request(status):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    # g.sql_queries is counted by query_stats
+    metrics_registry.observe_request(
+        _endpoint(), request.method, status, time.perf_counter() - started,
+        g.get('sql_queries', 0), g.get('sql_seconds', 0.0), g.get('sql_slow', 0)
+    )
+
+
+def _metrics_allowed():
+    if request.remote_addr in current_app.config['METRICS_ALLOWED_ADDRESSES']:
+        return True
+    token = current_app.config['METRICS_TOKEN']
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+
+
+def metrics():
+    return current_app.response_class(metrics_registry.render(), mimetype=None,
+                                      content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def slow_queries():
+    return jsonify({'threshold_seconds': current_app.config['SLOW_QUERY_SECONDS'],
+                    'samples': list(metrics_registry.slow_queries)})
+
+
+def init_metrics(app):
+    """Record every request and serve /metrics, unless METRICS_ENABLED is off"""
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('SLOW_QUERY_SECONDS', SLOW_QUERY_SECONDS)
+    app.config.setdefault('SLOW_QUERY_SAMPLES', False)
+    app.config.setdefault('METRICS_ALLOWED_ADDRESSES', ())
+    app.config.setdefault('METRICS_TOKEN', None)
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    if app.config['SLOW_QUERY_SAMPLES']:
+        app.add_url_rule('/metrics/slow-queries', 'slow_queries', slow_queries)
+
+    @app.before_request
+    def _start_request():
+        g.request_started = time.perf_counter()
+        if request.endpoint in ('metrics', 'slow_queries') and not _metrics_allowed():
+            return jsonify({'success': False, 'message': 'Metrics are not available to this client'}), 403
+
+    @app.after_request
+    def _finish_request(response):
+        _record_request(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _failed_request(error):
+        # after_request does not run when a view raises
+        if error is not None:
+            _record_request(500)
@@ -1,6 +1,16 @@
+import re
 from extensions import db
+from facilities import FacilityRouted, FacilityScoped
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 from datetime import datetime
+from tariffs import tariff_registry
+
+
+def normalize_plate(plate):
+    """Canonical form of a license plate: upper case letters and digits only"""
+    return re.sub(r'[^0-9A-Z]', '', (plate or '').upper())
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -23,38 +33,186 @@ class Vehicle(db.Model):
     __tablename__ = 'vehicles'
     id = db.Column(db.Integer, primary_key=True)
     license_plate = db.Column(db.String(20), unique=True, nullable=False)
+    # Normalized plate used for lookups, kept in sync with license_plate
+    plate_key = db.Column(db.String(20), unique=True, index=True)
     make = db.Column(db.String(50))
     model = db.Column(db.String(50))
     color = db.Column(db.String(30))
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
 
+    @validates('license_plate')
+    def _sync_plate_key(self, key, license_plate):
+        self.plate_key = normalize_plate(license_plate)
+        return license_plate
 
-class IndoorSlot(db.Model):
-    __tablename__ = 'indoor_slot'
+
+class ParkingSlot(FacilityScoped, db.Model):
+    __tablename__ = 'parking_slots'
+    __table_args__ = (
+        db.UniqueConstraint('facility', 'slot_number', name='uq_parking_slots_facility_number'),
+        # Slots changed since the last occupancy sync (see occupancy.py)
+        db.Index('ix_parking_slots_facility_occupancy_changed', 'facility', 'occupancy_changed_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    slot_number = db.Column(db.String(10), unique=True, nullable=False)
-    status = db.Column(db.String(20), default='available')
-    level = db.Column(db.String(10))
+    slot_number = db.Column(db.String(10), nullable=False)
+    location = db.Column(db.String(50), nullable=False)
     area = db.Column(db.String(50))
+    is_occupied = db.Column(db.Boolean, default=False)
+    occupancy_changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+
+    @property
+    def coordinates(self):
+        # Kept for API responses that expect the old "lat,lng" string
+        if self.latitude is None or self.longitude is None:
+            return None
+        return f"{self.latitude},{self.longitude}"
 
 
-class ParkingRecord(db.Model):
+class ParkingRecord(FacilityScoped, db.Model):
     __tablename__ = 'parking_records'
+    __table_args__ = (
+        # Active parkings and recent history (exit_time IS NULL / ORDER BY exit_time)
+        db.Index('ix_parking_records_user_exit', 'user_id', 'exit_time'),
+        # Digital card history, keyset-paged on (entry_time, id)
+        db.Index('ix_parking_records_user_entry', 'user_id', 'entry_time', 'id'),
+        # Open record of a vehicle at the exit gate
+        db.Index('ix_parking_records_vehicle_exit', 'vehicle_id', 'exit_time'),
+        db.Index('ix_parking_records_vehicle_status', 'vehicle_id', 'status'),
+        # Completed records not yet folded into the occupancy rollups
+        db.Index('ix_parking_records_rollup', 'rolled_up', 'id'),
+        # Stays still open or ended within a forecast training window
+        db.Index('ix_parking_records_exit', 'exit_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=False)
-    slot_id = db.Column(db.Integer, db.ForeignKey('indoor_slot.id'), nullable=False)
+    slot_id = db.Column(db.Integer, db.ForeignKey('parking_slots.id'), nullable=False)
     entry_time = db.Column(db.DateTime, default=datetime.utcnow)
     exit_time = db.Column(db.DateTime, nullable=True)
     parking_type = db.Column(db.String(20))
     fee = db.Column(db.Float, default=0.0)
+    payment_status = db.Column(db.String(20), default='Pending')
     # This column aligns with your SQLite schema and is crucial for tracking active records.
     status = db.Column(db.String(20), default='active')  
+    # Set once the completed stay has been added to the occupancy rollups
+    rolled_up = db.Column(db.Boolean, default=False, nullable=False)
 
     vehicle = db.relationship('Vehicle', backref='parkings')
-    slot = db.relationship('IndoorSlot', backref='parkings')
+    slot = db.relationship('ParkingSlot', backref='parkings')
 
     @property
     def duration(self):
         if self.exit_time:
             return int((self.exit_time - self.entry_time).total_seconds() // 60)
-        return None
\ No newline at end of file
+        return None
+
+    def calculate_fee(self):
+        """Price the stay with the tariff for its parking type and area"""
+        tariff = tariff_registry.select(self.parking_type, self.slot.area if self.slot else None)
+        self.fee = tariff.fee(self.entry_time, self.exit_time)
+        return self.fee
+
+
+class ArchivedParkingRecord(FacilityScoped, db.Model):
+    """A completed parking record moved out of parking_records by `flask archive-records`"""
+    __tablename__ = 'parking_records_archive'
+    __table_args__ = (
+        # Archived history, keyset-paged on (entry_time, id) like the hot table
+        db.Index('ix_parking_records_archive_user_entry', 'user_id', 'entry_time', 'id'),
+        # Exports and repricing by entry date
+        db.Index('ix_parking_records_archive_entry', 'entry_time'),
+        # Nightly forecast training only reads stays that ended in its window
+        db.Index('ix_parking_records_archive_exit', 'exit_time'),
+    )
+    # Records keep the id they had in parking_records
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=False)
+    slot_id = db.Column(db.Integer, db.ForeignKey('parking_slots.id'), nullable=False)
+    entry_time = db.Column(db.DateTime, nullable=False)
+    exit_time = db.Column(db.DateTime, nullable=False)
+    parking_type = db.Column(db.String(20))
+    fee = db.Column(db.Float, default=0.0)
+    payment_status = db.Column(db.String(20))
+    status = db.Column(db.String(20))
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    vehicle = db.relationship('Vehicle')
+    slot = db.relationship('ParkingSlot')
+
+    duration = ParkingRecord.duration
+
+
+class Reservation(FacilityScoped, db.Model):
+    """A slot booked for a time window, indexed in memory by reservations.py"""
+    __tablename__ = 'reservations'
+    __table_args__ = (
+        # Conflict checks: the bookings of one slot that end after a window starts
+        db.Index('ix_reservations_slot_end', 'slot_id', 'end_time'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=False)
+    slot_id = db.Column(db.Integer, db.ForeignKey('parking_slots.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    # booked or cancelled
+    status = db.Column(db.String(20), default='booked', nullable=False)
+    # Other workers sync their reservation index by these two timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    cancelled_at = db.Column(db.DateTime, index=True)
+
+    slot = db.relationship('ParkingSlot')
+    vehicle = db.relationship('Vehicle')
+
+
+class OccupancyRollup(FacilityScoped, db.Model):
+    """Per-area, per-hour aggregates of completed stays, maintained by rollups.py"""
+    __tablename__ = 'occupancy_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('facility', 'hour', 'area', name='uq_occupancy_rollups_hour_area'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False)
+    area = db.Column(db.String(50), nullable=False)
+    entries = db.Column(db.Integer, default=0, nullable=False)
+    exits = db.Column(db.Integer, default=0, nullable=False)
+    # Vehicle-minutes parked within the hour
+    occupied_minutes = db.Column(db.Float, default=0.0, nullable=False)
+    # Dwell time and revenue are attributed to the hour of exit
+    dwell_minutes = db.Column(db.Float, default=0.0, nullable=False)
+    revenue = db.Column(db.Float, default=0.0, nullable=False)
+
+
+class JournalCheckpoint(FacilityRouted, db.Model):
+    """Last gate journal entry written to the database, see journal.py"""
+    __tablename__ = 'journal_checkpoints'
+    name = db.Column(db.String(50), primary_key=True)
+    # Updated in the same transaction as the events it covers
+    sequence = db.Column(db.BigInteger, default=0, nullable=False)
+
+
+class ForecastProfile(FacilityScoped, db.Model):
+    """Per-area running sums behind the availability forecasts, see forecast.py"""
+    __tablename__ = 'forecast_profiles'
+    __table_args__ = (
+        db.UniqueConstraint('facility', 'area', 'weekday', 'time_bin', name='uq_forecast_profiles_area_time'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    area = db.Column(db.String(50), nullable=False)
+    # Monday is 0; time_bin counts 15-minute bins from local midnight
+    weekday = db.Column(db.Integer, nullable=False)
+    time_bin = db.Column(db.Integer, nullable=False)
+    # Days of this weekday the sums below cover
+    days = db.Column(db.Integer, default=0, nullable=False)
+    arrivals = db.Column(db.Integer, default=0, nullable=False)
+    # Vehicles parked at the start of the bin, summed over the days
+    occupied = db.Column(db.Float, default=0.0, nullable=False)
+    full_days = db.Column(db.Integer, default=0, nullable=False)
+    # Completed stays that arrived in the bin and their total length
+    departures = db.Column(db.Integer, default=0, nullable=False)
+    dwell_minutes = db.Column(db.Float, default=0.0, nullable=False)
+    # Last local day trained into the row
+    trained_through = db.Column(db.Date, nullable=False)
@@ -0,0 +1,338 @@
+"""
+In-memory slot occupancy index for the Car Parking System.
+
+The index keeps a free-list per location and per (location, area) so that a
+free slot can be handed out in constant time without querying the
+parking_slots table or hydrating ORM objects. It is warmed once from the
+database and then kept in sync by staging occupancy changes on the session;
+staged changes are only applied after the surrounding transaction commits.
+
+The index is per process and per facility. Changes committed by other
+worker processes are picked up by sync(), at most every
+OCCUPANCY_SYNC_SECONDS. Every write of is_occupied also sets
+parking_slots.occupancy_changed_at, so sync() only reads the slots changed
+since the newest change it has seen, less OCCUPANCY_SYNC_OVERLAP for
+transactions that committed late and clocks that differ between workers,
+and applies the differences like local changes: they bump the version and
+reach the slot list cache and the live events too. Rows read twice are
+simply found unchanged. Every OCCUPANCY_FULL_SYNC_SECONDS the occupancy of
+every slot is read again, in case a change slipped past the overlap. The database stays the source of truth, so a slot
+picked here is still checked again when the vehicle actually parks.
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from facilities import DEFAULT_FACILITY, FacilityLocal, current_facility, use_facility
+from models import ParkingSlot, db
+
+SlotInfo = namedtuple('SlotInfo', ['id', 'slot_number', 'location', 'area', 'latitude', 'longitude'])
+
+_STAGED_KEY = 'occupancy_changes'
+
+OCCUPANCY_SYNC_SECONDS = 1.0
+OCCUPANCY_SYNC_OVERLAP = timedelta(seconds=5)
+OCCUPANCY_FULL_SYNC_SECONDS = 300
+
+
+class FreeList:
+    """Set of slot ids with O(1) add, discard and random choice"""
+
+    def __init__(self):
+        self._items = []
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, slot_id):
+        return slot_id in self._positions
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def add(self, slot_id):
+        if slot_id in self._positions:
+            return
+        self._positions[slot_id] = len(self._items)
+        self._items.append(slot_id)
+
+    def discard(self, slot_id):
+        position = self._positions.pop(slot_id, None)
+        if position is None:
+            return
+        # Move the last item into the hole so removal stays O(1)
+        last = self._items.pop()
+        if position < len(self._items):
+            self._items[position] = last
+            self._positions[last] = position
+
+    def choice(self):
+        if not self._items:
+            return None
+        return random.choice(self._items)
+
+
+class OccupancyIndex:
+    """Process-wide view of which parking slots are free"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._occupied = set()
+        self._free_by_location = {}
+        self._free_by_area = {}
+        self._by_location = {}
+        self._changes = {}
+        self._listeners = []
+        self._warm_listeners = []
+        self.is_warm = False
+        # Off in the process that owns the gate journal, where the index runs
+        # ahead of the database
+        self.sync_enabled = True
+        self._checked = 0.0
+        self._full_synced = 0.0
+        # Newest occupancy_changed_at read from the database
+        self._watermark = None
+        self.facility = DEFAULT_FACILITY
+        # The version only means something together with the epoch, which
+        # changes every time the index is (re)loaded
+        self.epoch = None
+        self.version = 0
+
+    def warm(self):
+        """Load every slot from the database (requires an app context)"""
+        rows = db.session.query(
+            ParkingSlot.id,
+            ParkingSlot.slot_number,
+            ParkingSlot.location,
+            ParkingSlot.area,
+            ParkingSlot.latitude,
+            ParkingSlot.longitude,
+            ParkingSlot.is_occupied,
+            ParkingSlot.occupancy_changed_at,
+        ).all()
+
+        with self._lock:
+            self._slots = {}
+            self._occupied = set()
+            self._free_by_location = {}
+            self._free_by_area = {}
+            self._by_location = {}
+            self._changes = {}
+            for slot_id, slot_number, location, area, lat, lng, is_occupied, _ in sorted(rows):
+                self._slots[slot_id] = SlotInfo(slot_id, slot_number, location, area, lat, lng)
+                self._by_location.setdefault(location, []).append(slot_id)
+                if is_occupied:
+                    self._occupied.add(slot_id)
+                else:
+                    self._add_free(self._slots[slot_id])
+            self.epoch = uuid.uuid4().hex[:8]
+            self.version = 0
+            self.is_warm = True
+            self._checked = self._full_synced = time.monotonic()
+            self._watermark = _newest(rows, self._watermark)
+
+        for callback in self._warm_listeners:
+            callback(self)
+
+    def ensure_warm(self):
+        if not self.is_warm:
+            self.warm()
+
+    def sync(self):
+        """Warm the index, or pick up other workers' changes if it is due"""
+        if not self.is_warm:
+            self.warm()
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not self.sync_enabled or now - self._checked < OCCUPANCY_SYNC_SECONDS:
+                return
+            self._checked = now
+            full = self._watermark is None or now - self._full_synced >= OCCUPANCY_FULL_SYNC_SECONDS
+            if full:
+                self._full_synced = now
+            watermark = self._watermark
+            started = self.version
+        query = select(ParkingSlot.id, ParkingSlot.is_occupied, ParkingSlot.occupancy_changed_at).where(
+            ParkingSlot.facility == self.facility
+        )
+        if not full:
+            query = query.where(ParkingSlot.occupancy_changed_at >= watermark - OCCUPANCY_SYNC_OVERLAP)
+        # A connection of its own, so the rows are not older than the request's transaction
+        with db.session.get_bind(ParkingSlot).connect() as connection:
+            rows = connection.execute(query).all()
+        with self._lock:
+            self._watermark = _newest(rows, self._watermark)
+            # Slots changed here since the read started are already newer than the rows
+            changed = [(slot_id, bool(occupied)) for slot_id, occupied, _ in rows
+                       if slot_id in self._slots and (slot_id in self._occupied) != bool(occupied)
+                       and self._changes.get(slot_id, 0) <= started]
+        for slot_id, occupied in changed:
+            self.set_occupied(slot_id, occupied)
+
+    def add_listener(self, callback):
+        """Register callback(slot_info, is_occupied), called after each change"""
+        self._listeners.append(callback)
+
+    def add_warm_listener(self, callback):
+        """Register callback(index), called after the index is (re)loaded"""
+        self._warm_listeners.append(callback)
+
+    def get(self, slot_id):
+        return self._slots.get(slot_id)
+
+    def is_occupied(self, slot_id):
+        return slot_id in self._occupied
+
+    def count_free(self, location, area=None):
+        free = self._free_list(location, area)
+        return len(free) if free is not None else 0
+
+    def pick(self, location, area=None):
+        """Return a random free slot for the location (and area), or None"""
+        with self._lock:
+            free = self._free_list(location, area)
+            slot_id = free.choice() if free is not None else None
+            return self._slots.get(slot_id) if slot_id is not None else None
+
+    def locations(self):
+        with self._lock:
+            return list(self._by_location)
+
+    def slots(self, location, area=None):
+        """Every slot of the location (and area), free or occupied"""
+        with self._lock:
+            return [self._slots[slot_id] for slot_id in self._by_location.get(location, [])
+                    if area is None or self._slots[slot_id].area == area]
+
+    def free_slots(self, location, area=None):
+        """Snapshot of the free slots for the location (and area)"""
+        with self._lock:
+            free = self._free_list(location, area)
+            if free is None:
+                return []
+            return [self._slots[slot_id] for slot_id in free]
+
+    @property
+    def version_tag(self):
+        """Opaque token for the current occupancy state of this process"""
+        return f"{self.epoch}-{self.version}"
+
+    def snapshot(self, location, since=None):
+        """Return (version_tag, [(slot_info, is_occupied)]) for a location.
+
+        With since set to an earlier version tag only the slots changed after
+        it are returned. A tag from another epoch returns every slot.
+        """
+        with self._lock:
+            since_version = self._parse_tag(since)
+            if since_version is None or since_version > self.version:
+                slot_ids = self._by_location.get(location, [])
+            else:
+                # _changes is ordered by version, newest last
+                slot_ids = []
+                for slot_id, version in reversed(self._changes.items()):
+                    if version <= since_version:
+                        break
+                    if self._slots[slot_id].location == location:
+                        slot_ids.append(slot_id)
+                slot_ids.reverse()
+            return self.version_tag, [(self._slots[slot_id], slot_id in self._occupied)
+                                      for slot_id in slot_ids]
+
+    def _parse_tag(self, tag):
+        epoch, _, version = (tag or '').partition('-')
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def set_occupied(self, slot_id, occupied):
+        """Apply an occupancy change that has already been committed"""
+        with self._lock:
+            slot = self._slots.get(slot_id)
+            if slot is None:
+                return
+            if occupied:
+                if slot_id in self._occupied:
+                    return
+                self._occupied.add(slot_id)
+                self._free_by_location[slot.location].discard(slot_id)
+                self._free_by_area[(slot.location, slot.area)].discard(slot_id)
+            else:
+                if slot_id not in self._occupied:
+                    return
+                self._occupied.discard(slot_id)
+                self._add_free(slot)
+            self.version += 1
+            self._changes.pop(slot_id, None)
+            self._changes[slot_id] = self.version
+
+        for callback in self._listeners:
+            callback(slot, occupied)
+
+    def _free_list(self, location, area):
+        if area is None:
+            return self._free_by_location.get(location)
+        return self._free_by_area.get((location, area))
+
+    def _add_free(self, slot):
+        self._free_by_location.setdefault(slot.location, FreeList()).add(slot.id)
+        self._free_by_area.setdefault((slot.location, slot.area), FreeList()).add(slot.id)
+
+
+def _newest(rows, watermark):
+    changed = [row.occupancy_changed_at for row in rows if row.occupancy_changed_at is not None]
+    if watermark is not None:
+        changed.append(watermark)
+    return max(changed, default=None)
+
+
+occupancy_index = FacilityLocal(OccupancyIndex, broadcast=('add_listener', 'add_warm_listener'))
+
+
+def stage_occupancy_change(slot_id, occupied, session=None):
+    """Queue an occupancy change to be applied to the index on commit"""
+    session = session or db.session
+    session.info.setdefault(_STAGED_KEY, []).append((current_facility(), slot_id, occupied))
+
+
+def add_occupancy_changed_column():
+    """Add parking_slots.occupancy_changed_at and its index to a database created
+    before them; True if added"""
+    bind = db.session.get_bind(ParkingSlot)
+    columns = {column['name'] for column in sa.inspect(bind).get_columns(ParkingSlot.__tablename__)}
+    if 'occupancy_changed_at' in columns:
+        return False
+    column_type = ParkingSlot.occupancy_changed_at.type.compile(dialect=bind.dialect)
+    with bind.begin() as connection:
+        connection.execute(sa.text(
+            f"ALTER TABLE {ParkingSlot.__tablename__} ADD COLUMN occupancy_changed_at {column_type}"
+        ))
+        connection.execute(sa.update(ParkingSlot.__table__).values(occupancy_changed_at=datetime.utcnow()))
+        for index in ParkingSlot.__table__.indexes:
+            if 'occupancy_changed_at' in index.columns:
+                index.create(connection, checkfirst=True)
+    logging.info("Added parking_slots.occupancy_changed_at")
+    return True
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_staged_changes(session):
+    for facility, slot_id, occupied in session.info.pop(_STAGED_KEY, []):
+        with use_facility(facility):
+            occupancy_index.set_occupied(slot_id, occupied)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_staged_changes(session):
+    session.info.pop(_STAGED_KEY, None)
@@ -0,0 +1,184 @@
+"""
+License plate lookup for the Car Parking System.
+
+ANPR output varies in case, spacing and dashes, so plates are matched on
+their normalized key (Vehicle.plate_key, which has a unique index). Results
+are kept in a small LRU cache with a TTL. Misses are only kept for
+MISS_TTL seconds: add_vehicle invalidates the key in its own worker, and
+the others must not keep turning a newly registered car away.
+
+Fuzzy mode tolerates one OCR mistake (a wrong, missing or extra character).
+Rather than a symmetric deletion index, which stores every one-character
+deletion of every plate, it probes the few hundred edit-distance-1
+neighbours of the query against an in-memory set of plate keys. The results
+are the same and the set costs one entry per registered plate, which keeps a
+million plates affordable. The set is loaded on the first fuzzy lookup and
+picks up vehicles registered since, by id, at most every KEYS_SYNC_SECONDS.
+"""
+import logging
+import string
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import sqlalchemy as sa
+
+from models import Vehicle, db, normalize_plate
+
+VehicleInfo = namedtuple('VehicleInfo', ['id', 'license_plate', 'make', 'model', 'color', 'user_id'])
+
+PLATE_ALPHABET = string.ascii_uppercase + string.digits
+MISS_TTL = 2
+KEYS_SYNC_SECONDS = 2
+_MISS = object()
+
+
+def plate_neighbours(key):
+    """All keys within one substitution, insertion or deletion of key"""
+    neighbours = set()
+    for i in range(len(key) + 1):
+        head, tail = key[:i], key[i:]
+        if tail:
+            neighbours.add(head + tail[1:])
+            for char in PLATE_ALPHABET:
+                if char != tail[0]:
+                    neighbours.add(head + char + tail[1:])
+        for char in PLATE_ALPHABET:
+            neighbours.add(head + char + tail)
+    neighbours.discard(key)
+    return neighbours
+
+
+class PlateLookup:
+    """Normalized, cached and optionally fuzzy license plate lookup"""
+
+    def __init__(self, maxsize=100000, ttl=300, keys_ttl=3600, miss_ttl=MISS_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.keys_ttl = keys_ttl
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._keys = None
+        self._keys_loaded_at = 0
+        self._keys_synced_at = 0
+        self._last_vehicle_id = 0
+
+    def lookup(self, plate, fuzzy=False):
+        """Return VehicleInfo for the plate, or None if it isn't registered"""
+        key = normalize_plate(plate)
+        if not key:
+            return None
+        vehicle = self._get(key)
+        if vehicle is None and fuzzy:
+            matches = self.fuzzy_matches(key)
+            # Only trust a correction that is unambiguous
+            if len(matches) == 1:
+                vehicle = self._get(matches[0])
+        return vehicle
+
+    def fuzzy_matches(self, plate):
+        """Registered plate keys within edit distance 1 of the plate"""
+        key = normalize_plate(plate)
+        keys = self._plate_keys()
+        return sorted(candidate for candidate in plate_neighbours(key) if candidate in keys)
+
+    def invalidate(self, plate):
+        """Forget cached results for the plate, e.g. after it was registered"""
+        key = normalize_plate(plate)
+        with self._lock:
+            self._cache.pop(key, None)
+            if self._keys is not None:
+                self._keys.add(key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._keys = None
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(key)
+                return None if entry[1] is _MISS else entry[1]
+
+        row = db.session.query(
+            Vehicle.id, Vehicle.license_plate, Vehicle.make, Vehicle.model, Vehicle.color, Vehicle.user_id
+        ).filter(Vehicle.plate_key == key).first()
+        vehicle = VehicleInfo(*row) if row else None
+
+        with self._lock:
+            if vehicle:
+                self._cache[key] = (now + self.ttl, vehicle)
+            else:
+                self._cache[key] = (now + self.miss_ttl, _MISS)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return vehicle
+
+    def _plate_keys(self):
+        now = time.monotonic()
+        if self._keys is None or now - self._keys_loaded_at > self.keys_ttl:
+            # Reloaded now and then so changed and deleted plates drop out too
+            rows = db.session.query(Vehicle.id, Vehicle.plate_key).yield_per(10000)
+            last_id, keys = 0, set()
+            for vehicle_id, key in rows:
+                last_id = max(last_id, vehicle_id)
+                if key:
+                    keys.add(key)
+            with self._lock:
+                self._keys = keys
+                self._keys_loaded_at = self._keys_synced_at = now
+                self._last_vehicle_id = last_id
+        elif now - self._keys_synced_at > KEYS_SYNC_SECONDS:
+            # Vehicles registered through other workers since the last look
+            rows = db.session.query(Vehicle.id, Vehicle.plate_key).filter(
+                Vehicle.id > self._last_vehicle_id).all()
+            with self._lock:
+                for vehicle_id, key in rows:
+                    self._last_vehicle_id = max(self._last_vehicle_id, vehicle_id)
+                    if key:
+                        self._keys.add(key)
+                self._keys_synced_at = now
+        return self._keys
+
+
+plate_lookup = PlateLookup()
+
+
+def add_plate_key_column():
+    """Add vehicles.plate_key and its index to a database created before them; True if added"""
+    bind = db.session.get_bind(Vehicle)
+    columns = {column['name'] for column in sa.inspect(bind).get_columns(Vehicle.__tablename__)}
+    if 'plate_key' in columns:
+        return False
+    column_type = Vehicle.plate_key.type.compile(dialect=bind.dialect)
+    with bind.begin() as connection:
+        # SQLite can't add a UNIQUE column; the unique index does the same, and NULLs don't collide
+        connection.execute(sa.text(f"ALTER TABLE {Vehicle.__tablename__} ADD COLUMN plate_key {column_type}"))
+        for index in Vehicle.__table__.indexes:
+            if 'plate_key' in index.columns:
+                index.create(connection, checkfirst=True)
+    logging.info("Added vehicles.plate_key")
+    return True
+
+
+def backfill_plate_keys(batch_size=1000):
+    """Fill plate_key for vehicles created before the column existed"""
+    taken = {key for (key,) in db.session.query(Vehicle.plate_key).filter(Vehicle.plate_key.isnot(None))}
+    while True:
+        vehicles = Vehicle.query.filter(Vehicle.plate_key.is_(None)).limit(batch_size).all()
+        if not vehicles:
+            break
+        for vehicle in vehicles:
+            key = normalize_plate(vehicle.license_plate)
+            if key in taken:
+                # Leave duplicates for an operator to resolve; the placeholder never matches
+                logging.warning(f"Plate {vehicle.license_plate} duplicates key {key}, not indexed")
+                key = f"#{vehicle.id}"
+            taken.add(key)
+            vehicle.plate_key = key
+        db.session.commit()
@@ -0,0 +1,77 @@
+"""
+SQL statement counting for the Car Parking System.
+
+Every statement sent to the database is counted against the current
+request and against any count_queries() block active on the thread. With
+SQL_QUERY_STATS enabled (the default in debug mode) responses carry an
+X-SQL-Queries header. QUERY_BUDGETS maps endpoint names to the most
+statements a request may issue; overruns are logged as warnings.
+
+Tests can assert budgets directly:
+
+    with count_queries() as queries:
+        client.get('/dashboard')
+    assert queries.count <= 3, queries.statements
+"""
+import logging
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Cold-cache statement counts of the pages; API endpoints have no budget yet
+DEFAULT_QUERY_BUDGETS = {
+    'views.dashboard': 4,
+    'views.indoor_parking': 2,
+    'views.outdoor_parking': 2,
+    'views.digital_card': 4,
+}
+
+_local = threading.local()
+
+
+class QueryCounter:
+    """Statements executed while a count_queries() block is active"""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    counters = _local.__dict__.setdefault('counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+    for counter in getattr(_local, 'counters', ()):
+        counter.statements.append(statement)
+
+
+def init_query_stats(app):
+    app.config.setdefault('SQL_QUERY_STATS', app.debug)
+    budgets = app.config.setdefault('QUERY_BUDGETS', dict(DEFAULT_QUERY_BUDGETS))
+
+    @app.after_request
+    def _report_query_count(response):
+        queries = g.get('sql_queries', 0)
+        if app.config['SQL_QUERY_STATS']:
+            response.headers['X-SQL-Queries'] = str(queries)
+        budget = budgets.get(request.endpoint)
+        if budget is not None and queries > budget:
+            logging.warning(f"{request.endpoint} ran {queries} SQL statements, budget is {budget}")
+        return response
@@ -0,0 +1,369 @@
+"""
+Slot reservations for the Car Parking System.
+
+Users book a slot for a time window. The bookings of each slot are kept in
+memory as a list of non-overlapping intervals sorted by start, so checking
+a window against a slot is a binary search rather than a scan over every
+booking. For "which slots are free from 14:00 to 18:00" the index also
+keeps, per hour, the slots with a booking in that hour: every slot booked
+in 15:00-16:00 or 16:00-17:00 is taken by a set union, and only the slots
+booked in the partly covered hours at the edges of a window are searched.
+
+The database stays the source of truth. book_slot serializes the bookings
+of a slot by writing its parking_slots row first (a row lock on PostgreSQL,
+the write lock on SQLite), checks the window with an indexed query and
+inserts the booking in the same transaction. Committed bookings and
+cancellations are applied to this process's index on commit; other worker
+processes pick them up when they next sync, at most
+RESERVATION_SYNC_SECONDS later. Each facility has an index of its own.
+
+Walk-ins are only given slots that stay unbooked for WALK_IN_HORIZON, and
+a vehicle with a booking starting within ARRIVAL_GRACE is sent to its
+booked slot.
+"""
+import bisect
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, or_, select, update
+from sqlalchemy.orm import Session
+
+from facilities import FacilityLocal, current_facility, use_facility
+from models import ParkingSlot, Reservation, db
+from occupancy import occupancy_index
+
+RESERVATION_SYNC_SECONDS = 1.0
+# Rows committed this long after they were stamped are still picked up by a sync
+SYNC_MARGIN = timedelta(seconds=30)
+PRUNE_SECONDS = 300
+WALK_IN_HORIZON = timedelta(hours=2)
+ARRIVAL_GRACE = timedelta(minutes=15)
+MAX_RESERVATION = timedelta(days=7)
+PICK_ATTEMPTS = 8
+ONE_HOUR = timedelta(hours=1)
+
+_STAGED_KEY = 'reservation_changes'
+
+Booking = namedtuple('Booking', ['id', 'slot_id', 'user_id', 'vehicle_id', 'start', 'end'])
+
+_BOOKING_COLUMNS = (
+    Reservation.id, Reservation.slot_id, Reservation.user_id, Reservation.vehicle_id,
+    Reservation.start_time, Reservation.end_time,
+)
+
+
+class ReservationConflict(Exception):
+    """The slot is booked or occupied for part of the window"""
+
+
+class SlotBookings:
+    """Non-overlapping bookings of one slot, sorted by start"""
+
+    __slots__ = ('starts', 'bookings')
+
+    def __init__(self):
+        self.starts = []
+        self.bookings = []
+
+    def overlapping(self, start, end):
+        """Bookings overlapping [start, end), earliest first"""
+        # Bookings don't overlap, so their ends are sorted as well: walk back
+        # from the last booking that starts before the window ends
+        i = bisect.bisect_left(self.starts, end)
+        first = i
+        while first > 0 and self.bookings[first - 1].end > start:
+            first -= 1
+        return self.bookings[first:i]
+
+    def add(self, booking):
+        i = bisect.bisect_left(self.starts, booking.start)
+        self.starts.insert(i, booking.start)
+        self.bookings.insert(i, booking)
+
+    def remove(self, booking):
+        i = bisect.bisect_left(self.starts, booking.start)
+        while i < len(self.bookings) and self.starts[i] == booking.start:
+            if self.bookings[i].id == booking.id:
+                del self.starts[i]
+                del self.bookings[i]
+                return
+            i += 1
+
+
+class ReservationIndex:
+    """Process-wide view of upcoming bookings per slot and per vehicle"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_slot = {}
+        self._by_id = {}
+        self._by_vehicle = {}
+        # hour -> {slot_id: number of bookings of the slot in that hour}
+        self._by_hour = {}
+        self._synced_at = None
+        self._checked = 0.0
+        self._pruned = 0.0
+        self.is_warm = False
+
+    def warm(self):
+        """Load every booking that hasn't ended (requires an app context)"""
+        now = datetime.utcnow()
+        rows = db.session.query(*_BOOKING_COLUMNS).filter(
+            Reservation.status == 'booked', Reservation.end_time > now
+        ).all()
+        with self._lock:
+            self._by_slot = {}
+            self._by_id = {}
+            self._by_vehicle = {}
+            self._by_hour = {}
+            for row in rows:
+                self._add(Booking(*row))
+            self._synced_at = now
+            self._checked = self._pruned = time.monotonic()
+            self.is_warm = True
+
+    def sync(self):
+        """Warm the index, or pick up other workers' changes if it is due"""
+        if not self.is_warm:
+            self.warm()
+            return
+        if time.monotonic() - self._checked < RESERVATION_SYNC_SECONDS:
+            return
+        started = datetime.utcnow()
+        since = self._synced_at - SYNC_MARGIN
+        rows = db.session.query(*_BOOKING_COLUMNS, Reservation.status).filter(
+            or_(Reservation.created_at >= since, Reservation.cancelled_at >= since)
+        ).all()
+        with self._lock:
+            # Rows seen by an earlier sync come back within the margin; both
+            # applying a booking and removing one are idempotent
+            for *columns, status in rows:
+                booking = Booking(*columns)
+                if status == 'booked':
+                    self._add(booking)
+                else:
+                    self._remove(booking.id)
+            self._synced_at = started
+            self._checked = time.monotonic()
+            if self._checked - self._pruned > PRUNE_SECONDS:
+                self._prune(started)
+                self._pruned = self._checked
+
+    def apply(self, booking, booked):
+        """Apply a booking or cancellation that has already been committed"""
+        with self._lock:
+            if booked:
+                self._add(booking)
+            else:
+                self._remove(booking.id)
+
+    def conflicts(self, slot_id, start, end):
+        """Bookings of the slot that overlap [start, end)"""
+        with self._lock:
+            bookings = self._by_slot.get(slot_id)
+            return bookings.overlapping(start, end) if bookings else []
+
+    def booked_slot_ids(self, start, end):
+        """Ids of the slots with a booking overlapping [start, end)"""
+        with self._lock:
+            full_hours = []
+            edge_hours = []
+            for hour in _hours(start, end):
+                inside = hour >= start and hour + ONE_HOUR <= end
+                (full_hours if inside else edge_hours).append(self._by_hour.get(hour, {}))
+            # A booking in an hour the window covers overlaps the window
+            booked = set().union(*full_hours)
+            for slots in edge_hours:
+                for slot_id in slots:
+                    if slot_id not in booked and self._by_slot[slot_id].overlapping(start, end):
+                        booked.add(slot_id)
+            return booked
+
+    def for_vehicle(self, vehicle_id, at):
+        """The vehicle's booking covering the given time, allowing early arrival"""
+        with self._lock:
+            for booking in self._by_vehicle.get(vehicle_id, ()):
+                if booking.start - ARRIVAL_GRACE <= at < booking.end:
+                    return booking
+        return None
+
+    def free_slots(self, location, start, end, area=None):
+        """Slots of the location (and area) that can be booked for [start, end)"""
+        booked = self.booked_slot_ids(start, end)
+        slots = occupancy_index.slots(location, area)
+        if _occupancy_matters(start):
+            return [slot for slot in slots if slot.id not in booked and not occupancy_index.is_occupied(slot.id)]
+        return [slot for slot in slots if slot.id not in booked]
+
+    def pick_free(self, location, start, end, area=None):
+        """A random slot that is free and unbooked for [start, end), or None"""
+        if _occupancy_matters(start):
+            # Most free slots are unbooked; try a few before listing them all
+            for _ in range(PICK_ATTEMPTS):
+                slot = occupancy_index.pick(location, area)
+                if slot is None:
+                    return None
+                if not self.conflicts(slot.id, start, end):
+                    return slot
+        slots = self.free_slots(location, start, end, area)
+        return random.choice(slots) if slots else None
+
+    def _add(self, booking):
+        if booking.id in self._by_id:
+            return
+        self._by_id[booking.id] = booking
+        self._by_slot.setdefault(booking.slot_id, SlotBookings()).add(booking)
+        self._by_vehicle.setdefault(booking.vehicle_id, []).append(booking)
+        for hour in _hours(booking.start, booking.end):
+            slots = self._by_hour.setdefault(hour, {})
+            slots[booking.slot_id] = slots.get(booking.slot_id, 0) + 1
+
+    def _remove(self, booking_id):
+        booking = self._by_id.pop(booking_id, None)
+        if booking is None:
+            return
+        self._by_slot[booking.slot_id].remove(booking)
+        self._by_vehicle[booking.vehicle_id].remove(booking)
+        for hour in _hours(booking.start, booking.end):
+            slots = self._by_hour[hour]
+            if slots[booking.slot_id] == 1:
+                del slots[booking.slot_id]
+                if not slots:
+                    del self._by_hour[hour]
+            else:
+                slots[booking.slot_id] -= 1
+
+    def _prune(self, now):
+        for booking in [booking for booking in self._by_id.values() if booking.end <= now]:
+            self._remove(booking.id)
+
+
+reservation_index = FacilityLocal(ReservationIndex)
+
+
+def reserved_for_others(slot_id, vehicle_id, now=None):
+    """True if a walk-in parking now would block someone else's booking"""
+    now = now or datetime.utcnow()
+    reservation_index.sync()
+    bookings = reservation_index.conflicts(slot_id, now, now + WALK_IN_HORIZON)
+    own = reservation_index.for_vehicle(vehicle_id, now)
+    if own is not None and own.slot_id == slot_id:
+        # Parking in one's own booked slot; the next booking starts after it ends
+        return False
+    return bool(bookings)
+
+
+def _hours(start, end):
+    """The whole hours that [start, end) overlaps"""
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    while hour < end:
+        yield hour
+        hour += ONE_HOUR
+
+
+def _occupancy_matters(start):
+    # A vehicle parked now may well still be there when a window this close starts
+    return start < datetime.utcnow() + WALK_IN_HORIZON
+
+
+def validate_window(start, end, now=None):
+    """Raise ValueError unless [start, end) is a window that can be booked"""
+    now = now or datetime.utcnow()
+    if end <= start:
+        raise ValueError("End time must be after start time")
+    if end <= now:
+        raise ValueError("Reservation window is in the past")
+    if end - start > MAX_RESERVATION:
+        raise ValueError(f"Reservations may last at most {MAX_RESERVATION.days} days")
+
+
+def book_slot(user_id, vehicle_id, slot_id, start, end):
+    """Book the slot for [start, end) in the current transaction.
+
+    Raises ReservationConflict if the slot is booked for part of the window
+    (or occupied, for windows starting soon) and LookupError if the slot
+    does not exist. The booking reaches the index when the caller commits.
+    """
+    reservation_index.sync()
+    if reservation_index.conflicts(slot_id, start, end):
+        raise ReservationConflict("Parking slot is already booked for that time")
+
+    # Writing the slot row first serializes bookings of this slot across workers
+    row = db.session.execute(
+        update(ParkingSlot).where(ParkingSlot.id == slot_id).values(id=ParkingSlot.id)
+        .returning(ParkingSlot.is_occupied)
+    ).first()
+    if row is None:
+        raise LookupError("Parking slot not found")
+    if row.is_occupied and _occupancy_matters(start):
+        raise ReservationConflict("Parking slot is occupied")
+
+    clash = db.session.execute(
+        select(Reservation.id).where(
+            Reservation.slot_id == slot_id,
+            Reservation.end_time > start,
+            Reservation.start_time < end,
+            Reservation.status == 'booked',
+        ).limit(1)
+    ).first()
+    if clash:
+        raise ReservationConflict("Parking slot is already booked for that time")
+
+    reservation = Reservation(user_id=user_id, vehicle_id=vehicle_id, slot_id=slot_id,
+                              start_time=start, end_time=end)
+    db.session.add(reservation)
+    db.session.flush()
+    _stage(Booking(reservation.id, slot_id, user_id, vehicle_id, start, end), True)
+    return reservation
+
+
+def book_any_slot(user_id, vehicle_id, location, start, end, area=None):
+    """Book a random free slot of the location (and area); None if all are taken"""
+    for _ in range(PICK_ATTEMPTS):
+        reservation_index.sync()
+        slot = reservation_index.pick_free(location, start, end, area)
+        if slot is None:
+            return None
+        # Another worker may have booked the slot since the index last synced;
+        # a conflict is raised before anything is written, so just try another
+        try:
+            return book_slot(user_id, vehicle_id, slot.id, start, end)
+        except ReservationConflict:
+            continue
+    return None
+
+
+def cancel_reservation(reservation_id, user_id):
+    """Cancel a booking of the user in the current transaction; True if it was booked"""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(Reservation)
+        .where(Reservation.id == reservation_id, Reservation.user_id == user_id,
+               Reservation.status == 'booked')
+        .values(status='cancelled', cancelled_at=now)
+    )
+    if result.rowcount != 1:
+        return False
+    row = db.session.execute(select(*_BOOKING_COLUMNS).where(Reservation.id == reservation_id)).one()
+    _stage(Booking(*row), False)
+    return True
+
+
+def _stage(booking, booked, session=None):
+    session = session or db.session
+    session.info.setdefault(_STAGED_KEY, []).append((current_facility(), booking, booked))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_staged_changes(session):
+    for facility, booking, booked in session.info.pop(_STAGED_KEY, []):
+        with use_facility(facility):
+            reservation_index.apply(booking, booked)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_staged_changes(session):
+    session.info.pop(_STAGED_KEY, None)
@@ -0,0 +1,272 @@
+"""
+Occupancy analytics rollups for the Car Parking System.
+
+Completed stays are folded into occupancy_rollups, one row per area and
+hour, holding entries, exits, vehicle-minutes parked, dwell time and
+revenue. Reports read only the rollup rows of the requested range, so their
+cost does not grow with the size of parking_records.
+
+Each completed record is rolled up exactly once. ParkingRecord.rolled_up is
+the watermark: refresh_rollups claims a chunk of pending records by flipping
+the flag with a conditional UPDATE, merges their deltas into the rollups and
+commits both together. Exits don't refresh the rollups themselves: they
+ask rollup_refresher, whose background thread refreshes them at most every
+ROLLUP_REFRESH_SECONDS, and `flask refresh-rollups` backfills history (or
+catches up after a failure or a restart) in chunks. Only rolled-up records are archived, so a rebuild folds
+the archive in again before the hot records.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.exc import IntegrityError
+
+from facilities import DEFAULT_FACILITY, FacilityLocal, use_facility
+from models import ArchivedParkingRecord, OccupancyRollup, ParkingRecord, ParkingSlot, db
+
+ROLLUP_CHUNK_SIZE = 5000
+# Exits in this window are rolled up together, behind the requests
+ROLLUP_REFRESH_SECONDS = 1.0
+UNKNOWN_AREA = 'Unknown'
+ROLLUP_FIELDS = ('entries', 'exits', 'occupied_minutes', 'dwell_minutes', 'revenue')
+
+ONE_HOUR = timedelta(hours=1)
+ONE_MINUTE = timedelta(minutes=1)
+
+
+class RollupConflict(Exception):
+    """Another worker claimed or rolled up the same records first"""
+
+
+def _hour(time):
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+def _bucket(deltas, hour, area):
+    bucket = deltas.get((hour, area))
+    if bucket is None:
+        bucket = deltas[(hour, area)] = [0, 0, 0.0, 0.0, 0.0]
+    return bucket
+
+
+def add_stay(deltas, entry_time, exit_time, fee, area):
+    """Add one completed stay to a {(hour, area): [field deltas]} dict"""
+    area = area or UNKNOWN_AREA
+    _bucket(deltas, _hour(entry_time), area)[0] += 1
+    exit_bucket = _bucket(deltas, _hour(exit_time), area)
+    exit_bucket[1] += 1
+    exit_bucket[3] += (exit_time - entry_time) / ONE_MINUTE
+    exit_bucket[4] += fee or 0.0
+
+    # Spread the parked minutes over every hour the stay overlaps
+    hour = _hour(entry_time)
+    while hour < exit_time:
+        overlap = min(exit_time, hour + ONE_HOUR) - max(entry_time, hour)
+        _bucket(deltas, hour, area)[2] += overlap / ONE_MINUTE
+        hour += ONE_HOUR
+
+
+def _claim_pending(chunk_size):
+    rows = db.session.query(
+        ParkingRecord.id, ParkingRecord.entry_time, ParkingRecord.exit_time,
+        ParkingRecord.fee, ParkingSlot.area
+    ).outerjoin(ParkingSlot, ParkingRecord.slot_id == ParkingSlot.id).filter(
+        ParkingRecord.rolled_up.is_(False),
+        ParkingRecord.exit_time.isnot(None)
+    ).order_by(ParkingRecord.id).limit(chunk_size).all()
+    if not rows:
+        return rows
+
+    # Claim the whole id range; a mismatch means another worker got there first
+    # or a record in the range was closed after it was read
+    result = db.session.execute(
+        update(ParkingRecord)
+        .where(ParkingRecord.id.between(rows[0].id, rows[-1].id),
+               ParkingRecord.rolled_up.is_(False),
+               ParkingRecord.exit_time.isnot(None))
+        .values(rolled_up=True)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(rows):
+        raise RollupConflict('Pending records changed while being claimed')
+    return rows
+
+
+def _merge(deltas):
+    hours = [hour for hour, _ in deltas]
+    existing = {
+        (row.hour, row.area): row.id
+        for row in db.session.query(OccupancyRollup.id, OccupancyRollup.hour, OccupancyRollup.area)
+        .filter(OccupancyRollup.hour.between(min(hours), max(hours)))
+    }
+
+    updates, inserts = [], []
+    for (hour, area), values in deltas.items():
+        rollup_id = existing.get((hour, area))
+        if rollup_id is None:
+            inserts.append(dict(zip(ROLLUP_FIELDS, values), hour=hour, area=area))
+        else:
+            updates.append(dict(zip(('b_' + field for field in ROLLUP_FIELDS), values), b_id=rollup_id))
+
+    table = OccupancyRollup.__table__
+    if updates:
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam('b_id'))
+            .values({field: table.c[field] + bindparam('b_' + field) for field in ROLLUP_FIELDS}),
+            updates
+        )
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+def refresh_rollups(chunk_size=ROLLUP_CHUNK_SIZE, max_chunks=None):
+    """Fold pending completed records into the rollups, one transaction per chunk.
+
+    Stops when nothing is pending, after max_chunks chunks, or when another
+    worker is processing the same records. Returns the number rolled up.
+    """
+    total = 0
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        try:
+            rows = _claim_pending(chunk_size)
+            if not rows:
+                db.session.rollback()
+                break
+            deltas = {}
+            for row in rows:
+                add_stay(deltas, row.entry_time, row.exit_time, row.fee, row.area)
+            _merge(deltas)
+            db.session.commit()
+        except (RollupConflict, IntegrityError) as error:
+            # Leave the records pending; the next refresh picks them up
+            db.session.rollback()
+            logging.info(f"Rollup refresh stopped: {error}")
+            break
+        total += len(rows)
+        chunks += 1
+    return total
+
+
+class RollupRefresher:
+    """Background refresh of the rollups after stays are completed"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._app = None
+        self._pending = False
+        self._thread = None
+        self.delay = ROLLUP_REFRESH_SECONDS
+        self.facility = DEFAULT_FACILITY
+
+    def init_app(self, app):
+        app.config.setdefault('ROLLUP_REFRESH_SECONDS', ROLLUP_REFRESH_SECONDS)
+        self._app = app
+        self.delay = app.config['ROLLUP_REFRESH_SECONDS']
+
+    def request(self):
+        """Refresh the rollups soon; call after committing completed stays"""
+        with self._condition:
+            self._pending = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rollup-refresher', daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+            time.sleep(self.delay)
+            with self._condition:
+                self._pending = False
+            with self._app.app_context(), use_facility(self.facility):
+                try:
+                    refresh_rollups()
+                except Exception:
+                    # The records stay pending for the next refresh
+                    logging.exception("Rollup refresh failed")
+                    db.session.rollback()
+
+
+rollup_refresher = FacilityLocal(RollupRefresher, broadcast=('init_app',))
+
+
+def _rollup_archived(chunk_size):
+    """Fold every archived record into the rollups, one transaction per chunk"""
+    query = db.session.query(
+        ArchivedParkingRecord.id, ArchivedParkingRecord.entry_time, ArchivedParkingRecord.exit_time,
+        ArchivedParkingRecord.fee, ParkingSlot.area
+    ).outerjoin(ParkingSlot, ArchivedParkingRecord.slot_id == ParkingSlot.id)
+    total = 0
+    last_id = 0
+    while True:
+        rows = query.filter(ArchivedParkingRecord.id > last_id).order_by(
+            ArchivedParkingRecord.id
+        ).limit(chunk_size).all()
+        if not rows:
+            db.session.rollback()
+            return total
+        deltas = {}
+        for row in rows:
+            add_stay(deltas, row.entry_time, row.exit_time, row.fee, row.area)
+        _merge(deltas)
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1].id
+
+
+def rebuild_rollups(chunk_size=ROLLUP_CHUNK_SIZE):
+    """Drop all rollups and roll every completed record up again, e.g. after repricing"""
+    db.session.query(OccupancyRollup).delete(synchronize_session=False)
+    db.session.execute(
+        update(ParkingRecord)
+        .where(ParkingRecord.rolled_up.is_(True))
+        .values(rolled_up=False)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return _rollup_archived(chunk_size) + refresh_rollups(chunk_size)
+
+
+def slots_per_area():
+    """Number of parking slots in each area, {area: count}"""
+    rows = db.session.query(ParkingSlot.area, func.count(ParkingSlot.id)).group_by(ParkingSlot.area)
+    return {area or UNKNOWN_AREA: count for area, count in rows}
+
+
+def get_occupancy_report(start, end, area=None, granularity='hour'):
+    """Occupancy, dwell time, turnover and revenue per area for [start, end).
+
+    Buckets are hours or days. Only stays that have ended are included.
+    """
+    query = OccupancyRollup.query.filter(OccupancyRollup.hour >= start, OccupancyRollup.hour < end)
+    if area:
+        query = query.filter(OccupancyRollup.area == area)
+
+    bucket_hours = 24 if granularity == 'day' else 1
+    buckets = {}
+    for rollup in query.order_by(OccupancyRollup.hour, OccupancyRollup.area):
+        period = rollup.hour.replace(hour=0) if granularity == 'day' else rollup.hour
+        values = buckets.setdefault((period, rollup.area), [0, 0, 0.0, 0.0, 0.0])
+        for index, field in enumerate(ROLLUP_FIELDS):
+            values[index] += getattr(rollup, field)
+
+    slots = slots_per_area()
+    report = []
+    for (period, bucket_area), (entries, exits, occupied, dwell, revenue) in buckets.items():
+        capacity = slots.get(bucket_area, 0)
+        report.append({
+            'period': period.isoformat(),
+            'area': bucket_area,
+            'entries': entries,
+            'exits': exits,
+            'occupancy_rate': round(occupied / (capacity * 60 * bucket_hours), 4) if capacity else None,
+            'average_dwell_minutes': round(dwell / exits, 1) if exits else None,
+            'turnover': round(exits / capacity, 2) if capacity else None,
+            'revenue': round(revenue, 2),
+        })
+    return report
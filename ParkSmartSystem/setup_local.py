@@ -27,6 +27,7 @@ def setup_local_environment():
         "werkzeug==2.3.7",
         "email-validator==2.1.0",
         "gunicorn==23.0.0",
+        "numpy==1.26.4",
     ]
     
     # Install required packages
@@ -0,0 +1,53 @@
+"""
+Pre-serialised slot lists for /api/parking-slots.
+
+The full slot list for a location is rendered to JSON once per occupancy
+version and reused until the next entry or exit changes it, so an unchanged
+poll neither touches the database nor serialises anything. Delta responses
+(?since=<version>) are small and rendered on demand from the occupancy index.
+"""
+import json
+
+from facilities import FacilityLocal
+from occupancy import occupancy_index
+
+
+def _slot_to_dict(slot, occupied):
+    return {
+        'id': slot.id,
+        'slot_number': slot.slot_number,
+        'location': slot.location,
+        'area': slot.area,
+        'is_occupied': occupied,
+        'coordinates': (f"{slot.latitude},{slot.longitude}"
+                        if slot.latitude is not None and slot.longitude is not None else None),
+    }
+
+
+def render_slots(slots):
+    return json.dumps([_slot_to_dict(slot, occupied) for slot, occupied in slots])
+
+
+class SlotListCache:
+    """Per-location JSON bodies keyed by occupancy version"""
+
+    def __init__(self, index=occupancy_index):
+        self._index = index
+        self._bodies = {}
+
+    def get_body(self, location, since=None):
+        """Return (version_tag, json_body) for the location"""
+        if since is not None:
+            version, slots = self._index.snapshot(location, since)
+            return version, render_slots(slots)
+
+        cached = self._bodies.get(location)
+        if cached is not None and cached[0] == self._index.version_tag:
+            return cached
+
+        version, slots = self._index.snapshot(location)
+        self._bodies[location] = (version, render_slots(slots))
+        return self._bodies[location]
+
+
+slot_list_cache = FacilityLocal(SlotListCache)
@@ -0,0 +1,177 @@
+"""
+Spatial index over free outdoor parking slots.
+
+Slots are bucketed into a uniform latitude/longitude grid. A k-nearest query
+scans rings of cells around the caller's cell and stops as soon as no cell
+further out can hold a closer slot, so the cost depends on the local slot
+density rather than on the total number of slots. Distances are great-circle
+(haversine) distances in metres.
+
+The index follows the occupancy index: it is rebuilt whenever the occupancy
+index is warmed and updated whenever a slot is occupied or freed.
+"""
+import heapq
+import math
+import threading
+
+from facilities import FacilityLocal
+from occupancy import occupancy_index
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+WALKING_SPEED_M_PER_MIN = 80.0
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres between two points"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """Uniform grid of points keyed by (row, col) cell"""
+
+    def __init__(self, cell_size=0.0005):
+        # 0.0005 degrees is roughly 55 m of latitude
+        self.cell_size = cell_size
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._points = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_size)), int(math.floor(lng / self.cell_size)))
+
+    def clear(self):
+        with self._lock:
+            self._cells = {}
+            self._points = {}
+
+    def insert(self, key, lat, lng, value=None):
+        with self._lock:
+            self._remove(key)
+            cell = self._cell(lat, lng)
+            self._points[key] = (lat, lng, value, cell)
+            self._cells.setdefault(cell, {})[key] = (lat, lng, value)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        point = self._points.pop(key, None)
+        if point is None:
+            return
+        cell = point[3]
+        bucket = self._cells[cell]
+        del bucket[key]
+        if not bucket:
+            del self._cells[cell]
+
+    def nearest(self, lat, lng, k=1):
+        """Return up to k (distance_m, key, value) tuples, closest first"""
+        with self._lock:
+            if not self._cells or k <= 0:
+                return []
+
+            row, col = self._cell(lat, lng)
+            best = []  # max-heap of (-distance, key, value)
+            visited = 0
+            ring = 0
+            while visited < len(self._cells):
+                for cell in self._ring_cells(row, col, ring):
+                    bucket = self._cells.get(cell)
+                    if bucket is None:
+                        continue
+                    visited += 1
+                    for key, (p_lat, p_lng, value) in bucket.items():
+                        distance = haversine(lat, lng, p_lat, p_lng)
+                        if len(best) < k:
+                            heapq.heappush(best, (-distance, key, value))
+                        elif distance < -best[0][0]:
+                            heapq.heapreplace(best, (-distance, key, value))
+
+                # Anything outside this ring is at least `ring` whole cells away
+                if len(best) == k and -best[0][0] <= self._ring_floor(lat, ring):
+                    break
+                ring += 1
+                if (2 * ring + 1) ** 2 > 4 * len(self._cells):
+                    # Caller is far from every slot; finish with a flat scan
+                    self._scan_remaining(lat, lng, row, col, ring, k, best)
+                    break
+
+            return sorted((-d, key, value) for d, key, value in best)
+
+    def _ring_floor(self, lat, ring):
+        """Lower bound in metres for points outside the given ring"""
+        degrees = ring * self.cell_size
+        worst_lat = min(90.0, abs(lat) + degrees)
+        return degrees * METERS_PER_DEGREE * math.cos(math.radians(worst_lat))
+
+    def _scan_remaining(self, lat, lng, row, col, ring, k, best):
+        for (c_row, c_col), bucket in self._cells.items():
+            if max(abs(c_row - row), abs(c_col - col)) < ring:
+                continue
+            for key, (p_lat, p_lng, value) in bucket.items():
+                distance = haversine(lat, lng, p_lat, p_lng)
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, key, value))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, key, value))
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
+
+
+class SpatialSlotIndex:
+    """Grid index of the free slots at one location, synced with occupancy"""
+
+    def __init__(self, location='outdoor', cell_size=0.0005):
+        self.location = location
+        self.grid = GridIndex(cell_size)
+
+    def rebuild(self, index):
+        self.grid.clear()
+        for slot in index.free_slots(self.location):
+            self._insert(slot)
+
+    def on_occupancy_change(self, slot, occupied):
+        if slot.location != self.location:
+            return
+        if occupied:
+            self.grid.remove(slot.id)
+        else:
+            self._insert(slot)
+
+    def _insert(self, slot):
+        if slot.latitude is None or slot.longitude is None:
+            return
+        self.grid.insert(slot.id, slot.latitude, slot.longitude, slot)
+
+    def nearest(self, lat, lng, k=1):
+        """Return up to k (slot_info, distance_m) pairs, closest first"""
+        return [(slot, distance) for distance, _, slot in self.grid.nearest(lat, lng, k)]
+
+
+outdoor_spatial_index = FacilityLocal(lambda: SpatialSlotIndex('outdoor'))
+occupancy_index.add_warm_listener(outdoor_spatial_index.rebuild)
+occupancy_index.add_listener(outdoor_spatial_index.on_occupancy_change)
+
+
+def estimate_walking_minutes(distance_m):
+    return max(1, int(round(distance_m / WALKING_SPEED_M_PER_MIN)))
@@ -17,11 +17,38 @@ document.addEventListener('DOMContentLoaded', function() {
 
 function initializeParkingMap() {
     // This function initializes the indoor parking visualization
-    // It will be refreshed periodically to show real-time slot status
+    // and keeps it in sync with live slot status updates
     refreshParkingSlots();
 
-    // Set up periodic refresh (every 30 seconds)
-    setInterval(refreshParkingSlots, 30000);
+    if (typeof EventSource === 'undefined') {
+        // Fall back to periodic refresh (every 30 seconds)
+        setInterval(refreshParkingSlots, 30000);
+        return;
+    }
+
+    const stream = new EventSource('/api/parking-slots/stream?location=indoor');
+
+    // Only changed slots are pushed
+    stream.addEventListener('slot', function(event) {
+        updateSlotElement(JSON.parse(event.data));
+    });
+
+    // Sent when updates were missed; reload the whole map once.
+    // On reconnect the browser resumes from Last-Event-ID by itself.
+    stream.addEventListener('resync', refreshParkingSlots);
+}
+
+function updateSlotElement(slot) {
+    const slotElement = document.querySelector(`.parking-slot[data-slot-id="${slot.id}"]`);
+    if (slotElement) {
+        if (slot.is_occupied) {
+            slotElement.classList.add('occupied');
+            slotElement.classList.remove('available');
+        } else {
+            slotElement.classList.add('available');
+            slotElement.classList.remove('occupied');
+        }
+    }
 }
 
 async function refreshParkingSlots() {
@@ -29,18 +56,7 @@ async function refreshParkingSlots() {
         const slots = await apiCall('/api/parking-slots?location=indoor');
 
         // Update the status of each slot in the UI
-        slots.forEach(slot => {
-            const slotElement = document.querySelector(`.parking-slot[data-slot-id="${slot.id}"]`);
-            if (slotElement) {
-                if (slot.is_occupied) {
-                    slotElement.classList.add('occupied');
-                    slotElement.classList.remove('available');
-                } else {
-                    slotElement.classList.add('available');
-                    slotElement.classList.remove('occupied');
-                }
-            }
-        });
+        slots.forEach(updateSlotElement);
     } catch (error) {
         console.error('Error refreshing parking slots:', error);
     }
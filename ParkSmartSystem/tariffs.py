@@ -0,0 +1,185 @@
+"""
+Tariff engine for the Car Parking System.
+
+Tariffs are declared as plain dictionaries, for example:
+
+    {
+        'standard': {'rate': 2.0, 'minimum_fee': 2.0},
+        'indoor': {
+            'bands': [(0, 7, 1.0), (7, 19, 3.0), (19, 24, 1.5)],  # (from hour, to hour, $/hour)
+            'daily_cap': 25.0,
+            'grace_minutes': 10,
+            'minimum_fee': 2.0,
+        },
+        'vip': {'rate': 5.0, 'minimum_fee': 5.0},
+    }
+
+A stay is charged minute by minute at the rate of the band each minute falls
+in. Each 24 hours from entry is capped at daily_cap, stays no longer than
+grace_minutes are free, and any other stay costs at least minimum_fee.
+'standard' is used for parking types without their own tariff and, with the
+defaults below, reproduces the original $2/hour with a one-hour minimum.
+Stays in the VIP areas (the VIP_AREAS config, none by default) are charged
+the 'vip' tariff if there is one; the slot assigner keeps the same areas for
+VIP users.
+
+Each tariff is compiled into a cumulative cost table with one entry per
+minute over two days, so the fee for any stay is a few table lookups: any
+full 24 hours costs the same whatever time it starts, and the remainder is
+the difference of two cumulative values. Tariff.fee uses the table for one
+record; batch_fees evaluates whole NumPy arrays of records at once.
+"""
+from datetime import datetime, timedelta
+
+
+MINUTES_PER_DAY = 1440
+EPOCH = datetime(1970, 1, 1)
+ONE_MINUTE = timedelta(minutes=1)
+
+DEFAULT_TARIFFS = {
+    'standard': {'rate': 2.0, 'minimum_fee': 2.0},
+}
+
+
+def _numpy():
+    # Imported on first use so web workers that never reprice don't pay for it
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("numpy is required for batch fee evaluation")
+    return numpy
+
+
+class Tariff:
+    """A compiled tariff"""
+
+    def __init__(self, name, bands=None, rate=None, daily_cap=None, grace_minutes=0,
+                 minimum_fee=0.0, utc_offset_minutes=0):
+        if bands is None:
+            bands = [(0, 24, rate or 0.0)]
+        self.name = name
+        self.bands = [tuple(band) for band in bands]
+        self.daily_cap = daily_cap
+        self.grace_minutes = grace_minutes
+        self.minimum_fee = minimum_fee
+        self.utc_offset_minutes = utc_offset_minutes
+
+        per_minute = [0.0] * MINUTES_PER_DAY
+        for start_hour, end_hour, hourly_rate in self.bands:
+            for minute in range(int(start_hour * 60), int(end_hour * 60)):
+                per_minute[minute] = hourly_rate / 60
+        # Cumulative cost from midnight, over two days so stays can wrap
+        self._cumulative = [0.0]
+        for minute in range(2 * MINUTES_PER_DAY):
+            self._cumulative.append(self._cumulative[-1] + per_minute[minute % MINUTES_PER_DAY])
+        self.full_day_fee = self._cumulative[MINUTES_PER_DAY]
+        self._numpy_cumulative = None
+
+    @classmethod
+    def from_config(cls, name, config):
+        return cls(name, **config)
+
+    def _cost_until(self, minute):
+        index = int(minute)
+        fraction = minute - index
+        low = self._cumulative[index]
+        if fraction:
+            low += (self._cumulative[index + 1] - low) * fraction
+        return low
+
+    def fee(self, entry_time, exit_time):
+        """Fee for one stay"""
+        minutes = (exit_time - entry_time) / ONE_MINUTE
+        if self.grace_minutes and minutes <= self.grace_minutes:
+            return 0.0
+
+        # Times are naive UTC, as stored on ParkingRecord
+        start = ((entry_time - EPOCH) / ONE_MINUTE + self.utc_offset_minutes) % MINUTES_PER_DAY
+        days, rest = divmod(minutes, MINUTES_PER_DAY)
+        partial = self._cost_until(start + rest) - self._cost_until(start)
+        day_fee = self.full_day_fee
+        if self.daily_cap is not None:
+            partial = min(partial, self.daily_cap)
+            day_fee = min(day_fee, self.daily_cap)
+        return round(max(days * day_fee + partial, self.minimum_fee), 2)
+
+    def batch_fees(self, entry_minutes, exit_minutes):
+        """Fees for arrays of entry/exit times given in minutes since the epoch"""
+        np = _numpy()
+        if self._numpy_cumulative is None:
+            self._numpy_cumulative = np.asarray(self._cumulative)
+        cumulative = self._numpy_cumulative
+
+        minutes = exit_minutes - entry_minutes
+        start = np.mod(entry_minutes + self.utc_offset_minutes, MINUTES_PER_DAY)
+        days = np.floor(minutes / MINUTES_PER_DAY)
+        end = start + (minutes - days * MINUTES_PER_DAY)
+
+        def cost_until(minute):
+            index = minute.astype(np.int64)
+            fraction = minute - index
+            upper = np.minimum(index + 1, len(cumulative) - 1)
+            return cumulative[index] + (cumulative[upper] - cumulative[index]) * fraction
+
+        partial = cost_until(end) - cost_until(start)
+        day_fee = self.full_day_fee
+        if self.daily_cap is not None:
+            partial = np.minimum(partial, self.daily_cap)
+            day_fee = min(day_fee, self.daily_cap)
+        fees = np.maximum(days * day_fee + partial, self.minimum_fee)
+        if self.grace_minutes:
+            fees = np.where(minutes <= self.grace_minutes, 0.0, fees)
+        return np.round(fees, 2)
+
+
+class TariffRegistry:
+    """Compiled tariffs by name"""
+
+    def __init__(self, config=None, vip_areas=()):
+        self.configure(config or DEFAULT_TARIFFS, vip_areas)
+
+    def configure(self, config, vip_areas=()):
+        tariffs = {name: Tariff.from_config(name, options) for name, options in config.items()}
+        if 'standard' not in tariffs:
+            tariffs['standard'] = Tariff.from_config('standard', DEFAULT_TARIFFS['standard'])
+        self._tariffs = tariffs
+        self.vip_areas = frozenset(vip_areas)
+
+    def is_vip_area(self, area):
+        return area in self.vip_areas
+
+    def get(self, name):
+        return self._tariffs.get(name) or self._tariffs['standard']
+
+    def resolve(self, parking_type=None, area=None):
+        """Name of the tariff for a stay of the given parking type in the given area"""
+        if area in self.vip_areas and 'vip' in self._tariffs:
+            return 'vip'
+        name = (parking_type or '').lower()
+        return name if name in self._tariffs else 'standard'
+
+    def select(self, parking_type=None, area=None):
+        return self._tariffs[self.resolve(parking_type, area)]
+
+    def batch_fees(self, tariff_names, entry_minutes, exit_minutes):
+        """Fees for arrays of records, each priced by its own tariff name"""
+        np = _numpy()
+        # Group records by tariff with integer codes; comparing strings per record is slow
+        codes = {}
+        record_codes = np.fromiter((codes.setdefault(name, len(codes)) for name in tariff_names),
+                                   dtype=np.int32, count=len(tariff_names))
+        fees = np.zeros(len(record_codes))
+        for name, code in codes.items():
+            mask = record_codes == code
+            fees[mask] = self.get(name).batch_fees(entry_minutes[mask], exit_minutes[mask])
+        return fees
+
+
+tariff_registry = TariffRegistry()
+
+
+def to_epoch_minutes(times):
+    """Convert a sequence of naive UTC datetimes to a float array of epoch minutes"""
+    np = _numpy()
+    # Subtracting datetimes is much cheaper than letting NumPy parse datetime objects
+    return np.fromiter(((time - EPOCH) / ONE_MINUTE for time in times), dtype=float, count=len(times))
@@ -0,0 +1,85 @@
+"""
+Fixtures for the Car Parking System tests.
+
+One app is created per test session, on a SQLite database in a temporary
+directory, since the caches and indexes are module-level singletons. Tests
+create users of their own, so they don't see each other's vehicles and
+records.
+"""
+import itertools
+import os
+import sys
+from collections import namedtuple
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+PASSWORD = 'secret'
+TestUser = namedtuple('TestUser', ['id', 'username', 'vehicle_id'])
+
+_numbers = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    from app import create_app
+    from commands import init_database
+
+    path = tmp_path_factory.mktemp('db') / 'parking.db'
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'METRICS_ENABLED': False, 'TESTING': True})
+    with app.app_context():
+        init_database()
+    return app
+
+
+def make_user(app):
+    """A new user with one vehicle"""
+    from extensions import db
+    from models import User, Vehicle
+
+    number = next(_numbers)
+    with app.app_context():
+        account = User(username=f'driver{number}', email=f'driver{number}@example.com')
+        account.set_password(PASSWORD)
+        db.session.add(account)
+        db.session.flush()
+        vehicle = Vehicle(license_plate=f'TS{number:04d}', user_id=account.id)
+        db.session.add(vehicle)
+        db.session.commit()
+        created = TestUser(account.id, account.username, vehicle.id)
+        db.session.remove()
+    return created
+
+
+def login(app, user):
+    """Test client logged in as user"""
+    client = app.test_client()
+    client.post('/login', data={'username': user.username, 'password': PASSWORD})
+    return client
+
+
+@pytest.fixture
+def user(app):
+    return make_user(app)
+
+
+@pytest.fixture
+def client(app, user):
+    return login(app, user)
+
+
+def free_slot_id(client, location='indoor'):
+    slots = client.get(f'/api/parking-slots?location={location}').get_json()
+    return next(slot['id'] for slot in slots if not slot['is_occupied'])
+
+
+def park(client, user, location='indoor'):
+    """Park the user's vehicle in a free slot; returns the entry response body and the slot_id"""
+    slot_id = free_slot_id(client, location)
+    response = client.post('/api/parking-entry', json={
+        'vehicle_id': user.vehicle_id, 'slot_id': slot_id, 'parking_type': location.capitalize(),
+    })
+    assert response.status_code == 200, response.get_json()
+    return dict(response.get_json(), slot_id=slot_id)
@@ -0,0 +1,85 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import archive
+from archive import archive_parking_records
+from conftest import make_user
+from extensions import db
+from facilities import use_facility
+from models import ArchivedParkingRecord, ParkingRecord, ParkingSlot
+
+NOW = datetime(2024, 6, 1, 12)
+OLD = NOW - timedelta(days=200)
+
+
+@pytest.fixture
+def facility(app):
+    """A site of its own, so archival only sees the records made here"""
+    user = make_user(app)
+    code = f'arc{uuid.uuid4().hex[:6]}'
+    with app.app_context(), use_facility(code):
+        slot = ParkingSlot(slot_number='A1', location='indoor', area='Level 1', is_occupied=False)
+        db.session.add(slot)
+        db.session.flush()
+
+        def record(entry, hours=1, rolled_up=True, open_=False):
+            return ParkingRecord(user_id=user.id, vehicle_id=user.vehicle_id, slot_id=slot.id, entry_time=entry,
+                                 exit_time=None if open_ else entry + timedelta(hours=hours),
+                                 fee=2.0 * hours, payment_status='Paid', status='completed', rolled_up=rolled_up)
+
+        old = [record(OLD + timedelta(days=day), hours=day + 1) for day in range(5)]
+        kept = [record(OLD, rolled_up=False), record(NOW - timedelta(days=10)), record(OLD, open_=True)]
+        # The newest record is old and rolled up too, but its id must stay
+        newest = record(OLD - timedelta(days=1))
+        for rows in (old, kept, [newest]):
+            db.session.add_all(rows)
+            db.session.flush()
+        db.session.commit()
+        ids = ([row.id for row in old], [row.id for row in kept], newest.id)
+        db.session.remove()
+    return code, ids
+
+
+def hot_and_archived(app, code):
+    with app.app_context(), use_facility(code):
+        hot = {row.id for row in ParkingRecord.query}
+        archived = {row.id: (row.entry_time, row.exit_time, row.fee, row.facility)
+                    for row in ArchivedParkingRecord.query}
+        db.session.remove()
+    return hot, archived
+
+
+def test_old_rolled_up_records_move_in_batches_except_the_newest(app, facility):
+    code, (old, kept, newest) = facility
+    with app.app_context(), use_facility(code):
+        assert archive_parking_records(older_than_days=90, batch_size=2, now=NOW) == len(old)
+        assert archive_parking_records(older_than_days=90, batch_size=2, now=NOW) == 0
+        db.session.remove()
+
+    hot, archived = hot_and_archived(app, code)
+    assert hot == set(kept) | {newest}
+    assert set(archived) == set(old)
+    # Records keep their id, times, fee and facility
+    entry, exit_time, fee, archived_facility = archived[old[2]]
+    assert (entry, exit_time - entry, fee, archived_facility) == (OLD + timedelta(days=2), timedelta(hours=3),
+                                                                  6.0, code)
+
+
+def test_count_mismatch_rolls_the_batch_back_and_stops(app, facility, monkeypatch, caplog):
+    code, (old, kept, newest) = facility
+    # One record of the first batch changes between reading the ids and copying it; deleting
+    # it anyway would lose it
+    changed = old[1]
+    select = archive.select
+    monkeypatch.setattr(archive, 'select', lambda *columns: select(*columns).where(ParkingRecord.id != changed))
+
+    with app.app_context(), use_facility(code):
+        assert archive_parking_records(older_than_days=90, batch_size=3, now=NOW) == 0
+        db.session.remove()
+    assert 'Archival stopped: 3 records to move, 2 copied and 3 deleted' in caplog.text
+
+    hot, archived = hot_and_archived(app, code)
+    assert hot == set(old) | set(kept) | {newest}
+    assert archived == {}
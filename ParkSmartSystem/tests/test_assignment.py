@@ -0,0 +1,91 @@
+import random
+
+import assignment
+from assignment import RankedSlots, SlotAssigner
+from occupancy import SlotInfo
+from tariffs import TariffRegistry
+
+
+class FakeIndex:
+    def __init__(self, slots):
+        self._slots = {slot.id: slot for slot in slots}
+        self.occupied = set()
+
+    def locations(self):
+        return ['indoor']
+
+    def slots(self, location):
+        return list(self._slots.values())
+
+    def is_occupied(self, slot_id):
+        return slot_id in self.occupied
+
+    def get(self, slot_id):
+        return self._slots.get(slot_id)
+
+
+def garage(levels=2, per_level=5):
+    return [SlotInfo(level * 100 + number, f'L{level}{number:02d}', 'indoor', f'Level {level}', None, None)
+            for level in range(1, levels + 1) for number in range(1, per_level + 1)]
+
+
+def test_ranked_slots_stay_ordered_through_adds_and_discards():
+    rng = random.Random(3)
+    ranked, expected = RankedSlots(), set()
+    for _ in range(20000):
+        key = (rng.randint(0, 40) * 2.5, rng.randint(1, 200))
+        if rng.random() < 0.5:
+            ranked.add(key)
+            expected.add(key)
+        else:
+            ranked.discard(key)
+            expected.discard(key)
+    assert list(ranked) == sorted(expected)
+    assert len(ranked) == len(expected)
+    assert ranked.choice() in expected
+
+
+def test_held_slots_are_skipped_until_released(monkeypatch):
+    index = FakeIndex(garage())
+    monkeypatch.setattr(assignment, 'occupancy_index', index)
+    assigner = SlotAssigner('nearest_entrance')
+    assigner.rebuild(index)
+
+    # Cars detected together get different slots, nearest first
+    assigned = [assigner.assign('indoor').id for _ in range(10)]
+    assert assigned == [101, 102, 103, 104, 105, 201, 202, 203, 204, 205]
+
+    # With every slot held, the nearest held one is given out again
+    assert assigner.assign('indoor').id == 101
+
+    # An occupied slot drops its hold; once freed it is the nearest free slot again
+    slot = index.get(102)
+    index.occupied.add(102)
+    assigner.on_occupancy_change(slot, True)
+    index.occupied.discard(102)
+    assigner.on_occupancy_change(slot, False)
+    assert assigner.assign('indoor').id == 102
+
+    # Expired holds return their slots to the free ones
+    monkeypatch.setattr(assignment.time, 'monotonic', lambda: 1e12)
+    assert assigner.assign('indoor').id == 101
+    assert assigner.assign('indoor', accept=lambda slot_id: slot_id > 200).id == 201
+
+
+def test_vip_areas_follow_the_tariff_config(monkeypatch):
+    index = FakeIndex(garage())
+    monkeypatch.setattr(assignment, 'occupancy_index', index)
+    monkeypatch.setattr(assignment, 'tariff_registry', TariffRegistry(vip_areas=['Level 2']))
+    assigner = SlotAssigner('nearest_entrance')
+    assigner.rebuild(index)
+
+    # VIP users go to the VIP level first, everyone else never gets it
+    assert assigner.assign('indoor', vip=True).id == 201
+    assert assigner.assign('indoor').id == 101
+    assert assigner.assign('indoor', area='Level 2') is None
+
+    # Once the VIP level is full, VIP users fall back to the other ones
+    for slot_id in range(201, 206):
+        index.occupied.add(slot_id)
+        assigner.on_occupancy_change(index.get(slot_id), True)
+    assert assigner.assign('indoor', vip=True).id == 102
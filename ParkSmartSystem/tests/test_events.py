@@ -0,0 +1,62 @@
+import json
+import threading
+import time
+
+import events
+from events import SlotEventBroker, stream_slot_events
+
+STREAMS = 8
+
+
+def open_streams(app, broker, location, count, sync=False):
+    with app.app_context():
+        streams = [stream_slot_events(location, broker=broker, sync=sync) for _ in range(count)]
+    for stream in streams:
+        assert next(stream) == 'retry: 5000\n\n'
+    return streams
+
+
+def syncers():
+    return [thread for thread in threading.enumerate() if thread.name == 'slot-event-sync']
+
+
+def test_one_broadcast_reaches_every_stream(app):
+    broker = SlotEventBroker()
+    streams = open_streams(app, broker, 'indoor', STREAMS)
+    assert broker.subscribers == STREAMS
+
+    received = [None] * STREAMS
+    readers = [threading.Thread(target=lambda i=i: received.__setitem__(i, next(streams[i])))
+               for i in range(STREAMS)]
+    for reader in readers:
+        reader.start()
+    broker.publish('outdoor', {'id': 2})
+    broker.publish('indoor', {'id': 1, 'is_occupied': True})
+    for reader in readers:
+        reader.join(timeout=5)
+
+    assert len(set(received)) == 1
+    header, _, data = received[0].strip().rpartition('data: ')
+    assert header == f'id: {broker.current_seq}\nevent: slot\n'
+    assert json.loads(data) == {'id': 1, 'is_occupied': True}
+
+    for stream in streams:
+        stream.close()
+    assert broker.subscribers == 0
+
+
+def test_open_streams_share_one_syncer(app, monkeypatch):
+    monkeypatch.setattr(events, 'OCCUPANCY_SYNC_SECONDS', 0.05)
+    monkeypatch.setattr(events.occupancy_index, 'sync', lambda: None)
+    broker = SlotEventBroker()
+    before = len(syncers())
+
+    streams = open_streams(app, broker, 'indoor', STREAMS, sync=True)
+    assert len(syncers()) == before + 1
+
+    for stream in streams:
+        stream.close()
+    deadline = time.monotonic() + 5
+    while len(syncers()) > before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(syncers()) == before
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import park
+from exit_tokens import InvalidExitToken, exit_gate
+from extensions import db
+from models import ParkingRecord
+
+
+@pytest.fixture
+def parked(app, client, user):
+    """The user's open parking record, detached from the session"""
+    record_id = park(client, user)['record_id']
+    with app.app_context():
+        record = db.session.get(ParkingRecord, record_id)
+        db.session.expunge(record)
+        db.session.remove()
+    return record
+
+
+def issue(app, record, now=None):
+    with app.app_context():
+        return exit_gate.issue(record, now)
+
+
+def exit_with(client, token):
+    return client.post('/api/parking-exit', json={'token': token})
+
+
+def test_token_lets_the_vehicle_out_once(app, client, parked):
+    token = issue(app, parked)
+
+    response = exit_with(client, token)
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['record_id'] == parked.id
+
+    replayed = exit_with(client, token)
+    assert replayed.status_code == 400
+    assert replayed.get_json()['message'] == 'Vehicle has already exited'
+
+    with app.app_context():
+        assert exit_gate.flush(timeout=5)
+        assert db.session.get(ParkingRecord, parked.id).exit_time is not None
+        db.session.remove()
+
+
+@pytest.mark.parametrize('tamper', [
+    # A flipped character in the signature, and in the payload (the record id)
+    lambda token: token[:-1] + ('A' if token[-1] != 'A' else 'B'),
+    lambda token: token[:4] + ('A' if token[4] != 'A' else 'B') + token[5:],
+    lambda token: token[:-8],
+    lambda token: 'not a token',
+])
+def test_tampered_token_is_refused(app, client, parked, tamper):
+    response = exit_with(client, tamper(issue(app, parked)))
+    assert response.status_code == 403
+    with app.app_context():
+        assert db.session.get(ParkingRecord, parked.id).exit_time is None
+        db.session.remove()
+
+
+def test_expired_token_is_refused(app, client, parked):
+    max_age = app.config['EXIT_TOKEN_MAX_AGE']
+    token = issue(app, parked, now=datetime.utcnow() - timedelta(seconds=max_age + 60))
+
+    response = exit_with(client, token)
+    assert response.status_code == 403
+    assert 'expired' in response.get_json()['message']
+    with app.app_context():
+        with pytest.raises(InvalidExitToken):
+            exit_gate.verify(token)
+        # Still valid when it was issued
+        assert exit_gate.verify(token, now=datetime.utcnow() - timedelta(seconds=max_age)).record_id == parked.id
+
+
+def test_token_is_refused_after_exit_by_record_id(app, client, parked):
+    token = issue(app, parked)
+
+    response = client.post('/api/parking-exit', json={'record_id': parked.id})
+    assert response.status_code == 200, response.get_json()
+
+    replayed = exit_with(client, token)
+    assert replayed.status_code == 400
+    assert replayed.get_json()['message'] == 'Vehicle has already exited'
+
+
+def test_exit_closed_by_another_worker_is_counted_as_a_conflict(app, client, parked):
+    token = issue(app, parked)
+    # Another worker lets the car out by record id; this one hasn't seen it
+    with app.app_context():
+        db.session.get(ParkingRecord, parked.id).exit_time = datetime.utcnow()
+        db.session.commit()
+        conflicts = exit_gate.stats['conflicts']
+
+    assert exit_with(client, token).status_code == 200
+    with app.app_context():
+        assert exit_gate.flush(timeout=5)
+        assert exit_gate.stats['conflicts'] == conflicts + 1
+        db.session.remove()
@@ -0,0 +1,101 @@
+import csv
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import free_slot_id, make_user
+from exports import EXPORT_COLUMNS, export_parking_records
+from extensions import db
+from models import ArchivedParkingRecord, ParkingRecord
+
+BASE = datetime(2023, 6, 1, 8, 0)
+
+
+def add_records(app, user, slot_id):
+    """Records entering BASE + 0..4 days, the second one archived and the last one open; returns their ids"""
+    with app.app_context():
+        records = []
+        for day in range(5):
+            entry = BASE + timedelta(days=day)
+            exit_time = entry + timedelta(minutes=90) if day < 4 else None
+            if day == 1:
+                record = ArchivedParkingRecord(id=800000 + user.id * 10 + day, exit_time=exit_time)
+            else:
+                record = ParkingRecord(exit_time=exit_time)
+            record.user_id, record.vehicle_id, record.slot_id = user.id, user.vehicle_id, slot_id
+            record.entry_time, record.parking_type = entry, 'Indoor'
+            record.fee, record.payment_status = (3.0, 'Paid') if exit_time else (0.0, None)
+            db.session.add(record)
+            records.append(record)
+        db.session.commit()
+        ids = [record.id for record in records]
+        db.session.remove()
+    return ids
+
+
+def export(client, export_format, **params):
+    response = client.get('/api/parking-records/export', query_string=dict(params, format=export_format))
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response
+
+
+def test_csv_export_has_the_users_records_in_the_window(app, client, user):
+    ids = add_records(app, user, free_slot_id(client))
+    # Another driver's records are never in a user's export
+    other = make_user(app)
+    add_records(app, other, free_slot_id(client))
+
+    response = export(client, 'csv', start=BASE.isoformat(), end=(BASE + timedelta(days=4, hours=1)).isoformat())
+    assert response.mimetype == 'text/csv'
+    assert 'parking-records.csv' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert list(rows[0]) == EXPORT_COLUMNS
+    assert [int(row['id']) for row in rows] == ids
+
+    completed = rows[0]
+    assert completed['user_id'] == str(user.id)
+    assert completed['license_plate'].startswith('TS')
+    assert completed['entry_time'] == BASE.isoformat()
+    assert completed['duration_minutes'] == '90'
+    assert float(completed['fee']) == 3.0
+    assert rows[-1]['exit_time'] == '' and rows[-1]['duration_minutes'] == ''
+
+    window = export(client, 'csv', start=(BASE + timedelta(days=1)).isoformat(),
+                    end=(BASE + timedelta(days=3)).isoformat())
+    assert [int(row['id']) for row in csv.DictReader(io.StringIO(window.get_data(as_text=True)))] == ids[1:3]
+
+
+@pytest.mark.parametrize('export_format', ['parquet', 'arrow'])
+def test_columnar_exports_match_the_csv(app, client, user, export_format):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+
+    ids = add_records(app, user, free_slot_id(client))
+    data = export(client, export_format).get_data()
+    if export_format == 'parquet':
+        table = pyarrow.parquet.read_table(io.BytesIO(data))
+    else:
+        table = pa.ipc.open_stream(data).read_all()
+
+    assert table.column_names == EXPORT_COLUMNS
+    assert table.column('id').to_pylist() == ids
+    assert table.column('entry_time').to_pylist()[0] == BASE
+    assert table.column('duration_minutes').to_pylist() == [90, 90, 90, 90, None]
+    assert table.column('fee').to_pylist() == [3.0, 3.0, 3.0, 3.0, 0.0]
+
+
+def test_parquet_export_writes_one_row_group_per_chunk(app, client, user):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+
+    add_records(app, user, free_slot_id(client))
+    with app.app_context():
+        data = b''.join(export_parking_records('parquet', user_id=user.id, chunk_size=2))
+    parquet_file = pyarrow.parquet.ParquetFile(io.BytesIO(data))
+    assert parquet_file.metadata.num_rows == 5
+    assert parquet_file.metadata.num_row_groups == 3
+
+
+def test_unknown_format_is_refused(client):
+    assert client.get('/api/parking-records/export?format=xlsx').status_code == 400
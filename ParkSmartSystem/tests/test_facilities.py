@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+
+from conftest import make_user
+from extensions import db
+from facilities import DEFAULT_FACILITY, current_facility, use_facility
+from models import ParkingRecord, ParkingSlot, Reservation
+
+OTHER = 'depot'
+
+
+def add_stays(app, user, facility, slot_number):
+    """A slot and two completed stays of the user at a facility"""
+    with app.app_context(), use_facility(facility):
+        slot = ParkingSlot(slot_number=slot_number, location='scoping', area='Scoping', is_occupied=False)
+        db.session.add(slot)
+        db.session.flush()
+        entry = datetime(2024, 5, 1, 9)
+        db.session.add_all(ParkingRecord(user_id=user.id, vehicle_id=user.vehicle_id, slot_id=slot.id,
+                                         entry_time=entry + timedelta(days=day),
+                                         exit_time=entry + timedelta(days=day, hours=1), fee=2.0)
+                           for day in range(2))
+        db.session.commit()
+        slot_id = slot.id
+        db.session.remove()
+    return slot_id
+
+
+def test_rows_are_only_seen_from_their_own_facility(app):
+    user = make_user(app)
+    # The same slot number at two sites
+    number = f'SC{user.id}'
+    main_slot = add_stays(app, user, DEFAULT_FACILITY, number)
+    other_slot = add_stays(app, user, OTHER, number)
+
+    with app.app_context():
+        for facility, slot_id in ((DEFAULT_FACILITY, main_slot), (OTHER, other_slot)):
+            with use_facility(facility):
+                assert [slot.id for slot in ParkingSlot.query.filter_by(slot_number=number)] == [slot_id]
+                records = ParkingRecord.query.filter_by(user_id=user.id).all()
+                assert {record.facility for record in records} == {facility}
+                assert {record.slot.id for record in records} == {slot_id}
+                assert db.session.query(func.count(ParkingRecord.id)).filter(
+                    ParkingRecord.user_id == user.id).scalar() == 2
+                # A site's slot is not found by id from another one
+                other = other_slot if facility == DEFAULT_FACILITY else main_slot
+                assert ParkingSlot.query.filter_by(id=other).first() is None
+                assert Reservation.query.filter_by(slot_id=other).count() == 0
+            db.session.expunge_all()
+
+        everywhere = db.session.execute(
+            select(ParkingRecord.facility).where(ParkingRecord.user_id == user.id)
+            .execution_options(all_facilities=True)
+        ).scalars().all()
+        assert sorted(everywhere) == sorted([DEFAULT_FACILITY, OTHER] * 2)
+        db.session.remove()
+
+
+def test_updates_and_deletes_only_touch_the_current_facility(app):
+    user = make_user(app)
+    add_stays(app, user, DEFAULT_FACILITY, f'SU{user.id}')
+    add_stays(app, user, OTHER, f'SU{user.id}')
+
+    with app.app_context():
+        with use_facility(OTHER):
+            repriced = db.session.execute(
+                update(ParkingRecord).where(ParkingRecord.user_id == user.id).values(fee=9.0)
+            ).rowcount
+            deleted = ParkingRecord.query.filter_by(user_id=user.id, fee=9.0).delete()
+            db.session.commit()
+        assert (repriced, deleted) == (2, 2)
+
+        fees = db.session.execute(
+            select(ParkingRecord.facility, ParkingRecord.fee).where(ParkingRecord.user_id == user.id)
+            .execution_options(all_facilities=True)
+        ).all()
+        assert sorted(fees) == [(DEFAULT_FACILITY, 2.0), (DEFAULT_FACILITY, 2.0)]
+        assert current_facility() == DEFAULT_FACILITY
+        db.session.remove()
+
+
+def test_history_api_does_not_show_other_facilities(app, user, client):
+    add_stays(app, user, OTHER, f'SH{user.id}')
+    assert client.get('/api/parking-history').get_json()['records'] == []
+    # Only configured facilities can be asked for
+    response = client.get('/api/parking-history', headers={'X-Facility': OTHER})
+    assert response.status_code == 404
+    assert response.get_json()['message'] == 'Facility not found'
@@ -0,0 +1,72 @@
+import uuid
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from conftest import make_user
+from extensions import db
+from forecast import BINS_PER_DAY, PROFILE_FIELDS, AvailabilityForecaster
+from models import ForecastProfile, ParkingRecord, ParkingSlot
+
+# A Monday, after every other test's records
+START = date(2030, 1, 7)
+
+
+@pytest.fixture
+def area(app):
+    """A one-slot area with stays over two weeks from START, one of them across the first week's end"""
+    user = make_user(app)
+    name = f'Forecast {uuid.uuid4().hex[:6]}'
+    day = lambda n, hour, minute=0: datetime.combine(START + timedelta(days=n), time(hour, minute))
+    stays = [(day(n, 8, 10), day(n, 9, 40)) for n in (0, 3, 7, 10, 12)]
+    stays += [(day(n, 17), day(n, 18, 5)) for n in (1, 8, 9)]
+    stays += [(day(6, 22), day(7, 3, 20))]
+    with app.app_context():
+        slot = ParkingSlot(slot_number=f'F{user.id}', location='forecast', area=name, is_occupied=False)
+        db.session.add(slot)
+        db.session.flush()
+        db.session.add_all(ParkingRecord(user_id=user.id, vehicle_id=user.vehicle_id, slot_id=slot.id,
+                                         entry_time=entry, exit_time=exit_time)
+                           for entry, exit_time in stays)
+        # Everything before START counts as trained, so retrains start there
+        if db.session.query(ForecastProfile).filter(ForecastProfile.trained_through >= START).count() == 0:
+            db.session.add(ForecastProfile(area=f'{name} seed', weekday=0, time_bin=0,
+                                           trained_through=START - timedelta(days=1)))
+        db.session.commit()
+        db.session.remove()
+    return name
+
+
+def profile_rows(name):
+    return {(row.area, row.weekday, row.time_bin): [getattr(row, field) for field in PROFILE_FIELDS]
+            for row in ForecastProfile.query.filter_by(area=name)}
+
+
+def test_weekly_retrains_add_up_to_training_both_weeks_at_once(app, area):
+    forecaster = AvailabilityForecaster()
+    with app.app_context():
+        expected = {key: values for key, values in forecaster._aggregate(START, 14, 1000).items()
+                    if key[0] == area}
+
+        assert forecaster.retrain(until=START + timedelta(days=7), chunk_size=3) == 7
+        assert forecaster.retrain(until=START + timedelta(days=7)) == 0
+        assert forecaster.retrain(until=START + timedelta(days=14), chunk_size=3) == 7
+
+        rows = profile_rows(area)
+        assert rows.keys() == expected.keys()
+        for key, values in expected.items():
+            assert rows[key] == pytest.approx(values), key
+
+        # Monday 08:00-08:15: the slot was taken at 08:10 on both Mondays, so it is parked
+        # from the 08:15 bin, where the area is full on both days
+        monday_8 = rows[(area, 0, 8 * 4)]
+        assert dict(zip(PROFILE_FIELDS, monday_8))['arrivals'] == 2
+        assert dict(zip(PROFILE_FIELDS, rows[(area, 0, 8 * 4 + 1)]))['full_days'] == 2
+        # The Sunday overnight stay is parked at Monday 00:00 of the second week only
+        assert dict(zip(PROFILE_FIELDS, rows[(area, 0, 0)]))['occupied'] == 1.0
+
+        forecaster.load()
+        assert forecaster.trained_through == START + timedelta(days=13)
+        db.session.remove()
+    assert forecaster._days[area] == 14
+    assert len(forecaster._tables[area]) == 7 * BINS_PER_DAY
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import free_slot_id, login, make_user
+from extensions import db
+from models import ParkingRecord
+
+
+@pytest.fixture
+def device(app, monkeypatch):
+    """Client of a gate device account"""
+    account = make_user(app)
+    monkeypatch.setitem(app.config, 'GATE_DEVICE_USERS', (account.username,))
+    return login(app, account)
+
+
+def post_batch(device, events):
+    response = device.post('/api/gate-events/batch', json={'events': events})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['results']
+
+
+def open_records(app, vehicle_id):
+    with app.app_context():
+        count = ParkingRecord.query.filter_by(vehicle_id=vehicle_id, exit_time=None).count()
+        db.session.remove()
+    return count
+
+
+def test_entry_into_a_slot_reserved_for_someone_else_is_refused(app, client, user, device):
+    # Within the arrival grace, so the booking's own vehicle may already park
+    start = datetime.utcnow() + timedelta(minutes=10)
+    end = start + timedelta(hours=2)
+    available = client.get('/api/reservations/availability', query_string={
+        'start': start.isoformat(), 'end': end.isoformat(), 'location': 'outdoor',
+    }).get_json()['slots']
+    slot_id = available[-1]['id']
+    response = client.post('/api/reservations', json={
+        'vehicle_id': user.vehicle_id, 'slot_id': slot_id, 'start': start.isoformat(), 'end': end.isoformat(),
+    })
+    assert response.status_code == 200, response.get_json()
+
+    other = make_user(app)
+    refused, = post_batch(device, [{'type': 'entry', 'vehicle_id': other.vehicle_id, 'slot_id': slot_id}])
+    assert not refused['success']
+    assert refused['message'] == 'Parking slot is reserved'
+    assert open_records(app, other.vehicle_id) == 0
+
+    # The booking's own vehicle may take it
+    own, = post_batch(device, [{'type': 'entry', 'vehicle_id': user.vehicle_id, 'slot_id': slot_id}])
+    assert own['success'], own
+
+
+def test_replayed_batch_does_not_park_or_exit_twice(app, client, device):
+    driver = make_user(app)
+    slot_id = free_slot_id(client)
+    entry = [{'type': 'entry', 'vehicle_id': driver.vehicle_id, 'slot_id': slot_id,
+              'timestamp': (datetime.utcnow() - timedelta(hours=1)).isoformat()}]
+
+    first, = post_batch(device, entry)
+    assert first['success'], first
+    replayed, = post_batch(device, entry)
+    assert not replayed['success']
+    assert replayed['message'] == 'Parking slot is already occupied'
+    assert open_records(app, driver.vehicle_id) == 1
+
+    exit_event = [{'type': 'exit', 'record_id': first['record_id'], 'timestamp': datetime.utcnow().isoformat()}]
+    left, = post_batch(device, exit_event)
+    assert left['success'] and left['fee'] == 2.0
+    replayed, = post_batch(device, exit_event)
+    assert not replayed['success']
+    assert replayed['message'] == 'Vehicle has already exited'
+    assert open_records(app, driver.vehicle_id) == 0
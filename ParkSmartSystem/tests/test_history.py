@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from conftest import free_slot_id
+from extensions import db
+from models import ArchivedParkingRecord, ParkingRecord
+
+
+def add_history(app, user, slot_id):
+    """Completed hot and archived records, with entry time ties, and one open record"""
+    base = datetime(2024, 1, 1, 8, 0)
+    with app.app_context():
+        hot = [ParkingRecord(user_id=user.id, vehicle_id=user.vehicle_id, slot_id=slot_id,
+                             entry_time=base + timedelta(hours=hours), exit_time=base + timedelta(hours=hours + 1),
+                             fee=2.0, status='completed')
+               for hours in (0, 0, 0, 5, 5, 9, 12, 12)]
+        db.session.add_all(hot)
+        db.session.add(ParkingRecord(user_id=user.id, vehicle_id=user.vehicle_id, slot_id=slot_id,
+                                     entry_time=base + timedelta(days=1)))
+        archived = [ArchivedParkingRecord(id=900000 + user.id * 10 + number, user_id=user.id,
+                                          vehicle_id=user.vehicle_id, slot_id=slot_id,
+                                          entry_time=base + timedelta(hours=hours),
+                                          exit_time=base + timedelta(hours=hours + 1), fee=2.0, status='completed')
+                    for number, hours in enumerate((-3, 5, 7))]
+        db.session.add_all(archived)
+        db.session.commit()
+        rows = [(record.entry_time, record.id) for record in hot + archived]
+        hot_ids = {record.id for record in hot}
+        db.session.remove()
+    expected = [record_id for _, record_id in sorted(rows, reverse=True)]
+    return expected, hot_ids
+
+
+def all_pages(client, limit, **params):
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = dict(params, limit=limit)
+        if cursor:
+            query['before'] = cursor
+        body = client.get('/api/parking-history', query_string=query).get_json()
+        assert len(body['records']) <= limit
+        ids += [record['id'] for record in body['records']]
+        pages += 1
+        cursor = body['next_cursor']
+        if cursor is None:
+            return ids, pages
+
+
+def test_keyset_pages_cover_the_history_once_in_order(client, app, user):
+    expected, hot_ids = add_history(app, user, free_slot_id(client))
+
+    for limit in (1, 2, 3, 4, 100):
+        ids, pages = all_pages(client, limit)
+        assert ids == [record_id for record_id in expected if record_id in hot_ids]
+        assert pages == max(1, -(-len(hot_ids) // limit))
+
+        ids, _ = all_pages(client, limit, archived=1)
+        assert ids == expected
+
+
+def test_invalid_limit_and_cursor(client):
+    assert client.get('/api/parking-history?limit=x').status_code == 400
+    body = client.get('/api/parking-history', query_string={'before': 'not-a-cursor'}).get_json()
+    assert body['next_cursor'] is None
@@ -0,0 +1,48 @@
+import os
+
+from conftest import free_slot_id
+from extensions import db
+from journal import CHECKPOINT_NAME, GateJournal
+from models import JournalCheckpoint, ParkingRecord, ParkingSlot
+
+
+def open_journal(app, monkeypatch, path):
+    monkeypatch.setitem(app.config, 'GATE_JOURNAL', str(path))
+    journal = GateJournal()
+    journal.init_app(app)
+    return journal
+
+
+def test_replays_acknowledged_events_after_a_crash(app, client, user, tmp_path, monkeypatch, caplog):
+    path = tmp_path / 'gate.journal'
+    slot_id = free_slot_id(client)
+
+    # The process dies after acknowledging the events, before the applier wrote any of them
+    monkeypatch.setattr(GateJournal, '_run_applier', lambda self: None)
+    crashed = open_journal(app, monkeypatch, path)
+    with app.app_context():
+        first_id, _ = crashed.entry(user.id, user.vehicle_id, slot_id, 'Indoor')
+        crashed.exit(user.id, first_id)
+        second_id, _ = crashed.entry(user.id, user.vehicle_id, slot_id, 'Indoor')
+        assert db.session.get(ParkingRecord, first_id) is None
+    os.close(crashed._fd)
+    # Half of a line that was never acknowledged
+    with open(path, 'ab') as journal_file:
+        journal_file.write(b'{"type":"exit","record_id":')
+    monkeypatch.undo()
+
+    journal = open_journal(app, monkeypatch, path)
+    with app.app_context():
+        # Opening the journal replays it; the open record is known again
+        journal.exit(user.id, second_id)
+        journal.close()
+        assert 'Replaying 3 gate events' in caplog.text
+
+        first = db.session.get(ParkingRecord, first_id)
+        second = db.session.get(ParkingRecord, second_id)
+        assert first.exit_time is not None and first.user_id == user.id
+        assert second.exit_time is not None and second.slot_id == slot_id
+        assert not db.session.get(ParkingSlot, slot_id).is_occupied
+        assert db.session.get(JournalCheckpoint, CHECKPOINT_NAME).sequence == 4
+        db.session.remove()
+    assert path.read_bytes().endswith(b'\n')
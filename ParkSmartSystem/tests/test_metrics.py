@@ -0,0 +1,47 @@
+from flask import Flask
+
+from metrics import init_metrics
+
+
+def metrics_app(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    init_metrics(app)
+    return app.test_client()
+
+
+def get(client, path, address='10.1.2.3', token=None):
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    return client.get(path, headers=headers, environ_base={'REMOTE_ADDR': address})
+
+
+def test_metrics_are_not_served_until_configured():
+    client = metrics_app()
+    assert get(client, '/metrics', address='127.0.0.1').status_code == 403
+
+
+def test_metrics_are_only_served_to_allowed_addresses_and_the_token():
+    client = metrics_app(METRICS_TOKEN='scrape-me', METRICS_ALLOWED_ADDRESSES=('127.0.0.1',))
+    assert get(client, '/metrics', address='127.0.0.1').status_code == 200
+    assert get(client, '/metrics').status_code == 403
+    assert get(client, '/metrics', token='wrong').status_code == 403
+
+    response = get(client, '/metrics', token='scrape-me')
+    assert response.status_code == 200
+    assert 'parksmart_http_requests_total' in response.get_data(as_text=True)
+
+
+def test_no_token_means_no_remote_scrapes():
+    client = metrics_app(METRICS_ALLOWED_ADDRESSES=('10.1.2.3',))
+    assert get(client, '/metrics').status_code == 200
+    assert get(client, '/metrics', address='10.9.9.9', token='None').status_code == 403
+
+
+def test_slow_query_samples_are_off_unless_enabled():
+    assert get(metrics_app(METRICS_TOKEN='scrape-me'), '/metrics/slow-queries', token='scrape-me').status_code == 404
+
+    client = metrics_app(SLOW_QUERY_SAMPLES=True, METRICS_TOKEN='scrape-me')
+    assert get(client, '/metrics/slow-queries').status_code == 403
+    response = get(client, '/metrics/slow-queries', token='scrape-me')
+    assert response.status_code == 200
+    assert set(response.get_json()) == {'threshold_seconds', 'samples'}
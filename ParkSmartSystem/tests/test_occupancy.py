@@ -0,0 +1,79 @@
+import uuid
+
+from sqlalchemy import update
+
+import occupancy
+from extensions import db
+from models import ParkingSlot
+from occupancy import OccupancyIndex
+from utils import claim_slot, release_slot
+
+
+def add_slots(app, count):
+    tag = uuid.uuid4().hex[:6]
+    with app.app_context():
+        slots = [ParkingSlot(slot_number=f'S{tag}{i}', location=f'sync-{tag}', area='Sync', is_occupied=False)
+                 for i in range(count)]
+        db.session.add_all(slots)
+        db.session.commit()
+        slot_ids = [slot.id for slot in slots]
+        db.session.remove()
+    return slot_ids
+
+
+def another_worker(app, change):
+    # Committed without staging, so only sync() can find out
+    with app.app_context():
+        change()
+        db.session.commit()
+        db.session.remove()
+
+
+def later(monkeypatch, seconds):
+    now = occupancy.time.monotonic()
+    monkeypatch.setattr(occupancy.time, 'monotonic', lambda: now + seconds)
+
+
+def test_sync_picks_up_other_workers_changes(app, monkeypatch):
+    first, second = add_slots(app, 2)
+    with app.app_context():
+        index = OccupancyIndex()
+        index.warm()
+        another_worker(app, lambda: claim_slot(first) and claim_slot(second))
+
+        # Not due yet
+        index.sync()
+        assert not index.is_occupied(first)
+
+        later(monkeypatch, occupancy.OCCUPANCY_SYNC_SECONDS + 1)
+        index.sync()
+        assert index.is_occupied(first) and index.is_occupied(second)
+
+        another_worker(app, lambda: release_slot(first))
+        later(monkeypatch, 2 * occupancy.OCCUPANCY_SYNC_SECONDS + 2)
+        index.sync()
+        assert not index.is_occupied(first) and index.is_occupied(second)
+
+
+def test_sync_only_reads_recently_changed_slots_until_a_full_sync(app, monkeypatch):
+    slot_id, = add_slots(app, 1)
+    with app.app_context():
+        index = OccupancyIndex()
+        index.warm()
+        # A write that doesn't stamp occupancy_changed_at is invisible to incremental syncs
+        another_worker(app, lambda: db.session.execute(
+            update(ParkingSlot).where(ParkingSlot.id == slot_id).values(is_occupied=True)
+        ))
+        stale = ParkingSlot.__table__.c.occupancy_changed_at
+        another_worker(app, lambda: db.session.execute(
+            update(ParkingSlot.__table__).where(ParkingSlot.id == slot_id)
+            .values({stale: index._watermark - 2 * occupancy.OCCUPANCY_SYNC_OVERLAP})
+        ))
+
+        later(monkeypatch, occupancy.OCCUPANCY_SYNC_SECONDS + 1)
+        index.sync()
+        assert not index.is_occupied(slot_id)
+
+        later(monkeypatch, occupancy.OCCUPANCY_FULL_SYNC_SECONDS + 1)
+        index.sync()
+        assert index.is_occupied(slot_id)
@@ -0,0 +1,91 @@
+from sqlalchemy import insert
+
+import plates
+from conftest import make_user
+from extensions import db
+from models import Vehicle, normalize_plate
+from plates import PlateLookup, backfill_plate_keys
+
+
+def register(app, user, plate):
+    # Written directly, as another worker's add_vehicle would
+    with app.app_context():
+        db.session.add(Vehicle(license_plate=plate, user_id=user.id))
+        db.session.commit()
+        db.session.remove()
+
+
+def test_plate_registered_by_another_worker_is_found_once_the_miss_expires(app, monkeypatch):
+    user = make_user(app)
+    lookup = PlateLookup()
+    plate = f'ZQ{user.id:05d}M'
+    with app.app_context():
+        assert lookup.lookup(plate) is None
+        register(app, user, plate)
+        assert lookup.lookup(plate) is None
+
+        now = plates.time.monotonic()
+        monkeypatch.setattr(plates.time, 'monotonic', lambda: now + plates.MISS_TTL + 1)
+        vehicle = lookup.lookup(plate)
+        assert vehicle is not None and vehicle.user_id == user.id
+
+
+def test_fuzzy_keys_pick_up_plates_registered_by_another_worker(app, monkeypatch):
+    user = make_user(app)
+    lookup = PlateLookup()
+    plate = f'ZR{user.id:05d}N'
+    with app.app_context():
+        assert lookup.fuzzy_matches(plate[:-1]) == []
+        register(app, user, plate)
+
+        now = plates.time.monotonic()
+        monkeypatch.setattr(plates.time, 'monotonic', lambda: now + plates.KEYS_SYNC_SECONDS + 1)
+        assert lookup.fuzzy_matches(plate[:-1]) == [plate]
+        assert lookup.lookup(plate[:-1] + 'X', fuzzy=True).license_plate == plate
+
+
+def test_normalize_plate():
+    assert normalize_plate('ab-12 cd') == 'AB12CD'
+    assert normalize_plate(' tn.56/tg 0987 ') == 'TN56TG0987'
+    assert normalize_plate(None) == ''
+
+
+def test_plate_key_follows_license_plate():
+    vehicle = Vehicle(license_plate='ab-12 cd')
+    assert vehicle.plate_key == 'AB12CD'
+    vehicle.license_plate = 'xy 34'
+    assert vehicle.plate_key == 'XY34'
+
+
+def test_backfill_fills_missing_keys_and_leaves_duplicates_unmatched(app):
+    user = make_user(app)
+    first, duplicate = f'zt-{user.id:05d}', f'ZT {user.id:05d}'
+    with app.app_context():
+        # Rows from before the column, written without the ORM's validator
+        db.session.execute(insert(Vehicle), [{'license_plate': plate, 'user_id': user.id, 'plate_key': None}
+                                             for plate in (first, duplicate)])
+        db.session.commit()
+        backfill_plate_keys()
+        keys = dict(db.session.query(Vehicle.license_plate, Vehicle.plate_key)
+                    .filter(Vehicle.license_plate.in_([first, duplicate])))
+        duplicate_id = db.session.query(Vehicle.id).filter_by(license_plate=duplicate).scalar()
+        db.session.remove()
+    assert keys == {first: f'ZT{user.id:05d}', duplicate: f'#{duplicate_id}'}
+
+
+def test_fuzzy_match_within_one_edit(app):
+    user = make_user(app)
+    base = f'ZU{user.id:05d}'
+    for suffix in ('A', 'B', 'PQR'):
+        register(app, user, base + suffix)
+    lookup = PlateLookup()
+    with app.app_context():
+        # One wrong, missing or extra character
+        for misread in ('PXR', 'PR', 'PQRS'):
+            assert lookup.fuzzy_matches(base + misread) == [base + 'PQR']
+        assert lookup.lookup(base + 'PXR', fuzzy=True).license_plate == base + 'PQR'
+        assert lookup.lookup(base + 'PXR') is None
+
+        # ...E is one edit from both ...A and ...B: too ambiguous to trust
+        assert lookup.fuzzy_matches(base + 'E') == [base + 'A', base + 'B']
+        assert lookup.lookup(base + 'E', fuzzy=True) is None
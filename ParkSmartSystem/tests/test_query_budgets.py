@@ -0,0 +1,25 @@
+import pytest
+
+from conftest import park
+from query_stats import DEFAULT_QUERY_BUDGETS, count_queries
+
+PAGES = {
+    'views.dashboard': '/dashboard',
+    'views.indoor_parking': '/indoor-parking',
+    'views.outdoor_parking': '/outdoor-parking',
+    'views.digital_card': '/digital-card',
+}
+
+
+def test_every_budgeted_page_is_covered():
+    assert set(PAGES) == set(DEFAULT_QUERY_BUDGETS)
+
+
+@pytest.mark.parametrize('endpoint', sorted(DEFAULT_QUERY_BUDGETS))
+def test_page_within_query_budget(app, client, user, endpoint):
+    # An active parking, so the dashboard and digital card have records to show
+    park(client, user)
+    with count_queries() as queries:
+        response = client.get(PAGES[endpoint])
+    assert response.status_code == 200
+    assert queries.count <= DEFAULT_QUERY_BUDGETS[endpoint], queries.statements
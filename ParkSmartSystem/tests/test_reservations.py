@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import login, make_user, park
+from extensions import db
+from models import Reservation
+from reservations import ReservationConflict, book_slot
+
+
+def window(days, hours=2):
+    start = (datetime.utcnow() + timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+    return start, start + timedelta(hours=hours)
+
+
+def reserve(client, user, slot_id, start, end):
+    return client.post('/api/reservations', json={
+        'vehicle_id': user.vehicle_id, 'slot_id': slot_id, 'start': start.isoformat(), 'end': end.isoformat(),
+    })
+
+
+@pytest.fixture
+def slot_id(client):
+    """A slot nobody has booked"""
+    start, end = window(1, hours=24 * 6)
+    response = client.get('/api/reservations/availability', query_string={
+        'start': start.isoformat(), 'end': end.isoformat(), 'location': 'indoor',
+    })
+    return response.get_json()['slots'][-1]['id']
+
+
+def test_overlapping_booking_of_another_user_conflicts(app, client, user, slot_id):
+    start, end = window(2)
+    assert reserve(client, user, slot_id, start, end).status_code == 200
+
+    other = make_user(app)
+    other_client = login(app, other)
+    for other_start, other_end in [(start, end), (start - timedelta(hours=1), start + timedelta(minutes=1)),
+                                   (end - timedelta(minutes=1), end + timedelta(hours=1))]:
+        response = reserve(other_client, other, slot_id, other_start, other_end)
+        assert response.status_code == 409, (other_start, other_end)
+        assert response.get_json()['message'] == 'Parking slot is already booked for that time'
+
+    # Windows are half-open, so back-to-back bookings don't clash
+    assert reserve(other_client, other, slot_id, end, end + timedelta(hours=1)).status_code == 200
+    assert reserve(other_client, other, slot_id, start - timedelta(hours=1), start).status_code == 200
+
+
+def test_cancelled_booking_frees_the_window(app, client, user, slot_id):
+    start, end = window(3)
+    reservation_id = reserve(client, user, slot_id, start, end).get_json()['reservation']['id']
+    other = make_user(app)
+    other_client = login(app, other)
+    assert reserve(other_client, other, slot_id, start, end).status_code == 409
+
+    # Only the owner can cancel it
+    assert other_client.post(f'/api/reservations/{reservation_id}/cancel').status_code == 404
+    assert client.post(f'/api/reservations/{reservation_id}/cancel').status_code == 200
+    assert reserve(other_client, other, slot_id, start, end).status_code == 200
+
+
+def test_booking_missing_from_the_index_still_conflicts(app, user, slot_id):
+    # As if another worker booked the slot after this one's index last synced
+    start, end = window(4)
+    with app.app_context():
+        db.session.add(Reservation(user_id=user.id, vehicle_id=user.vehicle_id, slot_id=slot_id,
+                                   start_time=start, end_time=end))
+        db.session.commit()
+        with pytest.raises(ReservationConflict):
+            book_slot(user.id, user.vehicle_id, slot_id, start + timedelta(hours=1), end + timedelta(hours=1))
+        db.session.rollback()
+        db.session.remove()
+
+
+def test_occupied_slot_only_conflicts_for_windows_starting_soon(app, client, user):
+    slot_id = park(client, user)['slot_id']
+    now = datetime.utcnow()
+    assert reserve(client, user, slot_id, now + timedelta(minutes=30), now + timedelta(hours=1)).status_code == 409
+    assert reserve(client, user, slot_id, *window(5)).status_code == 200
@@ -0,0 +1,96 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import make_user
+from extensions import db
+from models import ArchivedParkingRecord, ParkingRecord, ParkingSlot
+from rollups import add_stay, get_occupancy_report, rebuild_rollups, refresh_rollups
+
+DAY = datetime(2019, 3, 4)
+
+
+def test_add_stay_spreads_a_stay_over_its_hours():
+    deltas = {}
+    add_stay(deltas, DAY.replace(hour=8, minute=30), DAY.replace(hour=10, minute=15), 6.0, None)
+    assert deltas == {
+        (DAY.replace(hour=8), 'Unknown'): [1, 0, 30.0, 0.0, 0.0],
+        (DAY.replace(hour=9), 'Unknown'): [0, 0, 60.0, 0.0, 0.0],
+        (DAY.replace(hour=10), 'Unknown'): [0, 1, 15.0, 105.0, 6.0],
+    }
+
+
+@pytest.fixture
+def area_stays(app):
+    """An area of its own with two completed stays and an open one on DAY"""
+    user = make_user(app)
+    area = f'Rollups {uuid.uuid4().hex[:6]}'
+    with app.app_context():
+        slot = ParkingSlot(slot_number=f'R{user.id}', location='rollups', area=area, is_occupied=False)
+        db.session.add(slot)
+        db.session.flush()
+        for start, minutes, fee in ((DAY.replace(hour=8, minute=30), 105, 6.0),
+                                    (DAY.replace(hour=9), 60, 2.0), (DAY.replace(hour=11), None, 0.0)):
+            db.session.add(ParkingRecord(user_id=user.id, vehicle_id=user.vehicle_id, slot_id=slot.id,
+                                         entry_time=start, fee=fee,
+                                         exit_time=start + timedelta(minutes=minutes) if minutes else None))
+        db.session.commit()
+        slot_id = slot.id
+        db.session.remove()
+    return user, area, slot_id
+
+
+def report(area):
+    return {row['period']: (row['entries'], row['exits'], row['average_dwell_minutes'], row['revenue'])
+            for row in get_occupancy_report(DAY, DAY + timedelta(days=1), area)}
+
+
+def roll_up(area):
+    # The background refresher may be folding the same records; go on until none are pending
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        refresh_rollups()
+        pending = ParkingRecord.query.join(ParkingSlot).filter(
+            ParkingSlot.area == area, ParkingRecord.rolled_up.is_(False), ParkingRecord.exit_time.isnot(None)
+        ).count()
+        if not pending:
+            return
+        time.sleep(0.05)
+    raise AssertionError('Records still pending')
+
+
+def test_refresh_rolls_each_stay_up_once(app, area_stays):
+    _, area, _ = area_stays
+    with app.app_context():
+        roll_up(area)
+        expected = {
+            DAY.replace(hour=8).isoformat(): (1, 0, None, 0.0),
+            DAY.replace(hour=9).isoformat(): (1, 0, None, 0.0),
+            DAY.replace(hour=10).isoformat(): (0, 2, 82.5, 8.0),
+        }
+        assert report(area) == expected
+
+        # Nothing is pending, so refreshing again changes nothing
+        refresh_rollups()
+        assert report(area) == expected
+        db.session.remove()
+
+
+def test_rebuild_matches_the_incremental_rollups_and_adds_the_archive(app, area_stays):
+    user, area, slot_id = area_stays
+    with app.app_context():
+        roll_up(area)
+        incremental = report(area)
+
+        rebuild_rollups()
+        assert report(area) == incremental
+
+        db.session.add(ArchivedParkingRecord(id=700000 + user.id, user_id=user.id, vehicle_id=user.vehicle_id,
+                                             slot_id=slot_id, entry_time=DAY.replace(hour=10),
+                                             exit_time=DAY.replace(hour=10, minute=30), fee=2.0))
+        db.session.commit()
+        rebuild_rollups()
+        assert report(area)[DAY.replace(hour=10).isoformat()] == (1, 3, 65.0, 10.0)
+        db.session.remove()
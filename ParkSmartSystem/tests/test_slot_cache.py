@@ -0,0 +1,36 @@
+from conftest import park
+
+
+def slots(client, **params):
+    return client.get('/api/parking-slots', query_string=dict(location='indoor', **params))
+
+
+def test_unchanged_slot_list_is_not_modified(client):
+    first = slots(client)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.strip('"') == first.headers['X-Occupancy-Version']
+
+    cached = client.get('/api/parking-slots?location=indoor', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.get_data() == b''
+
+
+def test_a_change_invalidates_the_etag_and_since_returns_only_it(client, user):
+    before = slots(client)
+    version = before.headers['X-Occupancy-Version']
+    slot_id = park(client, user)['slot_id']
+
+    after = client.get('/api/parking-slots?location=indoor', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200
+    assert after.headers['ETag'] != before.headers['ETag']
+    assert next(slot for slot in after.get_json() if slot['id'] == slot_id)['is_occupied']
+
+    delta = slots(client, since=version)
+    assert delta.status_code == 200
+    assert 'ETag' not in delta.headers
+    assert [(slot['id'], slot['is_occupied']) for slot in delta.get_json()] == [(slot_id, True)]
+
+    # Nothing changed since the latest version, and an unknown version gets everything
+    assert slots(client, since=delta.headers['X-Occupancy-Version']).get_json() == []
+    assert len(slots(client, since='stale-3').get_json()) == len(before.get_json())
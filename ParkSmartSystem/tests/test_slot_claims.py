@@ -0,0 +1,75 @@
+import threading
+from collections import Counter
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from conftest import make_user
+from extensions import db
+from models import ParkingRecord, ParkingSlot, Vehicle
+from utils import claim_slot
+
+GATES = 16
+SLOTS = 4
+
+
+def test_concurrent_claims_never_double_book(app):
+    user = make_user(app)
+    with app.app_context():
+        vehicles = [Vehicle(license_plate=f'CLAIM{user.id}-{i}', user_id=user.id) for i in range(GATES)]
+        # Slots of a location of their own, so other tests don't pick them
+        slots = [ParkingSlot(slot_number=f'C{user.id}-{i}', location='claims', area='Claims', is_occupied=False)
+                 for i in range(SLOTS)]
+        db.session.add_all(vehicles + slots)
+        db.session.commit()
+        vehicle_ids = [vehicle.id for vehicle in vehicles]
+        slot_ids = [slot.id for slot in slots]
+        db.session.remove()
+
+    start = threading.Barrier(GATES)
+    claims = Counter()
+    errors = []
+    lock = threading.Lock()
+
+    def gate(vehicle_id):
+        # Every gate tries every slot in the same order until it parks, so all of them collide
+        with app.app_context():
+            try:
+                start.wait()
+                for slot_id in slot_ids:
+                    while True:
+                        try:
+                            claimed = claim_slot(slot_id)
+                            if claimed:
+                                db.session.add(ParkingRecord(user_id=user.id, vehicle_id=vehicle_id,
+                                                             slot_id=slot_id, parking_type='Indoor'))
+                            db.session.commit()
+                            break
+                        except OperationalError:
+                            # SQLite busy beyond its timeout; nothing was written
+                            db.session.rollback()
+                    if claimed:
+                        with lock:
+                            claims[slot_id] += 1
+                        return
+            except Exception as error:
+                errors.append(error)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=gate, args=(vehicle_id,)) for vehicle_id in vehicle_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert sum(claims.values()) == SLOTS
+    assert all(count == 1 for count in claims.values())
+    with app.app_context():
+        open_records = dict(db.session.query(ParkingRecord.slot_id, func.count())
+                            .filter(ParkingRecord.slot_id.in_(slot_ids), ParkingRecord.exit_time.is_(None))
+                            .group_by(ParkingRecord.slot_id))
+        assert open_records == {slot_id: 1 for slot_id in slot_ids}
+        assert all(db.session.get(ParkingSlot, slot_id).is_occupied for slot_id in slot_ids)
+        db.session.remove()
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from occupancy import SlotInfo
+from spatial import GridIndex, SpatialSlotIndex, haversine
+
+
+def brute_force(points, lat, lng, k):
+    distances = sorted((haversine(lat, lng, p_lat, p_lng), key) for key, (p_lat, p_lng) in points.items())
+    return distances[:k]
+
+
+@pytest.mark.parametrize('cell_size', [0.0005, 0.003])
+def test_nearest_matches_brute_force_haversine(cell_size):
+    rng = random.Random(11)
+    grid, points = GridIndex(cell_size), {}
+    for key in range(2000):
+        points[key] = (17.44 + rng.uniform(-0.02, 0.02), 78.38 + rng.uniform(-0.02, 0.02))
+        grid.insert(key, *points[key])
+    for key in rng.sample(sorted(points), 500):
+        grid.remove(key)
+        del points[key]
+    assert len(grid) == len(points)
+
+    # Queries inside the lot, at its edge, and far away, which ends in a flat scan
+    queries = [(17.44 + rng.uniform(-0.025, 0.025), 78.38 + rng.uniform(-0.025, 0.025)) for _ in range(50)]
+    queries += [(17.5, 78.5), (-33.9, 151.2)]
+    for lat, lng in queries:
+        for k in (1, 5, 40):
+            found = [(distance, key) for distance, key, _ in grid.nearest(lat, lng, k)]
+            expected = brute_force(points, lat, lng, k)
+            assert [key for _, key in found] == [key for _, key in expected]
+            assert [distance for distance, _ in found] == pytest.approx([distance for distance, _ in expected])
+
+
+def test_nearest_of_an_empty_grid_or_zero_k():
+    grid = GridIndex()
+    assert grid.nearest(17.44, 78.38, 3) == []
+    grid.insert(1, 17.44, 78.38)
+    assert grid.nearest(17.44, 78.38, 0) == []
+
+
+class FakeIndex:
+    def __init__(self, slots):
+        self.slots = slots
+
+    def free_slots(self, location):
+        return [slot for slot in self.slots if slot.location == location]
+
+
+def test_slot_index_follows_occupancy_changes():
+    slots = [SlotInfo(1, 'O01', 'outdoor', 'Lot A', 17.4400, 78.3800),
+             SlotInfo(2, 'O02', 'outdoor', 'Lot A', 17.4410, 78.3800),
+             SlotInfo(3, 'O03', 'outdoor', 'Lot A', None, None),
+             SlotInfo(4, 'I01', 'indoor', 'Level 1', 17.4400, 78.3800)]
+    index = SpatialSlotIndex('outdoor')
+    index.rebuild(FakeIndex(slots))
+    assert [slot.id for slot, _ in index.nearest(17.4400, 78.3800, 5)] == [1, 2]
+
+    index.on_occupancy_change(slots[0], True)
+    (slot, distance), = index.nearest(17.4400, 78.3800)
+    assert slot.id == 2 and distance == pytest.approx(haversine(17.44, 78.38, 17.441, 78.38))
+
+    index.on_occupancy_change(slots[0], False)
+    index.on_occupancy_change(slots[3], True)
+    assert index.nearest(17.4400, 78.3800)[0][0].id == 1
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from tariffs import Tariff, TariffRegistry, to_epoch_minutes
+
+
+INDOOR = {
+    'bands': [(0, 7, 1.0), (7, 19, 3.0), (19, 24, 1.5)],
+    'daily_cap': 25.0,
+    'grace_minutes': 10,
+    'minimum_fee': 2.0,
+}
+
+STAYS = [
+    # Grace period and minimum charge
+    (datetime(2024, 3, 1, 9, 0), timedelta(minutes=5)),
+    (datetime(2024, 3, 1, 9, 0), timedelta(minutes=10)),
+    (datetime(2024, 3, 1, 9, 0), timedelta(minutes=11)),
+    (datetime(2024, 3, 1, 2, 0), timedelta(minutes=40)),
+    # Across band changes and midnight
+    (datetime(2024, 3, 1, 18, 30), timedelta(hours=1)),
+    (datetime(2024, 3, 1, 23, 15), timedelta(hours=2, minutes=30)),
+    (datetime(2024, 3, 1, 22, 0), timedelta(hours=10, seconds=30)),
+    # Over several days, with the daily cap
+    (datetime(2024, 3, 1, 8, 0), timedelta(days=1)),
+    (datetime(2024, 3, 1, 20, 45), timedelta(days=1, hours=13)),
+    (datetime(2024, 3, 1, 6, 10), timedelta(days=3, hours=2, minutes=5)),
+]
+
+
+def batch(tariff, stays):
+    entries = [entry for entry, _ in stays]
+    exits = [entry + duration for entry, duration in stays]
+    return list(tariff.batch_fees(to_epoch_minutes(entries), to_epoch_minutes(exits)))
+
+
+@pytest.mark.parametrize('config', [INDOOR, {'rate': 2.0, 'minimum_fee': 2.0},
+                                    dict(INDOOR, utc_offset_minutes=-300)])
+def test_scalar_and_batch_fees_agree(config):
+    tariff = Tariff.from_config('test', config)
+    scalar = [tariff.fee(entry, entry + duration) for entry, duration in STAYS]
+    assert batch(tariff, STAYS) == pytest.approx(scalar, abs=0.005)
+
+
+def test_indoor_tariff_charges_bands_grace_minimum_and_cap():
+    tariff = Tariff.from_config('indoor', INDOOR)
+    fees = [tariff.fee(entry, entry + duration) for entry, duration in STAYS]
+    assert fees[:4] == [0.0, 0.0, 2.0, 2.0]
+    assert fees[4] == 2.25
+    assert fees[5] == pytest.approx(0.75 * 1.5 + 1.75 * 1.0, abs=0.01)
+    assert fees[7] == 25.0
+    assert fees[9] == round(3 * 25.0 + 50 / 60 + 75 / 60 * 3.0, 2)
+
+
+def test_default_tariff_is_two_dollars_an_hour_with_one_hour_minimum():
+    standard = TariffRegistry().get('standard')
+    entry = datetime(2024, 3, 1, 23, 30)
+    durations = [timedelta(minutes=1), timedelta(minutes=30), timedelta(hours=1),
+                 timedelta(hours=3), timedelta(hours=2, minutes=15), timedelta(days=2)]
+    expected = [2.0, 2.0, 2.0, 6.0, 4.5, 96.0]
+    assert [standard.fee(entry, entry + duration) for duration in durations] == expected
+    assert batch(standard, [(entry, duration) for duration in durations]) == pytest.approx(expected)
+
+
+def test_vip_tariff_only_applies_in_configured_areas():
+    config = {'vip': {'rate': 5.0, 'minimum_fee': 5.0}}
+    assert TariffRegistry(config).resolve('Standard', 'VIP Section') == 'standard'
+
+    registry = TariffRegistry(config, vip_areas=['Level 1'])
+    assert registry.resolve('Standard', 'Level 1') == 'vip'
+    assert registry.resolve('Standard', 'Level 2') == 'standard'
+    assert registry.is_vip_area('Level 1') and not registry.is_vip_area('Level 2')
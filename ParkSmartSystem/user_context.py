@@ -0,0 +1,119 @@
+"""
+Cached user and vehicle context for the Car Parking System.
+
+Every authenticated request loads the user, and most pages list the user's
+vehicles. Both rarely change, so they are kept as plain tuples in a small
+per-process cache with a short TTL, and in flask.g for the rest of the
+request.
+
+Adding a vehicle invalidates the local cache and bumps a version number
+in the user's session cookie. Other worker processes see a newer version
+on that user's next request and reload the list instead of serving a
+stale one. Other browsers of the same user may see the old list until
+the TTL expires.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import g, has_request_context, session
+from flask_login import UserMixin
+
+from models import User, Vehicle, db
+from plates import VehicleInfo
+
+CONTEXT_TTL = 60
+_VERSION_KEY = 'vehicles_version'
+
+
+class SessionUser(UserMixin, namedtuple('SessionUser', ['id', 'username', 'email'])):
+    """Read-only stand-in for User as current_user"""
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize=10000, ttl=CONTEXT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = TTLCache()
+vehicle_cache = TTLCache()
+
+
+def load_session_user(user_id):
+    """The user for Flask-Login's user_loader, or None if it no longer exists"""
+    user = user_cache.get(user_id)
+    if user is None:
+        row = db.session.query(User.id, User.username, User.email).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        user = SessionUser(*row)
+        user_cache.set(user_id, user)
+    return user
+
+
+def _session_version():
+    return session.get(_VERSION_KEY, 0) if has_request_context() else 0
+
+
+def get_user_vehicles(user_id):
+    """The user's vehicles as VehicleInfo tuples, oldest first"""
+    request_cache = g.setdefault('user_vehicles', {})
+    if user_id in request_cache:
+        return request_cache[user_id]
+
+    version = _session_version()
+    cached = vehicle_cache.get(user_id)
+    if cached is not None and cached[0] >= version:
+        vehicles = cached[1]
+    else:
+        vehicles = [VehicleInfo(*row) for row in db.session.query(
+            Vehicle.id, Vehicle.license_plate, Vehicle.make, Vehicle.model, Vehicle.color, Vehicle.user_id
+        ).filter(Vehicle.user_id == user_id).order_by(Vehicle.id)]
+        vehicle_cache.set(user_id, (version, vehicles))
+    request_cache[user_id] = vehicles
+    return vehicles
+
+
+def get_user_vehicle(user_id, vehicle_id):
+    """One of the user's vehicles, or None if it isn't theirs"""
+    try:
+        vehicle_id = int(vehicle_id)
+    except (TypeError, ValueError):
+        return None
+    return next((vehicle for vehicle in get_user_vehicles(user_id) if vehicle.id == vehicle_id), None)
+
+
+def invalidate_user_vehicles(user_id):
+    """Forget the user's vehicle list here and, via the session, in other workers"""
+    vehicle_cache.pop(user_id)
+    g.pop('user_vehicles', None)
+    if has_request_context():
+        session[_VERSION_KEY] = session.get(_VERSION_KEY, 0) + 1
@@ -1,47 +1,66 @@
 import random
 import logging
-from models import ParkingSlot, db
+from datetime import datetime
+from sqlalchemy import bindparam, update
+from archive import RECORD_MODELS
+from assignment import slot_assigner
+from models import ParkingSlot, ParkingRecord, db
+from occupancy import occupancy_index
+from reservations import reservation_index, WALK_IN_HORIZON
+from tariffs import tariff_registry, to_epoch_minutes
 
-def init_parking_slots():
-    """Initialize parking slots if they don't exist"""
+OUTDOOR_LOTS = [
+    ('North Lot', (40.7128, -74.0060)),  # Random coordinates
+    ('East Lot', (40.7138, -74.0050)),
+    ('West Lot', (40.7118, -74.0070)),
+]
+
+def init_parking_slots(indoor_levels=3, slots_per_level=10, outdoor_lots=3, slots_per_lot=15,
+                       occupied_ratio=0.3):
+    """Initialize the current facility's parking slots if it has none
+
+    The defaults create the demo car park; benchmarks and facility layouts
+    pass larger sizes. Slot numbers are unique within a facility.
+    """
     # Check if slots already exist
     if ParkingSlot.query.first():
         return
     
     logging.info("Initializing parking slots")
     
+    # Zero-padded so slot numbers stay unique with more than 99 slots per area
+    indoor_width = max(2, len(str(slots_per_level)))
+    outdoor_width = max(2, len(str(slots_per_lot)))
+    
     # Create indoor parking slots
-    indoor_areas = ['Level 1', 'Level 2', 'Level 3']
-    for area in indoor_areas:
-        area_code = area.replace(" ", "")  # Remove spaces: "Level 1" -> "Level1"
+    for level in range(1, indoor_levels + 1):
+        area = f"Level {level}"
         
-        for i in range(1, 11):  # 10 slots per level
+        for i in range(1, slots_per_level + 1):
             # Create unique slot numbers: L101, L102, L201, etc.
-            slot_number = f"{area_code[0]}{area_code[-1]}{i:02d}"
+            slot_number = f"L{level}{i:0{indoor_width}d}"
             
             # Create new slot object and add to session
             new_slot = ParkingSlot()
             new_slot.slot_number = slot_number
             new_slot.location = 'indoor'
             new_slot.area = area
-            new_slot.is_occupied = random.random() < 0.3  # 30% chance to be occupied
+            new_slot.is_occupied = random.random() < occupied_ratio
             db.session.add(new_slot)
     
-    # Create outdoor parking slots
-    outdoor_areas = ['North Lot', 'East Lot', 'West Lot']
-    base_coords = {
-        'North Lot': (40.7128, -74.0060),  # Random coordinates
-        'East Lot': (40.7138, -74.0050),
-        'West Lot': (40.7118, -74.0070)
-    }
-    
-    for area in outdoor_areas:
-        area_code = area.split()[0]  # "North Lot" -> "North"
-        base_lat, base_lng = base_coords[area]
+    # Create outdoor parking slots; lots beyond the named ones are numbered
+    for lot in range(outdoor_lots):
+        if lot < len(OUTDOOR_LOTS):
+            area, (base_lat, base_lng) = OUTDOOR_LOTS[lot]
+            area_code = area[0]  # "North Lot" -> "N"
+        else:
+            area = f"Lot {lot + 1}"
+            area_code = f"P{lot + 1}-"
+            base_lat, base_lng = 40.7128 + (lot // 3) * 0.01, -74.0060 + (lot % 3) * 0.01
         
-        for i in range(1, 16):  # 15 slots per lot
+        for i in range(1, slots_per_lot + 1):
             # Create unique slot numbers: N01, N02, E01, etc.
-            slot_number = f"{area_code[0]}{i:02d}"
+            slot_number = f"{area_code}{i:0{outdoor_width}d}"
             
             # Generate nearby coordinates
             lat = base_lat + (random.randint(-10, 10) / 1000)
@@ -52,8 +71,9 @@ def init_parking_slots():
             new_slot.slot_number = slot_number
             new_slot.location = 'outdoor'
             new_slot.area = area
-            new_slot.is_occupied = random.random() < 0.3  # 30% chance to be occupied
-            new_slot.coordinates = f"{lat},{lng}"
+            new_slot.is_occupied = random.random() < occupied_ratio
+            new_slot.latitude = lat
+            new_slot.longitude = lng
             db.session.add(new_slot)
     
     db.session.commit()
@@ -61,10 +81,93 @@ def init_parking_slots():
 
 def get_available_slots(location='indoor'):
     """Get available parking slots for a given location"""
-    return ParkingSlot.query.filter_by(location=location, is_occupied=False).all()
+    occupancy_index.sync()
+    return occupancy_index.free_slots(location)
+
+def pick_available_slot(location='indoor', area=None, vip=False):
+    """Pick an available parking slot with the configured assignment strategy, or None if full.
+
+    Slots booked by a reservation within the walk-in horizon are skipped.
+    """
+    occupancy_index.sync()
+    reservation_index.sync()
+    now = datetime.utcnow()
+    end = now + WALK_IN_HORIZON
+    return slot_assigner.assign(location, area, vip,
+                                accept=lambda slot_id: not reservation_index.conflicts(slot_id, now, end))
+
+def claim_slot(slot_id):
+    """Atomically mark a free slot as occupied.
+
+    Uses a conditional UPDATE so that only one of several concurrent callers
+    (threads or worker processes) can win the slot. Returns True if this
+    caller claimed it; the change is committed with the caller's transaction.
+    """
+    result = db.session.execute(
+        update(ParkingSlot)
+        .where(ParkingSlot.id == slot_id, ParkingSlot.is_occupied.isnot(True))
+        .values(is_occupied=True, occupancy_changed_at=datetime.utcnow())
+    )
+    return result.rowcount == 1
+
+def release_slot(slot_id):
+    """Atomically mark an occupied slot as free; returns True if it was occupied"""
+    result = db.session.execute(
+        update(ParkingSlot)
+        .where(ParkingSlot.id == slot_id, ParkingSlot.is_occupied.is_(True))
+        .values(is_occupied=False, occupancy_changed_at=datetime.utcnow())
+    )
+    return result.rowcount == 1
+
+def close_parking_record(record_id, exit_time):
+    """Atomically set the exit time of an open record; returns True if it was open"""
+    result = db.session.execute(
+        update(ParkingRecord)
+        .where(ParkingRecord.id == record_id, ParkingRecord.exit_time.is_(None))
+        .values(exit_time=exit_time)
+    )
+    return result.rowcount == 1
+
+def reprice_parking_records(start=None, end=None, chunk_size=50000):
+    """Recompute the fee of completed records that entered in [start, end).
+
+    Records are read in id order, one chunk at a time, priced with the
+    vectorized tariff evaluator and written back with one executemany UPDATE
+    per chunk, each chunk in a transaction of its own so gates aren't held
+    up behind the whole run; an interrupted run can simply be repeated.
+    Archived records are repriced too. Returns the number of records
+    repriced.
+    """
+    total = 0
+    for model in RECORD_MODELS:
+        query = db.session.query(
+            model.id, model.entry_time, model.exit_time, model.parking_type, ParkingSlot.area
+        ).outerjoin(ParkingSlot, model.slot_id == ParkingSlot.id).filter(
+            model.exit_time.isnot(None)
+        )
+        if start is not None:
+            query = query.filter(model.entry_time >= start)
+        if end is not None:
+            query = query.filter(model.entry_time < end)
+
+        table = model.__table__
+        statement = update(table).where(table.c.id == bindparam('b_id')).values(fee=bindparam('b_fee'))
 
-def calculate_parking_fee(duration_minutes):
-    """Calculate parking fee based on duration in minutes"""
-    # Simple fee calculation: $2 per hour, minimum 1 hour
-    hours = max(1, duration_minutes / 60)
-    return round(hours * 2, 2)
+        last_id = 0
+        while True:
+            chunk = query.filter(model.id > last_id).order_by(model.id).limit(chunk_size).all()
+            if not chunk:
+                break
+            fees = tariff_registry.batch_fees(
+                [tariff_registry.resolve(row.parking_type, row.area) for row in chunk],
+                to_epoch_minutes([row.entry_time for row in chunk]),
+                to_epoch_minutes([row.exit_time for row in chunk])
+            )
+            db.session.execute(statement, [
+                {'b_id': row.id, 'b_fee': float(fee)} for row, fee in zip(chunk, fees)
+            ])
+            db.session.commit()
+            total += len(chunk)
+            last_id = chunk[-1].id
+    logging.info(f"Repriced {total} parking records")
+    return total
@@ -0,0 +1,126 @@
+from flask import Blueprint, render_template, redirect, url_for, request, flash
+from flask_login import login_required, current_user
+
+from exit_tokens import exit_gate, qr_code_svg
+from extensions import db
+from models import Vehicle, ParkingSlot, normalize_plate
+from history import get_active_parkings, get_recent_history, get_history_page, encode_cursor
+from plates import plate_lookup
+from user_context import get_user_vehicles, invalidate_user_vehicles
+
+views_bp = Blueprint('views', __name__)
+
+
+@views_bp.route('/')
+def index():
+    return render_template('index.html')
+
+@views_bp.route('/dashboard')
+@login_required
+def dashboard():
+    # Get user's vehicles
+    vehicles = get_user_vehicles(current_user.id)
+    
+    # Get active parking records and the latest history, with vehicle and slot loaded
+    active_parkings = get_active_parkings(current_user.id)
+    parking_history = get_recent_history(current_user.id, limit=5)
+    
+    return render_template(
+        'dashboard.html', 
+        vehicles=vehicles, 
+        active_parkings=active_parkings,
+        history_records=parking_history
+    )
+
+@views_bp.route('/indoor-parking')
+@login_required
+def indoor_parking():
+    # Get all indoor parking slots
+    indoor_slots = ParkingSlot.query.filter_by(location='indoor').all()
+    
+    # Get user's vehicles
+    vehicles = get_user_vehicles(current_user.id)
+    
+    return render_template(
+        'indoor_parking.html', 
+        indoor_slots=indoor_slots,
+        vehicles=vehicles
+    )
+
+@views_bp.route('/outdoor-parking')
+@login_required
+def outdoor_parking():
+    # Get all outdoor parking slots
+    outdoor_slots = ParkingSlot.query.filter_by(location='outdoor').all()
+    
+    # Get user's vehicles
+    vehicles = get_user_vehicles(current_user.id)
+    
+    return render_template(
+        'outdoor_parking.html', 
+        outdoor_slots=outdoor_slots,
+        vehicles=vehicles
+    )
+
+@views_bp.route('/digital-card')
+@login_required
+def digital_card():
+    # Get user's vehicles
+    vehicles = get_user_vehicles(current_user.id)
+    
+    # Get active parkings and one page of history; archived records once the recent ones run out
+    active_parkings = get_active_parkings(current_user.id)
+    # Signed tokens the exit gates check without a database lookup
+    exit_tokens = {parking.id: exit_gate.issue(parking) for parking in active_parkings}
+    exit_codes = {record_id: qr_code_svg(token) for record_id, token in exit_tokens.items()}
+    archived = request.args.get('archived') == '1'
+    parking_history, next_cursor = get_history_page(current_user.id, request.args.get('before'), archived=archived)
+    archive_cursor = None
+    if not archived and next_cursor is None and parking_history:
+        archive_cursor = encode_cursor(parking_history[-1])
+    
+    return render_template(
+        'digital_card.html', 
+        vehicles=vehicles,
+        active_parkings=active_parkings,
+        exit_tokens=exit_tokens,
+        exit_codes=exit_codes,
+        parking_history=parking_history,
+        next_cursor=next_cursor,
+        archived=archived,
+        archive_cursor=archive_cursor
+    )
+
+@views_bp.route('/add-vehicle', methods=['POST'])
+@login_required
+def add_vehicle():
+    license_plate = request.form.get('license_plate')
+    make = request.form.get('make')
+    model = request.form.get('model')
+    color = request.form.get('color')
+    
+    # Check if vehicle already exists (plates are unique across all users)
+    existing_vehicle = Vehicle.query.filter_by(
+        plate_key=normalize_plate(license_plate)
+    ).first()
+    
+    if existing_vehicle:
+        flash('Vehicle with this license plate already registered', 'danger')
+        return redirect(url_for('views.dashboard'))
+    
+    # Create new vehicle
+    vehicle = Vehicle(
+        license_plate=license_plate,
+        make=make,
+        model=model,
+        color=color,
+        user_id=current_user.id
+    )
+    
+    db.session.add(vehicle)
+    db.session.commit()
+    plate_lookup.invalidate(license_plate)
+    invalidate_user_vehicles(current_user.id)
+    
+    flash('Vehicle added successfully', 'success')
+    return redirect(url_for('views.dashboard'))